@@ -1,12 +1,11 @@
 from typing import Optional
 
-from bottle import request, route, run, Response
+from bottle import HTTPResponse, request, route, run, Response
 import uvicorn
 
 from arnold import config
-from arnold.motion.drivetrain import DriveTrain
-from arnold.output.speaker import Speaker
-from arnold.sensors.camera import Camera
+from arnold.motion.drivetrain import DriveTrain, parse_route
+from arnold.utils import registry
 
 
 API_CONFIG = config.API
@@ -20,18 +19,46 @@ def health():
     return {'success': True}
 
 
+def get_drivetrain() -> DriveTrain:
+    return registry.get('motion.drivetrain.DriveTrain')
+
+
 @route('/motion/drivetrain/go', method='POST')
 def drivetrain_go():
-    drivetrain = DriveTrain()
     direction = request.json.get('direction', 'forward')
     duration = request.json.get('duration')
-    drivetrain.go(direction=direction, duration=duration)
+    get_drivetrain().go(direction=direction, duration=duration)
     return {'success': True}
 
 
+@route('/motion/drivetrain/route', method='POST')
+def drivetrain_route():
+    route = request.json.get('route', [])
+    try:
+        if isinstance(route, str):
+            route = parse_route(route)
+        else:
+            route = [(step['direction'], step.get('duration')) for step in route]
+        get_drivetrain().queue(route, speed=request.json.get('speed', 1.0))
+    except (KeyError, TypeError, ValueError) as exc:
+        return HTTPResponse(status=400, body={'success': False, 'error': str(exc)})
+    return {'success': True, 'progress': get_drivetrain().progress}
+
+
+@route('/motion/drivetrain/route', method='GET')
+def drivetrain_route_progress():
+    return {'success': True, 'progress': get_drivetrain().progress}
+
+
+@route('/motion/drivetrain/route', method='DELETE')
+def drivetrain_route_cancel():
+    get_drivetrain().stop()
+    return {'success': True, 'progress': get_drivetrain().progress}
+
+
 @route('/output/speaker/say', method='POST')
 def speaker_say():
-    speaker = Speaker()
+    speaker = registry.get('output.speaker.Speaker')
     phrase = request.json.get('phrase', 'No input')
     speaker.say(phrase)
     return {'success': True}
@@ -39,12 +66,42 @@ def speaker_say():
 
 @route('/sensor/camera/stream', method='GET')
 def camera_stream():
-    camera = Camera()
+    camera = registry.get('sensors.camera.Camera')
     stream = camera.stream_video()
     return Response(stream, mimetype='multipart/x-mixed-replace; boundary=frame')
 
 
+@route('/sensor/camera/snapshot', method='GET')
+def camera_snapshot():
+    camera = registry.get('sensors.camera.Camera')
+    jpeg_frame = camera.get_snapshot()
+    if jpeg_frame is None:
+        return HTTPResponse(
+            status=503, body={'success': False, 'error': 'No camera frame.'}
+        )
+    return HTTPResponse(
+        body=jpeg_frame,
+        headers={'Content-Type': 'image/jpeg', 'Cache-Control': 'no-store'}
+    )
+
+
+@route('/sensor/camera/dashcam/trigger', method='POST')
+def camera_dashcam_trigger():
+    if not config.SENSOR['camera']['dashcam']['enabled']:
+        return {'success': False, 'error': 'The dashcam is not enabled.'}
+    reason = (request.json or {}).get('reason', 'api')
+    file_path = registry.get('sensors.camera.Dashcam').trigger(reason)
+    return {'success': file_path is not None, 'file_path': file_path}
+
+
 def runserver(host: Optional[str] = None, port: Optional[int] = None):
     host = host or API_CONFIG['host']
     port = port or API_CONFIG['port']
-    run(host=host, port=port)
+
+    # Started with the server if enabled, as it buffers frames before a trigger
+    if config.SENSOR['camera']['dashcam']['enabled']:
+        registry.get('sensors.camera.Dashcam').start()
+    try:
+        run(host=host, port=port)
+    finally:
+        registry.release_all()
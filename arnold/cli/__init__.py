@@ -1,8 +1,6 @@
-import json
-import os
-
 import click
 import logging
+import time
 
 from arnold import main, config, motion, output, sensors
 
@@ -35,17 +33,12 @@ def imu(address):
     click.echo(f'Calibrating IMU at {address}')
     imu = sensors.imu.IMU(address=address)
     imu.calibrate()
+    imu.save_calibration()
 
-    click.echo(f'Save the following values to environmental vars.')
     click.echo(f'Accelerometer Bias: {imu.sensor.abias}')
     click.echo(f'Gyroscope Bias: {imu.sensor.gbias}')
     click.echo(f'Magnetometer Bias: {imu.sensor.mbias}')
-
-    os.environ['ARNOLD_SENSOR_IMU_BIAS'] = json.dumps({
-        'accelerometer': imu.sensor.abias,
-        'gyroscope': imu.sensor.gbias,
-        'magnetometer': imu.sensor.mbias
-    })
+    click.echo(f'Saved calibration to {imu.calibration_store.file_path}')
 
 
 # Motion tests
@@ -65,6 +58,32 @@ def drivetrain(direction, duration, speed):
     drivetrain.go(direction=direction, duration=duration, speed=speed)
 
 
+@test.command()
+@click.option(
+    '--duration', '-d', default=10, type=float, help='The duration to drive for.'
+)
+@click.option(
+    '--speed', '-s', default=0.5, type=float, help='The speed to drive at.'
+)
+@click.option(
+    '--rate', '-r', default=config.MOTION['drivetrain']['heading_hold']['rate'],
+    type=int, help='The control rate in Hz.'
+)
+def heading_hold(duration, speed, rate):
+    click.echo(f'Testing heading hold driving forward for {duration}s at {rate}Hz')
+    drivetrain = motion.drivetrain.DriveTrain(enable_pwm=True)
+    imu = sensors.imu.IMU()
+    heading_hold = motion.heading.HeadingHold(drivetrain, imu=imu, rate=rate)
+
+    drivetrain.go('forward', duration=duration, speed=speed)
+    with heading_hold:
+        drivetrain.delay.wait()
+    drivetrain.release()
+
+    click.echo(f'Heading drift: {heading_hold.heading:.1f} degrees')
+    click.echo(f'Loop statistics: {heading_hold.statistics}')
+
+
 # Output device tests
 @test.command()
 @click.option(
@@ -96,11 +115,12 @@ def imu(address, count):
     imu = sensors.imu.IMU(address=address)
 
     for _ in range(count):
-        accelerometer_data = imu.get_accelerometer_data()
-        gyroscope_data = imu.get_gyroscope_data()
-        magnetometer_data = imu.get_magnetometer_data()
-        temperature = imu.get_temperature()
-        attitude = imu.get_attitude()
+        sample = imu.read_all()
+        accelerometer_data = dict(zip(sensors.imu.AXES, sample['accelerometer'].tolist()))
+        gyroscope_data = dict(zip(sensors.imu.AXES, sample['gyroscope'].tolist()))
+        magnetometer_data = dict(zip(sensors.imu.AXES, sample['magnetometer'].tolist()))
+        temperature = float(sample['temperature'])
+        attitude = imu.get_attitude(accelerometer_data, magnetometer_data)
 
         click.echo(f'Accelerometer: {accelerometer_data}')
         click.echo(f'Gyroscope: {gyroscope_data}')
@@ -119,12 +139,19 @@ def imu(address, count):
     help='Baudrate of the serial device.'
 )
 @click.option('--count', '-c', default=5, help='Number of distance tests to perform.')
-def lidar(serial_port, baudrate, count):
+@click.option(
+    '--record-file', '-f', default=None,
+    help='The file path to record the raw lidar frames to.'
+)
+def lidar(serial_port, baudrate, count, record_file):
     click.echo(f'Testing Lidar at {serial_port} ({baudrate})')
     lidar = sensors.lidar.Lidar(serial_port=serial_port, baudrate=baudrate)
+    if record_file is not None:
+        lidar.record(record_file)
     for _ in range(count):
         distance = lidar.get_distance()
         click.echo(f'Distance: {distance}')
+    lidar.release()
 
 
 @test.command()
@@ -147,8 +174,12 @@ def microphone(card_number, device_index):
 
 @test.command()
 @click.option(
-    '--camera-number', '-c', default=config.SENSOR['camera']['camera_number'],
-    help='Camera number to test.'
+    '--camera-number', '-c', default=None, type=int,
+    help='Camera number to test. Defaults to the configured source or camera number.'
+)
+@click.option(
+    '--source', '-s', default=None,
+    help='A video file path or `synthetic[:<pattern>]` to test instead of a camera.'
 )
 @click.option(
     '--video', '-v', is_flag=True, help='Test camera in video mode.'
@@ -175,14 +206,54 @@ def microphone(card_number, device_index):
     '--duration', '-d', default=config.SENSOR['camera']['video']['duration'],
     help='The duration of the video to be captured.'
 )
-def camera(camera_number, video, image, file_path, width, height, frame_rate, duration):
-    camera = sensors.camera.Camera(camera_number=camera_number)
-    if image:
+@click.option(
+    '--best-of', '-b', default=None, type=int,
+    help='Capture a burst of images and keep the sharpest.'
+)
+@click.option(
+    '--benchmark', is_flag=True, help='Benchmark the camera streaming pipeline.'
+)
+def camera(
+    camera_number, source, video, image, file_path, width, height, frame_rate,
+    duration, best_of, benchmark
+):
+    camera = sensors.camera.Camera(camera_number=camera_number, source=source)
+    if benchmark:
+        click.echo(f'Benchmarking Camera source `{camera.source}`.')
+        broadcaster = sensors.camera.CameraBroadcaster.get(
+            camera.source,
+            width=width or config.SENSOR['camera']['video']['width'],
+            height=height or config.SENSOR['camera']['video']['height'],
+            frame_rate=frame_rate,
+        )
+        subscriber = broadcaster.subscribe()
+        frame_count, frame_bytes = 0, 0
+        start_time = time.monotonic()
+        try:
+            while time.monotonic() - start_time < duration:
+                jpeg_frame = subscriber.get(timeout=1)
+                if jpeg_frame is not None:
+                    frame_count += 1
+                    frame_bytes += len(jpeg_frame)
+        finally:
+            elapsed = time.monotonic() - start_time
+            subscriber.close()
+            broadcaster.stop()
+
+        click.echo(
+            f'Captured {broadcaster.frame_count / elapsed:.1f} fps, encoded '
+            f'{broadcaster.encode_count} frames and streamed '
+            f'{frame_count / elapsed:.1f} fps at an average of '
+            f'{frame_bytes / max(frame_count, 1) / 1024:.1f}KiB a frame, with '
+            f'{broadcaster.error_count} read errors.'
+        )
+    elif image:
         click.echo(f'Testing Camera in `image` mode.')
         camera.capture_image(
             file_path=file_path or config.SENSOR['camera']['image']['file_path'],
             width=width or config.SENSOR['camera']['image']['width'],
             height=height or config.SENSOR['camera']['image']['height'],
+            best_of=best_of,
         )
     elif video:
         click.echo(f'Testing Camera in `video` mode.')
@@ -203,6 +274,10 @@ def camera(camera_number, video, image, file_path, width, height, frame_rate, du
     '--autonomous', '-a', is_flag=True,
     help='Run arnold in autonomous mode.'
 )
+@click.option(
+    '--follow', '-f', is_flag=True,
+    help='Run arnold in follow mode.'
+)
 @click.option(
     '--voice-command', '-v', is_flag=True,
     help='Run arnold in voice command mode.'
@@ -211,10 +286,12 @@ def camera(camera_number, video, image, file_path, width, height, frame_rate, du
     '--manual', '-m', is_flag=True, default=False,
     help='Run arnold in manual mode - controlled via the API.'
 )
-def run(autonomous, voice_command, manual):
+def run(autonomous, follow, voice_command, manual):
     mode = 'manual'
     if autonomous:
         mode = 'autonomous'
+    elif follow:
+        mode = 'follow'
     elif voice_command:
         mode = 'voicecommand'
     elif manual:
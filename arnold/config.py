@@ -53,7 +53,21 @@ MOTION = {
                 'pins': [22, 17]
             }
         },
-        'pause_duration': 0.1
+        'pause_duration': 0.1,
+        'ramp': {
+            'profile': 's-curve',
+            'duration': 0.5,
+            'tick': 0.02
+        },
+        'heading_hold': {
+            'enabled': False,
+            'rate': 50,
+            'kp': 0.02,
+            'ki': 0.01,
+            'kd': 0.001,
+            'max_trim': 0.2,
+            'statistics_window': 500
+        }
     }
 }
 
@@ -67,6 +81,8 @@ OUTPUT = {
 SENSOR = {
     'camera': {
         'camera_number': 0,
+        'source': os.environ.get('ARNOLD_SENSOR_CAMERA_SOURCE'),
+        'idle_timeout': 10.0,
         'image': {
             'file_path': os.path.join(ROOT_DIR, 'image.jpg'),
             'height': 480,
@@ -76,8 +92,55 @@ SENSOR = {
             'duration': 10,
             'file_path': os.path.join(ROOT_DIR, 'video.avi'),
             'frame_rate': 15,
+            'frame_pool_size': 4,
             'height': 480,
             'width': 640,
+            'open_timeout': 5.0,
+            'queue_size': 30,
+            'warmup_frames': 5,
+        },
+        'stream': {
+            'queue_size': 2,
+            'encoder_workers': 2,
+            'quality_levels': [
+                [80, 1.0],
+                [60, 1.0],
+                [50, 0.75],
+                [40, 0.5]
+            ],
+            'upgrade_after': 30,
+            'snapshot_max_age': 2.5,
+            'change_detection': {
+                'enabled': True,
+                'width': 32,
+                'height': 24,
+                'threshold': 2.0,
+                'keep_alive': 1.0
+            }
+        },
+        'dashcam': {
+            'enabled': False,
+            'directory': os.path.join(ROOT_DIR, 'dashcam'),
+            'duration': 10.0,
+            'post_event': 2.0,
+            'max_bytes': 16 * 1024 * 1024,
+            'obstacle_distance': 15,
+            'impact_threshold': 1.5
+        },
+        'follow': {
+            'width': 640,
+            'height': 480,
+            'frame_rate': 15,
+            'detection_width': 320,
+            'hit_threshold': 0.0,
+            'redetect_interval': 1.0,
+            'track_threshold': 0.5,
+            'search_margin': 0.5,
+            'lost_timeout': 1.0,
+            'flip': True,
+            'deadband': 0.2,
+            'stop_height': 0.8,
+            'command_duration': 1
         }
     },
     'imu': {
@@ -96,11 +159,28 @@ SENSOR = {
                     'magnetometer': [0, 0, 0]
                 })
             )
-        )
+        ),
+        'calibration_file': os.path.join(ROOT_DIR, 'imu_calibration.json'),
+        'bias_tracking': {
+            'enabled': False,
+            'window_size': 100,
+            'gyroscope_threshold': 0.5,
+            'accelerometer_threshold': 0.05,
+            'max_rate': 2.0,
+            'rate': 0.1
+        },
+        'sample_rate': 100,
+        'buffer_size': 1024,
+        'fusion_gain': 0.1
     },
     'lidar': {
         'serial_port': '/dev/ttyS0',
-        'baudrate': 115200
+        'baudrate': 115200,
+        'read_timeout': 0.1,
+        'reading_timeout': 1.0,
+        'streaming': True,
+        'window_size': 10,
+        'outlier_threshold': 2.0
     },
     'microphone': {
         'card_number': 1,
@@ -4,11 +4,9 @@ from typing import Optional
 
 from speech_recognition import UnknownValueError
 
-from arnold import api, utils
-from arnold.lookup import openai
-from arnold.motion import drivetrain
-from arnold.output import speaker
-from arnold.sensors import imu, lidar, microphone
+from arnold import api, config, utils
+from arnold.motion import drivetrain, heading
+from arnold.sensors import camera, imu, vision
 
 
 _logger = logging.getLogger(__name__)
@@ -21,7 +19,7 @@ class Arnold(object):
 
     Args:
         mode (str, optional): The mode to run Arnold in. Options are `autonomous`,
-        `voicecommand`, and `manual`
+        `follow`, `voicecommand`, and `manual`
     """
 
     def __init__(self, mode: Optional[str] = None) -> None:
@@ -32,37 +30,70 @@ class Arnold(object):
 
     def _setup_classes(self, classes: list = None) -> None:
         """
-        Setup the required classes.
+        Setup the required classes with their shared instances from the device
+        registry.
         """
         class_map = {
-            'drivetrain': drivetrain.DriveTrain,
-            'imu': imu.IMU,
-            'lidar': lidar.Lidar,
-            'microphone': microphone.Microphone,
-            'openai': openai.OpenAI,
-            'speaker': speaker.Speaker
+            'dashcam': 'sensors.camera.Dashcam',
+            'drivetrain': 'motion.drivetrain.DriveTrain',
+            'imu': 'sensors.imu.IMU',
+            'lidar': 'sensors.lidar.Lidar',
+            'microphone': 'sensors.microphone.Microphone',
+            'openai': 'lookup.openai.OpenAI',
+            'speaker': 'output.speaker.Speaker'
         }
         classes = classes or []
         for required_class in classes:
             if required_class not in class_map:
                 raise ValueError(f'{required_class} is not a valid class.')
-            setattr(self, required_class, class_map[required_class]())
+            setattr(self, required_class, utils.registry.get(class_map[required_class]))
 
     def _run_autonomous(self) -> None:
         """
         Run Arnold in autonomous mode.
         """
         self._setup_classes(['drivetrain', 'lidar'])
+
+        # Save the lead up to getting too close to an obstacle or an impact
+        dashcam_enabled = config.SENSOR['camera']['dashcam']['enabled']
+        imu_sampler = None
+        if dashcam_enabled:
+            self._setup_classes(['dashcam', 'imu'])
+            self.dashcam.start()
+            imu_sampler = imu.IMUSampler(
+                self.imu,
+                callback=lambda sample: self.dashcam.check_impact(
+                    sample['accelerometer']
+                )
+            )
+            imu_sampler.start()
+
+        # Hold the heading with the gyroscope while driving straight, reading the
+        # dashcam's samples if it's sampling the IMU already
+        heading_hold = None
+        if (
+            config.MOTION['drivetrain']['heading_hold']['enabled'] and
+            self.drivetrain.enable_pwm
+        ):
+            self._setup_classes(['imu'])
+            heading_hold = heading.HeadingHold(
+                self.drivetrain, imu=self.imu, sampler=imu_sampler
+            )
+            heading_hold.start()
+
         try:
+            # Each decision waits for a new lidar frame rather than spinning
             while True:
-                distance = self.lidar.get_mean_distance(10)
+                distance = self.lidar.get_smoothed_distance(wait_for_new=True)
+                if dashcam_enabled:
+                    self.dashcam.check_distance(distance)
                 if distance < 40:
                     self.drivetrain.turn(
                         random.choice(['right', 'left']),
                         duration=10
                     )
                     while True:
-                        distance = self.lidar.get_mean_distance(10)
+                        distance = self.lidar.get_smoothed_distance(wait_for_new=True)
                         if distance > 80:
                             self.drivetrain.stop()
                             break
@@ -71,8 +102,62 @@ class Arnold(object):
                     self.drivetrain.forward(duration=60)
 
         except KeyboardInterrupt:
+            pass
+
+        # Stop on a lidar failure too, rather than driving on blind
+        finally:
+            if heading_hold is not None:
+                heading_hold.stop()
+            if imu_sampler is not None:
+                imu_sampler.stop()
+            self.drivetrain.stop()
+
+    def _run_follow(self) -> None:
+        """
+        Run Arnold in follow mode, turning to keep a person centred in the camera
+        frame and driving towards them until they're close.
+        """
+        self._setup_classes(['drivetrain'])
+
+        follow_config = config.SENSOR['camera']['follow']
+        broadcaster = camera.CameraBroadcaster.get(
+            camera.get_source(),
+            width=follow_config['width'],
+            height=follow_config['height'],
+            frame_rate=follow_config['frame_rate'],
+        )
+        tracker = vision.PersonTracker()
+
+        direction = None
+        try:
+            with broadcaster.hold():
+                frame_id = None
+                while True:
+                    # Only the latest frame is processed, any missed are skipped
+                    frame = broadcaster.frames.wait_for_frame(frame_id, timeout=1)
+                    if frame is None:
+                        continue
+                    frame_id = frame.frame_id
+
+                    target = tracker.update(frame.image, timestamp=frame.timestamp)
+                    next_direction = vision.get_direction(target)
+
+                    # Commands pause the motors, so only send changes
+                    if next_direction == 'stop':
+                        if direction != 'stop':
+                            self.drivetrain.stop()
+                    elif next_direction != direction or not self.drivetrain.is_active:
+                        self.drivetrain.go(
+                            next_direction, duration=follow_config['command_duration']
+                        )
+                    direction = next_direction
+
+        except KeyboardInterrupt:
+            self._logger.info(
+                f'Followed with {tracker.detect_count} detections and '
+                f'{tracker.track_count} tracked frames.'
+            )
             self.drivetrain.stop()
-            self.drivetrain.release()
 
     def _run_manual(self):
         """
@@ -102,6 +187,18 @@ class Arnold(object):
             if 'exit' in command:
                 break
 
+            # Routes of several motions are driven back to back
+            if ' then ' in command:
+                try:
+                    route = drivetrain.parse_route(command)
+                except ValueError:
+                    route = None
+                if route:
+                    if not hasattr(self, 'drivetrain'):
+                        self._setup_classes(['drivetrain'])
+                    self.drivetrain.queue(route)
+                    continue
+
             command_parser = utils.CommandParser(command)
             try:
                 command_result = command_parser.parse()
@@ -113,11 +210,16 @@ class Arnold(object):
 
     def run(self):
         """
-        Run Arnold in a selected mode. Maps the mode to a 'private' method.
+        Run Arnold in a selected mode. Maps the mode to a 'private' method. The
+        devices are released when the mode exits.
         """
         mode_map = {
             'autonomous': self._run_autonomous,
+            'follow': self._run_follow,
             'voicecommand': self._run_voicecommand,
             'manual': self._run_manual,
         }
-        mode_map[self.mode]()
+        try:
+            mode_map[self.mode]()
+        finally:
+            utils.registry.release_all()
@@ -1,22 +1,121 @@
+import functools
 import logging
-from time import sleep
-from typing import Optional
+import math
+import re
+from typing import List, Optional, Tuple
 
-from gpiozero import GPIODeviceError, Motor
+from gpiozero import Motor
 
 from arnold import config
-from arnold.utils import InterruptibleDelay
+from arnold.constants import INT_MAP
+from arnold.utils import MotionScheduler, MotionStep
 
 
 _logger = logging.getLogger(__name__)
 
 
+DIRECTION_ALIASES = {
+    'forward': ['forward', 'forwards', 'forth', 'ahead', 'front'],
+    'back': ['back', 'backward', 'backwards', 'reverse', 'rear'],
+    'left': ['left', 'leftward', 'leftwards'],
+    'right': ['right', 'rightward', 'rightwards'],
+    'stop': ['stop', 'halt', 'pause', 'wait'],
+}
+
+
+RAMP_PROFILES = {
+    'linear': lambda fraction: fraction,
+    's-curve': lambda fraction: fraction * fraction * (3 - 2 * fraction),
+}
+
+
+@functools.lru_cache(maxsize=256)
+def get_ramp(
+    start: Tuple[float, float],
+    end: Tuple[float, float],
+    profile: str,
+    steps: int
+) -> Tuple[Tuple[float, float], ...]:
+    """
+    Precompute the left and right motor speeds of a ramp between two speeds, from
+    the first tick to the end speed. Speeds are signed, -1.0 (backward) to 1.0
+    (forward), so a reversal ramps down through a stop and up the other way.
+
+    Args:
+        start (tuple): The left and right start speeds
+        end (tuple): The left and right end speeds
+        profile (str): `linear` or `s-curve`, which eases in and out of the ramp
+        steps (int): The number of ticks in the ramp
+
+    Returns:
+        tuple: The (left, right) speeds for each tick
+    """
+    try:
+        shape = RAMP_PROFILES[profile]
+    except KeyError:
+        raise ValueError(f'{profile} is not a valid ramp profile.')
+
+    ramp = []
+    for step in range(1, steps + 1):
+        fraction = shape(step / steps)
+        ramp.append(tuple(
+            round(start_speed + (end_speed - start_speed) * fraction, 4)
+            for start_speed, end_speed in zip(start, end)
+        ))
+    return tuple(ramp)
+
+
 class PauseDurationError(Exception):
-    def __init__(self, message: Optional[str]):
+    def __init__(self, message: Optional[str] = None):
         self.message = message or 'The pause duration must be greater than 0.1.'
         super().__init__(message)
 
 
+def parse_route(route: str) -> List[Tuple[str, float]]:
+    """
+    Parse a route of comma or `then` separated steps, e.g. `forward 3s, left 1s,
+    forward 2s` or `go forward three seconds then turn left one second`.
+
+    Args:
+        route (str): The route
+
+    Raises:
+        ValueError: Raised if a step is missing a direction or duration
+
+    Returns:
+        list: (direction, duration) steps
+    """
+    aliases = {
+        alias: direction
+        for direction, direction_aliases in DIRECTION_ALIASES.items()
+        for alias in direction_aliases
+    }
+
+    steps = []
+    for part in re.split(r',|;|\bthen\b', route.lower()):
+        words = re.findall(r'\d+(?:\.\d+)?|[a-z]+', part)
+        if not words:
+            continue
+
+        direction = next((aliases[word] for word in words if word in aliases), None)
+        duration = None
+        for word in words:
+            if word in INT_MAP:
+                duration = float(INT_MAP[word])
+                break
+            try:
+                duration = float(word)
+                break
+            except ValueError:
+                pass
+
+        if direction is None or duration is None:
+            raise ValueError(f'Unable to parse the route step `{part.strip()}`.')
+        steps.append((direction, duration))
+
+    return steps
+
+
 class DriveTrain(object):
     """
     A controller class which initialises the motor gpio instances for the
@@ -43,41 +142,49 @@ class DriveTrain(object):
         # Setup logging
         self._logger = _logger
 
+        # Pause duration and motion scheduler setup
+        self.pause_duration = pause_duration or self.config['pause_duration']
+        if self.pause_duration < 0.1:
+            raise PauseDurationError()
+        self.delay = MotionScheduler(
+            halt_callback=self._halt, pause_duration=self.pause_duration
+        )
+
+        # Speed ramps applied by the motion scheduler with pwm
+        self.ramp_config = self.config['ramp']
+        self.ramp_steps = max(
+            1, round(self.ramp_config['duration'] / self.ramp_config['tick'])
+        )
+
+        # The route being driven and the direction the motors were last driven in
+        self.route = []
+        self._durations = []
+        self._direction = 'stop'
+
+        # The speeds set with pwm and a heading trim added to them, see `set_trim`
+        self._speeds = (0.0, 0.0)
+        self._trim = 0.0
+
         # Motor setup
         self.left_motor, self.right_motor = self.init_motors()
 
-        # Pause duration and delay class setup
-        self.pause_duration = pause_duration or self.config['pause_duration']
-        self.delay = InterruptibleDelay(halt_callback=self._pause)
-
-    def init_motors(self) -> None:
-        """
-        Initialise the motors.
+    def init_motors(self) -> Tuple[Motor, Motor]:
         """
-        try:
-            left_motor = Motor(
-                *self.config['gpio']['left']['pins'], pwm=self.enable_pwm
-            )
-            right_motor = Motor(
-                *self.config['gpio']['right']['pins'], pwm=self.enable_pwm
-            )
-        except GPIODeviceError as exc:
-            self._logger.warning(exc)
-            self.delay.terminate()
-            self.release()
-            left_motor = Motor(
-                *self.config['gpio']['left']['pins'], pwm=self.enable_pwm
-            )
-            right_motor = Motor(
-                *self.config['gpio']['right']['pins'], pwm=self.enable_pwm
-            )
+        Initialise the motors. The drivetrain is shared through the device registry
+        so the pins are only claimed once.
 
+        Returns:
+            tuple: The left and right motors
+        """
+        left_motor = Motor(*self.config['gpio']['left']['pins'], pwm=self.enable_pwm)
+        right_motor = Motor(*self.config['gpio']['right']['pins'], pwm=self.enable_pwm)
         return left_motor, right_motor
 
     def release(self):
         """
         Release the device pins for both motors.
         """
+        self.delay.close()
         self.right_motor.close()
         self.left_motor.close()
         self._logger.info(f'GPIO pins released')
@@ -126,7 +233,7 @@ class DriveTrain(object):
             bool: either left or right motor is active
         """
         is_active = self.delay.is_active()
-        self._logger.info(f'Is Active: {is_active}')
+        self._logger.debug(f'Is Active: {is_active}')
         return is_active
 
     def _get_motor_direction(self, motor: Motor) -> str:
@@ -146,20 +253,188 @@ class DriveTrain(object):
         return 'stopped'
 
 
-    def _pause(self) -> None:
+    def _halt(self) -> None:
+        """
+        Stops both motors, called by the motion scheduler when a motion is complete
+        or interrupted. The scheduler waits out the pause duration before starting
+        the next motion, preventing weird seg faults.
+        """
+        self.left_motor.stop()
+        self.right_motor.stop()
+        self._direction = 'stop'
+        self._speeds = (0.0, 0.0)
+
+    def _reverses(self, direction: str, next_direction: str) -> bool:
         """
-        Pauses motion between commands preventing weird seg faults.
+        Check if either motor reverses between two directions, which needs the
+        motors to be paused in between.
+
+        Args:
+            direction (str): The current direction
+            next_direction (str): The next direction
+
+        Returns:
+            bool: True if either motor reverses
+        """
+        return any(
+            {motor_direction, next_motor_direction} == {'forward', 'backward'}
+            for motor_direction, next_motor_direction in zip(
+                self._direction_map[direction], self._direction_map[next_direction]
+            )
+        )
+
+    def _get_step(
+        self,
+        direction: str,
+        duration: Optional[float],
+        previous_direction: str,
+        speed: float
+    ) -> MotionStep:
+        """
+        Get the motion step to drive in a direction.
+
+        Args:
+            direction (str): The direction
+            duration (float, optional): The duration of the step
+            previous_direction (str): The direction the motors were last driven in
+            speed (float): The speed of the motors 0.0-1.0
 
         Raises:
-            PauseDurationError: Raised if the pause duration is too low to prevent
-            seg fault
+            KeyError: Raised if the direction map has been configured incorrectly.
+
+        Returns:
+            MotionStep: The step
         """
-        if self.pause_duration < 0.1:
-            raise PauseDurationError()
+        try:
+            left, right = self._direction_map[direction]
+        except KeyError:
+            raise KeyError(
+                f'Mapping not found for direction `{direction}`'
+            )
 
-        self.left_motor.stop()
-        self.right_motor.stop()
-        sleep(self.pause_duration)
+        def start() -> None:
+            for motor, motor_direction in [
+                (self.left_motor, left), (self.right_motor, right)
+            ]:
+                if motor_direction == 'stop':
+                    motor.stop()
+                else:
+                    getattr(motor, motor_direction)(speed)
+
+            # A stop step doesn't pause the motors, so a reversal after it still does
+            if direction != 'stop':
+                self._direction = direction
+
+        return MotionStep(
+            duration=duration,
+            start_callback=start,
+            pause=self._reverses(previous_direction, direction),
+        )
+
+    @property
+    def is_straight(self) -> bool:
+        """
+        Check if Arnold is being driven straight forward or back with pwm, when a
+        heading trim applies.
+
+        Returns:
+            bool: Both motors are set to the same direction
+        """
+        left, right = self._speeds
+        return left * right > 0
+
+    def _set_speeds(self, speeds: Tuple[float, float]) -> None:
+        """
+        Set the signed left and right motor speeds, plus the heading trim when
+        driving straight.
+
+        Args:
+            speeds (tuple): The left and right speeds, -1.0 to 1.0
+        """
+        self._speeds = speeds
+        left, right = speeds
+        if self._trim and self.is_straight:
+            # The trim never reverses a motor, it's added to the left and taken
+            # from the right which turns Arnold clockwise either way
+            if left > 0:
+                left = min(max(left + self._trim, 0.0), 1.0)
+                right = min(max(right - self._trim, 0.0), 1.0)
+            else:
+                left = min(max(left + self._trim, -1.0), 0.0)
+                right = min(max(right - self._trim, -1.0), 0.0)
+        self.left_motor.value, self.right_motor.value = left, right
+
+    def set_trim(self, trim: float) -> None:
+        """
+        Trim the pwm speeds to correct the heading while driving straight, applied
+        straight away and on top of any ramp.
+
+        Args:
+            trim (float): The speed added to the left motor and taken from the
+            right, positive turns Arnold clockwise
+        """
+        with self.delay.lock:
+            self._trim = trim
+            if self.enable_pwm and self.delay.is_active():
+                self._set_speeds(self._speeds)
+
+    def _get_ramp_step(
+        self,
+        direction: str,
+        duration: Optional[float],
+        start_speeds: Tuple[float, float],
+        speed: float
+    ) -> Tuple[MotionStep, Tuple[float, float]]:
+        """
+        Get the motion step to ramp the motors to a direction at a speed, blending
+        from the start speeds rather than stopping and pausing on a reversal.
+
+        Args:
+            direction (str): The direction
+            duration (float, optional): The duration of the step, including the
+            ramp
+            start_speeds (tuple): The left and right speeds at the start of the step
+            speed (float): The speed of the motors 0.0-1.0
+
+        Raises:
+            KeyError: Raised if the direction map has been configured incorrectly.
+
+        Returns:
+            tuple: The step and the speeds the motors reach by its end
+        """
+        try:
+            motor_directions = self._direction_map[direction]
+        except KeyError:
+            raise KeyError(
+                f'Mapping not found for direction `{direction}`'
+            )
+        signs = {'forward': 1, 'backward': -1, 'stop': 0}
+        end_speeds = tuple(
+            signs[motor_direction] * speed for motor_direction in motor_directions
+        )
+
+        tick = self.ramp_config['tick']
+        ramp = get_ramp(
+            tuple(round(start_speed, 4) for start_speed in start_speeds),
+            end_speeds,
+            self.ramp_config['profile'],
+            self.ramp_steps,
+        )
+
+        # A step shorter than the ramp ends part way up it
+        end_index = len(ramp) - 1
+        if duration is not None:
+            end_index = min(end_index, max(math.ceil(duration / tick) - 1, 0))
+
+        step = MotionStep(
+            duration=duration,
+            start_callback=functools.partial(self._set_speeds, ramp[0]),
+            pause=False,
+            ramp=ramp[1:],
+            ramp_callback=self._set_speeds,
+            tick=tick,
+        )
+        return step, ramp[end_index]
 
     def go(
         self,
@@ -168,7 +443,9 @@ class DriveTrain(object):
         speed: Optional[float] = 1.0
     ) -> None:
         """
-        Move Arnold in a specific direction for a specified duration.
+        Move Arnold in a specific direction for a specified duration. The motors
+        are only paused if they reverse, continuing in the same direction doesn't
+        stop them, and with pwm they're ramped to the speed rather than jumping.
 
         Args:
             direction (str): stop, forward, backward, right or left.
@@ -179,21 +456,85 @@ class DriveTrain(object):
         Raises:
             KeyError: Raised if the direction map has been configured incorrectly.
         """
-        if self.delay.is_active():
-            self.stop()
-            sleep(self.pause_duration)
+        self.queue([(direction, duration)], speed=speed)
 
-        try:
-            left, right = self._direction_map[direction]
-        except KeyError:
-            raise KeyError(
-                f'Mapping not found for direction `{direction}`'
+    def queue(
+        self,
+        route: List[Tuple[str, Optional[float]]],
+        speed: Optional[float] = 1.0
+    ) -> None:
+        """
+        Drive a route of steps back to back, replacing the current motion. The
+        motors are only paused between steps where either of them reverses, e.g.
+        not from forward to forward or to and from a stop. With pwm the speeds are
+        ramped between steps instead, including through reversals, and down to a
+        stop at the end of the route.
+
+        Args:
+            route (list): (direction, duration) steps, see `parse_route`
+            speed (int, optional): The speed of the motors 0.0-1.0. Defaults to 1.0.
+
+        Raises:
+            KeyError: Raised if a direction isn't in the direction map.
+        """
+        self._logger.info(f'Route: {route}')
+
+        # Plan from the current motion without a step starting in between
+        with self.delay.lock:
+            steps = []
+            if self.enable_pwm:
+                speeds = self._speeds
+                for direction, duration in route:
+                    step, speeds = self._get_ramp_step(direction, duration, speeds, speed)
+                    steps.append(step)
+
+                # Decelerate to a stop at the end of the route
+                if route and route[-1][1] is not None:
+                    steps.append(self._get_ramp_step(
+                        'stop', self.ramp_config['duration'], speeds, speed
+                    )[0])
+            else:
+                previous_direction = self._direction
+                for direction, duration in route:
+                    steps.append(
+                        self._get_step(direction, duration, previous_direction, speed)
+                    )
+                    if direction != 'stop':
+                        previous_direction = direction
+
+            self.route = list(route)
+            self._durations = [step.duration for step in steps]
+            self.delay.schedule(steps)
+
+    @property
+    def progress(self) -> dict:
+        """
+        The progress along the route.
+
+        Returns:
+            dict: The `route`, the current `step` index or `None` once complete,
+            the seconds `elapsed` in the step, the seconds `remaining` of the route
+            and if the route was `cancelled`
+        """
+        progress = self.delay.progress()
+        step = progress['step']
+        remaining = 0.0
+        if step is not None:
+            durations = self._durations[step:]
+            remaining = (
+                None if None in durations else sum(durations) - progress['elapsed']
             )
-        else:
-            getattr(self.left_motor, left)(speed)
-            getattr(self.right_motor, right)(speed)
 
-        self.delay.async_delay(duration)
+            # The deceleration at the end of a route is part of its last step
+            step = min(step, len(self.route) - 1)
+
+        return {
+            'route': [list(route_step) for route_step in self.route],
+            'step': step,
+            'elapsed': progress['elapsed'],
+            'remaining': remaining,
+            'cancelled': progress['cancelled'],
+        }
 
     def forward(self, duration: Optional[int]) -> None:
         """
@@ -231,8 +572,8 @@ class DriveTrain(object):
 
     def stop(self) -> None:
         """
-        Stops Arnold's motion by terminating the delay and pausing the motors.
+        Stops Arnold's motion by terminating the scheduled motion or route, which
+        stops the motors immediately.
         """
         self.delay.terminate()
-        self._pause()
         self._logger.info(f'Stopped')
@@ -0,0 +1,279 @@
+import logging
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+
+from arnold import config
+from arnold.motion.drivetrain import DriveTrain
+from arnold.sensors.imu import IMU, IMUSampler, SAMPLE_DTYPE
+from arnold.utils import RateLoop, RollingStatistics
+
+
+_logger = logging.getLogger(__name__)
+
+
+class PIDController(object):
+    """
+    A PID controller with the output and the integral term clamped to a limit, so
+    the integral doesn't wind up while the output is saturated.
+
+    Args:
+        kp (float): The proportional gain
+        ki (float): The integral gain
+        kd (float): The derivative gain
+        output_limit (float, optional): The maximum absolute output
+    """
+
+    def __init__(
+        self,
+        kp: float,
+        ki: float,
+        kd: float,
+        output_limit: Optional[float] = None
+    ) -> None:
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.output_limit = output_limit
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Clear the integral and derivative state.
+        """
+        self.integral = 0.0
+        self._last_error = None
+
+    def _clamp(self, value: float) -> float:
+        if self.output_limit is None:
+            return value
+        return min(max(value, -self.output_limit), self.output_limit)
+
+    def update(self, error: float, dt: float) -> float:
+        """
+        Update the controller with the latest error.
+
+        Args:
+            error (float): The error from the setpoint
+            dt (float): Seconds since the last update
+
+        Returns:
+            float: The output
+        """
+        derivative = 0.0
+        if dt > 0:
+            self.integral += error * dt
+            if self.ki and self.output_limit is not None:
+                limit = self.output_limit / abs(self.ki)
+                self.integral = min(max(self.integral, -limit), limit)
+            if self._last_error is not None:
+                derivative = (error - self._last_error) / dt
+        self._last_error = error
+
+        return self._clamp(
+            self.kp * error + self.ki * self.integral + self.kd * derivative
+        )
+
+
+class HeadingHold(object):
+    """
+    Holds Arnold's heading while driving straight. A control thread reads the
+    gyroscope yaw rate at a fixed rate, integrates it into the heading drift since
+    Arnold started driving straight and trims the left and right pwm speeds
+    through a PID controller to steer it back. The controller is reset while
+    Arnold turns or stops. The loop time, the jitter of each wake up past its
+    deadline and missed deadlines are measured, see `statistics`.
+
+    Args:
+        drivetrain (DriveTrain): The drivetrain to trim, with pwm enabled
+        imu (IMU): The IMU to read the yaw rate from
+        sampler (IMUSampler, optional): Read the latest yaw rate from a running
+        sampler instead of the IMU
+        rate (int, optional): The control rate in Hz
+
+    Raises:
+        ValueError: Raised if the drivetrain doesn't have pwm enabled
+    """
+
+    def __init__(
+        self,
+        drivetrain: DriveTrain,
+        imu: Optional[IMU] = None,
+        sampler: Optional[IMUSampler] = None,
+        rate: Optional[int] = None
+    ) -> None:
+        if not drivetrain.enable_pwm:
+            raise ValueError('Heading hold needs the drivetrain to have pwm enabled.')
+        if imu is None and sampler is None:
+            raise ValueError('Heading hold needs an IMU or an IMU sampler.')
+
+        self.config = config.MOTION['drivetrain']['heading_hold']
+        self.drivetrain = drivetrain
+        self.imu = imu
+        self.sampler = sampler
+        self.rate = rate or self.config['rate']
+        self.pid = PIDController(
+            kp=self.config['kp'],
+            ki=self.config['ki'],
+            kd=self.config['kd'],
+            output_limit=self.config['max_trim'],
+        )
+
+        # The heading drift in degrees, anticlockwise positive
+        self.heading = 0.0
+        self.trim = 0.0
+
+        # Loop instrumentation
+        self.count = 0
+        self.error_count = 0
+        self.loop_time = RollingStatistics(self.config['statistics_window'])
+        self.jitter = RollingStatistics(self.config['statistics_window'])
+        self.max_loop_time = 0.0
+        self.max_jitter = 0.0
+
+        self._last_time = None
+        self._sample = np.zeros(1, dtype=SAMPLE_DTYPE)[0]
+        self._loop = RateLoop(self.rate)
+        self._statistics_lock = threading.Lock()
+        self._control_thread = None
+        self._stopped = threading.Event()
+
+        # Setup logging
+        self._logger = _logger
+
+    def __enter__(self) -> 'HeadingHold':
+        self.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        """
+        Start the control thread.
+        """
+        if self._control_thread is not None and self._control_thread.is_alive():
+            return
+
+        self._stopped.clear()
+        self._control_thread = threading.Thread(target=self._control, daemon=True)
+        self._control_thread.start()
+        self._logger.info(f'Holding heading at {self.rate}Hz')
+
+    def stop(self) -> None:
+        """
+        Stop the control thread and clear the trim.
+        """
+        self._stopped.set()
+        if self._control_thread is not None:
+            self._control_thread.join()
+            self._control_thread = None
+        self.drivetrain.set_trim(0.0)
+        self._logger.info(f'Heading hold statistics: {self.statistics}')
+
+    def _get_yaw_rate(self) -> float:
+        """
+        The latest yaw rate in degrees per second, anticlockwise positive. The IMU
+        is burst read, as the single channel reads return error data rather than
+        raising when the I2C read fails.
+
+        Raises:
+            OSError: Raised if the I2C read fails or the sampler has no sample yet
+
+        Returns:
+            float: The yaw rate
+        """
+        if self.sampler is not None:
+            sample = self.sampler.latest
+            if sample is None:
+                raise OSError('No IMU sample yet.')
+        else:
+            sample = self.imu.read_all(out=self._sample)
+        return float(sample['gyroscope'][2])
+
+    def update(self, now: Optional[float] = None) -> None:
+        """
+        Run one control step, integrating the yaw rate since the last step and
+        trimming the drivetrain.
+
+        Args:
+            now (float, optional): The time of the step. Defaults to now.
+        """
+        now = time.monotonic() if now is None else now
+        dt = 0.0 if self._last_time is None else now - self._last_time
+        self._last_time = now
+
+        if not self.drivetrain.is_straight:
+            if self.heading or self.trim:
+                self.heading = 0.0
+                self.trim = 0.0
+                self.pid.reset()
+                self.drivetrain.set_trim(0.0)
+            return
+
+        try:
+            yaw_rate = self._get_yaw_rate()
+        except OSError as exc:
+            self.error_count += 1
+            self._logger.debug(f'Failed to read the yaw rate: {exc}')
+            return
+
+        self.heading += yaw_rate * dt
+        self.trim = self.pid.update(self.heading, dt)
+        self.drivetrain.set_trim(self.trim)
+
+    def _control(self) -> None:
+        """
+        Control thread loop, at a fixed rate which doesn't drift with the loop time.
+        """
+        self._loop.run(
+            self._step, lambda: not self._stopped.is_set(), sleep=self._stopped.wait
+        )
+
+    def _step(self) -> None:
+        """
+        Run a control step, measuring its loop time and its jitter past the deadline.
+        """
+        wake_time = time.monotonic()
+        self.update(wake_time)
+        done_time = time.monotonic()
+
+        jitter = wake_time - self._loop.deadline
+        loop_time = done_time - wake_time
+        with self._statistics_lock:
+            self.jitter.update(jitter)
+            self.max_jitter = max(self.max_jitter, jitter)
+            self.loop_time.update(loop_time)
+            self.max_loop_time = max(self.max_loop_time, loop_time)
+            self.count += 1
+
+    @property
+    def statistics(self) -> dict:
+        """
+        The control loop timing, in milliseconds, over the statistics window.
+
+        Returns:
+            dict: The loop `count`, missed deadline `overrun_count`, failed read
+            `error_count`, and mean and max `loop_time` and mean, standard
+            deviation and max `jitter`
+        """
+        def milliseconds(value: Optional[float]) -> Optional[float]:
+            return None if value is None else round(value * 1000, 3)
+
+        with self._statistics_lock:
+            return {
+                'count': self.count,
+                'overrun_count': self._loop.overrun_count,
+                'error_count': self.error_count,
+                'loop_time': {
+                    'mean': milliseconds(self.loop_time.mean),
+                    'max': milliseconds(self.max_loop_time),
+                },
+                'jitter': {
+                    'mean': milliseconds(self.jitter.mean),
+                    'stdev': milliseconds(self.jitter.stdev),
+                    'max': milliseconds(self.max_jitter),
+                },
+            }
@@ -1,6 +1,10 @@
 import logging
 import time
 
+import pytest
+from gpiozero import Device
+from gpiozero.pins.mock import MockFactory, MockPWMPin
+
 from arnold.motion import drivetrain
 
 
@@ -109,3 +113,124 @@ class TestDrivetrain:
         assert not self.drive.status['left']['is_active']
         assert not self.drive.delay.is_active()
 
+
+    def test_drivetrain_stop_immediate(self):
+
+        self.drive.forward(3)
+        assert self.drive.status['right']['direction'] == 'forward'
+
+        # The motors are stopped before stop returns
+        self.drive.stop()
+        assert self.drive.status['right']['direction'] == 'stopped'
+        assert self.drive.status['left']['direction'] == 'stopped'
+        assert not self.drive.delay.is_active()
+
+        # The next motion waits out the pause in the scheduler thread
+        self.drive.back(3)
+        assert self.drive.status['right']['direction'] == 'stopped'
+        assert self.drive.delay.is_active()
+        time.sleep(self.drive.pause_duration + 0.05)
+        assert self.drive.status['right']['direction'] == 'back'
+
+    def test_drivetrain_queue(self):
+
+        self.drive.queue([('forward', 0.2), ('forward', 0.2), ('right', 0.2)])
+        assert self.drive.progress['step'] == 0
+        time.sleep(0.25)
+
+        # Continuing forward doesn't stop the motors
+        assert self.drive.progress['step'] == 1
+        assert self.drive.status['right']['direction'] == 'forward'
+        time.sleep(0.2)
+
+        # The right motor reverses so the motors are paused first
+        assert self.drive.progress['step'] == 2
+        assert self.drive.status['right']['direction'] == 'stopped'
+        time.sleep(self.drive.pause_duration)
+        assert self.drive.status['right']['direction'] == 'back'
+        assert self.drive.status['left']['direction'] == 'forward'
+
+        assert self.drive.delay.wait(timeout=1)
+        assert self.drive.progress['step'] is None
+        assert not self.drive.progress['cancelled']
+        assert self.drive.status['left']['direction'] == 'stopped'
+
+    def test_drivetrain_queue_cancel(self):
+
+        self.drive.queue(drivetrain.parse_route('forward 3s, left 1s'))
+        progress = self.drive.progress
+        assert progress['route'] == [['forward', 3.0], ['left', 1.0]]
+        assert 3.9 < progress['remaining'] <= 4.0
+
+        self.drive.stop()
+        assert self.drive.progress['cancelled']
+        assert self.drive.progress['step'] is None
+        assert self.drive.status['left']['direction'] == 'stopped'
+
+    def test_parse_route(self):
+
+        assert drivetrain.parse_route('forward 3s, left 1.5s; back 2') == [
+            ('forward', 3.0), ('left', 1.5), ('back', 2.0)
+        ]
+        assert drivetrain.parse_route(
+            'go forward three seconds then turn right one second'
+        ) == [('forward', 3.0), ('right', 1.0)]
+
+        with pytest.raises(ValueError):
+            drivetrain.parse_route('forward, left 1s')
+
+    def test_get_ramp(self):
+
+        ramp = drivetrain.get_ramp((0.0, 0.0), (1.0, -1.0), 'linear', 4)
+        assert ramp == ((0.25, -0.25), (0.5, -0.5), (0.75, -0.75), (1.0, -1.0))
+
+        # The s-curve eases in and out
+        ramp = drivetrain.get_ramp((0.0, 0.0), (1.0, 1.0), 's-curve', 4)
+        assert ramp[0][0] < 0.25 and ramp[1][0] == 0.5 and ramp[2][0] > 0.75
+        assert drivetrain.get_ramp((0.0, 0.0), (1.0, 1.0), 's-curve', 4) is ramp
+
+        with pytest.raises(ValueError):
+            drivetrain.get_ramp((0.0, 0.0), (1.0, 1.0), 'invalid', 4)
+
+
+class TestDrivetrainPWM:
+
+    def setup_method(self, method):
+        Device.pin_factory = MockFactory(pin_class=MockPWMPin)
+        self.drive = drivetrain.DriveTrain(enable_pwm=True)
+        self.speeds = []
+        set_speeds = self.drive._set_speeds
+        self.drive._set_speeds = lambda speeds: (
+            self.speeds.append(speeds), set_speeds(speeds)
+        )
+
+    def teardown_method(self, method):
+        self.drive.release()
+        Device.pin_factory = MockFactory()
+
+    def test_drivetrain_ramp(self):
+
+        # The motors accelerate rather than jumping to the speed
+        self.drive.go('forward', 0.6, speed=0.5)
+        assert 0 < self.drive.left_motor.value < 0.1
+        time.sleep(0.15)
+        assert 0.1 < self.drive.left_motor.value < 0.5
+
+        # and decelerate to a stop at the end
+        assert self.drive.delay.wait(timeout=2)
+        assert max(left for left, _ in self.speeds) == 0.5
+        assert self.speeds[-1] == (0.0, 0.0)
+        assert self.drive.left_motor.value == 0
+
+    def test_drivetrain_ramp_reverse(self):
+
+        # A reversal ramps through a stop without halting the motors
+        self.drive.queue([('forward', 0.5), ('back', 0.5)], speed=0.5)
+        time.sleep(0.6)
+        assert self.drive.progress['step'] == 1
+        assert self.drive.left_motor.value < 0.5
+        assert self.drive.delay.wait(timeout=2)
+
+        lefts = [left for left, _ in self.speeds]
+        assert min(lefts) == -0.5
+        assert all(abs(b - a) <= 0.2 for a, b in zip(lefts, lefts[1:]))
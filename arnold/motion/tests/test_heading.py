@@ -0,0 +1,132 @@
+import logging
+import time
+
+import pytest
+from gpiozero import Device
+from gpiozero.pins.mock import MockFactory, MockPWMPin
+
+from arnold import config
+from arnold.motion import drivetrain, heading
+
+
+logging.disable(logging.ERROR)
+
+
+class FakeIMU:
+    """
+    Simulates Arnold drifting anticlockwise, steered by the difference between the
+    motor speeds.
+    """
+
+    def __init__(self, drive, drift=10.0, gain=100.0):
+        self.drive = drive
+        self.drift = drift
+        self.gain = gain
+        self.failing = False
+
+    @property
+    def yaw_rate(self):
+        left, right = self.drive.left_motor.value, self.drive.right_motor.value
+        return self.drift + self.gain * (right - left)
+
+    def read_all(self, out):
+        if self.failing:
+            raise OSError('I2C read failed')
+        out['gyroscope'] = [0.0, 0.0, self.yaw_rate]
+        return out
+
+
+class TestPIDController:
+
+    def test_update(self):
+        pid = heading.PIDController(kp=1.0, ki=0.5, kd=0.1)
+        assert pid.update(2.0, 0.0) == 2.0
+        assert pid.update(2.0, 1.0) == pytest.approx(2.0 + 0.5 * 2.0)
+        assert pid.update(1.0, 1.0) == pytest.approx(1.0 + 0.5 * 3.0 - 0.1)
+
+        pid.reset()
+        assert pid.integral == 0.0
+
+    def test_output_limit(self):
+        pid = heading.PIDController(kp=1.0, ki=1.0, kd=0.0, output_limit=0.5)
+        for _ in range(100):
+            assert pid.update(10.0, 0.1) == 0.5
+
+        # The integral doesn't wind up past the limit
+        assert pid.integral == 0.5
+        assert pid.update(-1.0, 0.1) < 0
+
+
+class TestHeadingHold:
+
+    def setup_method(self, method):
+        self.config = config.MOTION['drivetrain']['heading_hold']
+        Device.pin_factory = MockFactory(pin_class=MockPWMPin)
+        self.drive = drivetrain.DriveTrain(enable_pwm=True)
+
+    def teardown_method(self, method):
+        self.drive.release()
+        Device.pin_factory = MockFactory()
+
+    def test_config(self):
+        required_config = ['enabled', 'rate', 'kp', 'ki', 'kd', 'max_trim']
+        for config_key in required_config:
+            assert config_key in self.config
+
+    def test_requires_pwm(self):
+        Device.pin_factory = MockFactory()
+        drive = drivetrain.DriveTrain(enable_pwm=False)
+        try:
+            with pytest.raises(ValueError):
+                heading.HeadingHold(drive, imu=FakeIMU(drive))
+        finally:
+            drive.release()
+
+    def test_update(self):
+        imu = FakeIMU(self.drive)
+        heading_hold = heading.HeadingHold(self.drive, imu=imu)
+
+        # Turns don't drift the heading
+        self.drive.go('left', 10, speed=0.5)
+        heading_hold.update(now=0.0)
+        heading_hold.update(now=0.1)
+        assert heading_hold.heading == 0.0
+
+        # Drifting anticlockwise while driving straight is trimmed clockwise
+        self.drive.stop()
+        self.drive.delay.pause_duration = 0
+        self.drive.go('forward', 10, speed=0.5)
+        time.sleep(self.drive.ramp_config['duration'] + 0.1)
+        heading_hold.update(now=0.2)
+        heading_hold.update(now=0.3)
+        assert heading_hold.heading > 0
+        assert heading_hold.trim > 0
+        assert self.drive.left_motor.value > self.drive.right_motor.value
+
+        # Failed reads are counted and not integrated
+        imu.failing = True
+        current_heading = heading_hold.heading
+        heading_hold.update(now=0.4)
+        assert heading_hold.heading == current_heading
+        assert heading_hold.error_count == 1
+
+    def test_hold(self):
+        imu = FakeIMU(self.drive)
+        self.drive.go('forward', 10, speed=0.5)
+        with heading.HeadingHold(self.drive, imu=imu, rate=100) as heading_hold:
+            time.sleep(2)
+
+            # The drift is cancelled and the heading steered back
+            assert abs(imu.yaw_rate) < 2
+            assert abs(heading_hold.heading) < 2
+            assert heading_hold.trim == pytest.approx(0.05, abs=0.01)
+
+        # The loop keeps its deadlines
+        statistics = heading_hold.statistics
+        assert 150 <= statistics['count'] <= 210
+        assert statistics['overrun_count'] < 5
+        assert statistics['loop_time']['mean'] < 10
+        assert statistics['jitter']['max'] is not None
+
+        # The trim is cleared on stop
+        assert self.drive.left_motor.value == self.drive.right_motor.value
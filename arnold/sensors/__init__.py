@@ -1 +1 @@
-from arnold.sensors import imu, camera, lidar, microphone
+from arnold.sensors import imu, camera, lidar, microphone, vision
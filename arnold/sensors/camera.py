@@ -1,15 +1,1260 @@
+import collections
+import json
 import logging
+import os
+import queue
+import re
+import threading
 import time
-from typing import Generator, Optional
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Generator, Iterator, Optional, Union
 
 import cv2
+import numpy as np
 
 from arnold import config
+from arnold.utils import RateLoop
 
 
 _logger = logging.getLogger(__name__)
 
 
+@dataclass
+class CameraFrame:
+    frame_id: int
+    timestamp: float
+    image: np.ndarray
+
+
+class SyntheticCapture(object):
+    """
+    A synthetic frame source with the interface of `cv2.VideoCapture`, to test and
+    benchmark the camera pipeline at controlled sizes and frame rates without a
+    camera. The `bars` pattern scrolls and the `noise` pattern, the worst case to
+    encode, cycles through random frames, both with the frame number drawn on. The
+    `static` pattern never changes.
+
+    Args:
+        width (int, optional): The width of the frames
+        height (int, optional): The height of the frames
+        frame_rate (float, optional): Pace reads to the frame rate like a camera.
+        Defaults to delivering frames as fast as they're read.
+        pattern (str, optional): `bars`, `noise` or `static`
+        seed (int, optional): The noise pattern's random seed
+    """
+
+    PATTERNS = ('bars', 'noise', 'static')
+
+    def __init__(
+        self,
+        width: int = 640,
+        height: int = 480,
+        frame_rate: Optional[float] = None,
+        pattern: Optional[str] = None,
+        seed: Optional[int] = None
+    ) -> None:
+        self.pattern = pattern or 'bars'
+        if self.pattern not in self.PATTERNS:
+            raise ValueError(f'{self.pattern} is not a valid pattern.')
+
+        self.width = width
+        self.height = height
+        self.frame_rate = frame_rate
+        self.frame_count = 0
+
+        self._random = np.random.default_rng(seed)
+        self._frames = None
+        self._next_time = None
+        self._opened = True
+
+    def _generate(self) -> None:
+        """
+        Generate the pattern frames once for the frame size.
+        """
+        if self.pattern == 'noise':
+            self._frames = self._random.integers(
+                0, 256, (8, self.height, self.width, 3), dtype=np.uint8
+            )
+            return
+
+        # Vertical colour bars, repeated twice so a scrolled frame is a slice
+        colours = np.array([
+            [255, 255, 255], [0, 255, 255], [255, 255, 0], [0, 255, 0],
+            [255, 0, 255], [0, 0, 255], [255, 0, 0], [0, 0, 0],
+        ], dtype=np.uint8)
+        columns = colours[np.arange(self.width * 2) * len(colours) // self.width % 8]
+        self._frames = np.ascontiguousarray(
+            np.broadcast_to(columns, (1, self.height, self.width * 2, 3))
+        )
+
+    def isOpened(self) -> bool:
+        return self._opened
+
+    def get(self, property_id: int) -> float:
+        return {
+            cv2.CAP_PROP_FRAME_WIDTH: self.width,
+            cv2.CAP_PROP_FRAME_HEIGHT: self.height,
+            cv2.CAP_PROP_FPS: self.frame_rate or 0,
+            cv2.CAP_PROP_POS_FRAMES: self.frame_count,
+        }.get(property_id, 0)
+
+    def set(self, property_id: int, value: float) -> bool:
+        if property_id == cv2.CAP_PROP_FRAME_WIDTH:
+            self.width = int(value)
+        elif property_id == cv2.CAP_PROP_FRAME_HEIGHT:
+            self.height = int(value)
+        elif property_id == cv2.CAP_PROP_FPS:
+            self.frame_rate = value
+        else:
+            return False
+        self._frames = None
+        return True
+
+    def grab(self) -> bool:
+        """
+        Advance to the next frame, waiting for it if paced to a frame rate.
+
+        Returns:
+            bool: True unless released
+        """
+        if not self._opened:
+            return False
+
+        if self.frame_rate:
+            now = time.monotonic()
+            if self._next_time is None or self._next_time < now:
+                self._next_time = now
+            else:
+                time.sleep(self._next_time - now)
+            self._next_time += 1 / self.frame_rate
+
+        self.frame_count += 1
+        return True
+
+    def retrieve(self, image: Optional[np.ndarray] = None) -> tuple:
+        """
+        Render the current frame.
+
+        Args:
+            image (np.ndarray, optional): A buffer to render into
+
+        Returns:
+            tuple: True and the frame
+        """
+        if self._frames is None:
+            self._generate()
+
+        shape = (self.height, self.width, 3)
+        if image is None or image.shape != shape or image.dtype != np.uint8:
+            image = np.empty(shape, dtype=np.uint8)
+
+        index = self.frame_count
+        if self.pattern == 'bars':
+            offset = (index * 4) % self.width
+            np.copyto(image, self._frames[0, :, offset:offset + self.width])
+        elif self.pattern == 'static':
+            np.copyto(image, self._frames[0, :, :self.width])
+        else:
+            np.copyto(image, self._frames[index % len(self._frames)])
+
+        if self.pattern != 'static':
+            cv2.putText(
+                image, str(index), (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1,
+                (128, 128, 128), 2
+            )
+        return True, image
+
+    def read(self, image: Optional[np.ndarray] = None) -> tuple:
+        """
+        Grab and render the next frame.
+
+        Args:
+            image (np.ndarray, optional): A buffer to render into
+
+        Returns:
+            tuple: True and the frame, or False and `None` if released
+        """
+        if not self.grab():
+            return False, None
+        return self.retrieve(image)
+
+    def release(self) -> None:
+        self._opened = False
+
+
+def get_source(source: Optional[Union[int, str]] = None) -> Union[int, str]:
+    """
+    The camera source, defaulting to the configured source or else the camera device
+    number. A device number given as a string, e.g. from the environment, is
+    converted to an int so it's the same source as the device.
+
+    Args:
+        source (int | str, optional): A source to normalise instead
+
+    Returns:
+        int | str: The source
+    """
+    if source is None:
+        camera_config = config.SENSOR['camera']
+        source = camera_config['source']
+        if source is None:
+            source = camera_config['camera_number']
+    if isinstance(source, str) and source.isdigit():
+        return int(source)
+    return source
+
+
+def open_capture(source: Union[int, str]):
+    """
+    Open a frame source with the `cv2.VideoCapture` interface.
+
+    Args:
+        source (int | str): A camera device number, a video file path or
+        `synthetic[:<pattern>]`, e.g. `synthetic:noise`, see `SyntheticCapture`
+
+    Returns:
+        cv2.VideoCapture | SyntheticCapture: The opened source
+    """
+    if isinstance(source, str):
+        if source.startswith('synthetic'):
+            _, _, pattern = source.partition(':')
+            return SyntheticCapture(pattern=pattern or None)
+        if source.isdigit():
+            source = int(source)
+    return cv2.VideoCapture(source)
+
+
+def get_sharpness(image: np.ndarray) -> float:
+    """
+    A focus measure of an image, the variance of its Laplacian. Blurred and badly
+    exposed images have fewer edges and a lower variance.
+
+    Args:
+        image (np.ndarray): The BGR image
+
+    Returns:
+        float: The sharpness, only comparable between images of the same scene
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+
+class FramePool(object):
+    """
+    A small pool of preallocated frame buffers which frames are captured into in
+    turn, with the latest frame in a slot consumers can read or wait on without
+    blocking the capture. Frames are handed out as read-only views of the pool,
+    the oldest buffer is reused for the next capture so a view is only valid for
+    `size - 1` frames, copy it to keep it longer.
+
+    Args:
+        size (int, optional): The number of frame buffers
+    """
+
+    def __init__(self, size: Optional[int] = None) -> None:
+        self.config = config.SENSOR['camera']['video']
+        self.size = size or self.config['frame_pool_size']
+
+        self.buffers = None
+        self.latest = None
+        self.allocation_count = 0
+
+        self._index = -1
+        self._frame_id = 0
+        self._condition = threading.Condition()
+
+    def _allocate(self, shape: tuple, dtype: np.dtype) -> None:
+        """
+        Allocate the frame buffers, only on the first frame or if the frame size
+        changes.
+
+        Args:
+            shape (tuple): The shape of a frame
+            dtype (np.dtype): The frame's data type
+        """
+        self.buffers = np.zeros((self.size, ) + shape, dtype=dtype)
+        self.allocation_count += 1
+        self._index = -1
+
+    def next_buffer(self) -> Optional[np.ndarray]:
+        """
+        The buffer to capture the next frame into, e.g. with
+        `cv2.VideoCapture.read(image=buffer)`.
+
+        Returns:
+            np.ndarray: The oldest buffer or `None` before the first frame
+        """
+        if self.buffers is None:
+            return None
+        return self.buffers[(self._index + 1) % self.size]
+
+    def publish(self, image: np.ndarray, timestamp: Optional[float] = None) -> CameraFrame:
+        """
+        Publish a captured frame as the latest frame. A frame which wasn't captured
+        into `next_buffer` is copied into the pool.
+
+        Args:
+            image (np.ndarray): The captured frame
+            timestamp (float, optional): The capture time. Defaults to now.
+
+        Returns:
+            CameraFrame: The latest frame
+        """
+        timestamp = time.monotonic() if timestamp is None else timestamp
+
+        buffer = self.next_buffer()
+        if buffer is None or buffer.shape != image.shape or buffer.dtype != image.dtype:
+            self._allocate(image.shape, image.dtype)
+            buffer = self.next_buffer()
+        if image is not buffer:
+            np.copyto(buffer, image)
+
+        view = buffer.view()
+        view.flags.writeable = False
+
+        with self._condition:
+            self._index = (self._index + 1) % self.size
+            self._frame_id += 1
+            self.latest = CameraFrame(
+                frame_id=self._frame_id, timestamp=timestamp, image=view
+            )
+            self._condition.notify_all()
+        return self.latest
+
+    def clear(self) -> None:
+        """
+        Clear the latest frame when the capture stops, so consumers wait for a
+        frame from the next capture rather than getting a stale one.
+        """
+        with self._condition:
+            self.latest = None
+
+    def wait_for_frame(
+        self,
+        frame_id: Optional[int] = None,
+        timeout: Optional[float] = None
+    ) -> Optional[CameraFrame]:
+        """
+        Wait for a frame newer than a given frame.
+
+        Args:
+            frame_id (int, optional): The last frame seen. Defaults to waiting for
+            the next frame.
+            timeout (float, optional): Seconds to wait. Defaults to waiting forever.
+
+        Returns:
+            CameraFrame: The latest frame or `None` on timeout
+        """
+        with self._condition:
+            frame_id = self._frame_id if frame_id is None else frame_id
+            if not self._condition.wait_for(
+                lambda: self.latest is not None and self._frame_id > frame_id,
+                timeout=timeout
+            ):
+                return None
+            return self.latest
+
+
+class ChangeDetector(object):
+    """
+    A cheap scene change detector which compares a small grayscale thumbnail of
+    each frame to that of the last frame let through. While nothing changes only a
+    keep-alive frame is let through every few seconds, so a static scene isn't
+    encoded and sent at the full frame rate.
+
+    Args:
+        threshold (float, optional): The mean absolute thumbnail pixel difference
+        (0 - 255) over which the scene has changed
+        keep_alive (float, optional): Seconds between frames let through while the
+        scene is static
+    """
+
+    def __init__(
+        self,
+        threshold: Optional[float] = None,
+        keep_alive: Optional[float] = None
+    ) -> None:
+        self.config = config.SENSOR['camera']['stream']['change_detection']
+        self.threshold = self.config['threshold'] if threshold is None else threshold
+        self.keep_alive = self.config['keep_alive'] if keep_alive is None else keep_alive
+        self.size = (self.config['width'], self.config['height'])
+
+        self.difference = 0.0
+
+        # Preallocated thumbnails, the reference is the last frame let through
+        self._thumbnail = np.zeros((self.size[1], self.size[0], 3), dtype=np.uint8)
+        self._current = np.zeros((self.size[1], self.size[0]), dtype=np.uint8)
+        self._reference = np.zeros_like(self._current)
+        self._reference_time = None
+
+    def reset(self) -> None:
+        """
+        Let the next frame through regardless, e.g. for a new viewer.
+        """
+        self._reference_time = None
+
+    def update(self, image: np.ndarray, timestamp: Optional[float] = None) -> bool:
+        """
+        Check a frame for a change from the last frame let through.
+
+        Args:
+            image (np.ndarray): The BGR frame
+            timestamp (float, optional): The frame's capture time. Defaults to now.
+
+        Returns:
+            bool: True if the scene changed or a keep-alive frame is due
+        """
+        timestamp = time.monotonic() if timestamp is None else timestamp
+
+        cv2.resize(image, self.size, dst=self._thumbnail, interpolation=cv2.INTER_AREA)
+        cv2.cvtColor(self._thumbnail, cv2.COLOR_BGR2GRAY, dst=self._current)
+
+        if self._reference_time is not None:
+            self.difference = cv2.norm(self._current, self._reference, cv2.NORM_L1) / (
+                self._current.size
+            )
+            if (
+                self.difference <= self.threshold and
+                timestamp - self._reference_time < self.keep_alive
+            ):
+                return False
+
+        self._current, self._reference = self._reference, self._current
+        self._reference_time = timestamp
+        return True
+
+
+class CameraSubscriber(object):
+    """
+    A subscription to the JPEG frames published by a `CameraBroadcaster`. Frames
+    are queued in a small bounded queue which drops the oldest frame when full, so
+    a slow subscriber skips frames instead of holding up the capture.
+
+    An adaptive subscription also steps down the quality levels, i.e. JPEG quality
+    and scale, when it drops frames and back up once it has kept up for a while,
+    so a slow client gets smaller frames rather than fewer frames.
+
+    Args:
+        broadcaster (CameraBroadcaster): The broadcaster subscribed to
+        queue_size (int, optional): The number of frames to queue
+        level (int, optional): The index of the initial quality level
+        adaptive (bool, optional): Adapt the quality level to the client
+    """
+
+    def __init__(
+        self,
+        broadcaster: 'CameraBroadcaster',
+        queue_size: Optional[int] = None,
+        level: int = 0,
+        adaptive: bool = True
+    ) -> None:
+        self.config = config.SENSOR['camera']['stream']
+        self.broadcaster = broadcaster
+        self.queue_size = queue_size or self.config['queue_size']
+        self.level = level
+        self.adaptive = adaptive
+
+        self.frames = queue.Queue(maxsize=self.queue_size)
+        self.dropped_count = 0
+        self.closed = False
+
+        self._kept_up_count = 0
+
+    def __iter__(self) -> Iterator[bytes]:
+        while True:
+            frame = self.get()
+            if frame is None:
+                break
+            yield frame
+
+    def put(self, frame: Optional[bytes]) -> None:
+        """
+        Queue a frame, dropping the oldest queued frame if the queue is full.
+
+        Args:
+            frame (bytes): The JPEG frame, `None` ends the subscription
+        """
+        kept_up = self.frames.empty()
+        dropped = False
+        while True:
+            try:
+                self.frames.put_nowait(frame)
+                break
+            except queue.Full:
+                try:
+                    self.frames.get_nowait()
+                    self.dropped_count += 1
+                    dropped = True
+                except queue.Empty:
+                    pass
+
+        if self.adaptive and frame is not None:
+            self._adapt(dropped, kept_up)
+
+    def _adapt(self, dropped: bool, kept_up: bool) -> None:
+        """
+        Step the quality level down on a dropped frame and up again after a run of
+        frames the client has kept up with, i.e. its queue was empty.
+
+        Args:
+            dropped (bool): A queued frame was dropped
+            kept_up (bool): The queue was empty
+        """
+        if dropped:
+            self._kept_up_count = 0
+            self.level = min(self.level + 1, len(self.config['quality_levels']) - 1)
+        elif kept_up:
+            self._kept_up_count += 1
+            if self._kept_up_count >= self.config['upgrade_after'] and self.level > 0:
+                self._kept_up_count = 0
+                self.level -= 1
+
+    def get(self, timeout: Optional[float] = None) -> Optional[bytes]:
+        """
+        Get the next frame, waiting for it to be published.
+
+        Args:
+            timeout (float, optional): Seconds to wait. Defaults to waiting until a
+            frame is published or the subscription ends.
+
+        Returns:
+            bytes: The JPEG frame or `None` on timeout or if the subscription ended
+        """
+        if self.closed:
+            return None
+        try:
+            frame = self.frames.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if frame is None:
+            self.closed = True
+        return frame
+
+    def close(self) -> None:
+        """
+        Unsubscribe from the broadcaster, ending the subscription straight away.
+        """
+        self.broadcaster.unsubscribe(self)
+        self.closed = True
+
+        # Wake up a blocked get
+        self.put(None)
+
+
+class CameraBroadcaster(object):
+    """
+    Captures frames from a camera once in a background thread and publishes them
+    JPEG encoded to any number of subscribers, so multiple viewers share a single
+    capture device. Frames are encoded off the capture thread in a worker pool,
+    once per quality level in use, and a level still encoding the previous frame
+    skips the frame so encoding never backs up the capture. Frames of a static
+    scene are only published at a keep-alive rate if change detection is enabled.
+    Use
+    `CameraBroadcaster.get` to get the shared broadcaster of a camera. Capture
+    starts with the first subscriber or hold and stops once there have been none
+    for the idle timeout, so the camera stays warm for the next user.
+
+    Args:
+        source (int | str, optional): The camera device number, a video file path or
+        a synthetic source, see `open_capture`
+        width (int, optional): The width of the captured frames
+        height (int, optional): The height of the captured frames
+        frame_rate (int, optional): The maximum frame rate to capture at
+        idle_timeout (float, optional): Seconds to keep capturing without
+        subscribers or holds
+    """
+
+    _broadcasters = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(
+        self,
+        source: Optional[Union[int, str]] = None,
+        width: Optional[int] = None,
+        height: Optional[int] = None,
+        frame_rate: Optional[int] = None,
+        idle_timeout: Optional[float] = None,
+    ) -> None:
+        self.config = config.SENSOR['camera']
+        self.video_config = self.config['video']
+        self.stream_config = self.config['stream']
+        self.idle_timeout = (
+            self.config['idle_timeout'] if idle_timeout is None else idle_timeout
+        )
+
+        self.source = get_source(source)
+        self.width = width or self.video_config['width']
+        self.height = height or self.video_config['height']
+        self.frame_rate = frame_rate or self.video_config['frame_rate']
+
+        # Setup logging
+        self._logger = _logger
+
+        self.frames = FramePool()
+        self.change_detector = (
+            ChangeDetector()
+            if self.stream_config['change_detection']['enabled'] else None
+        )
+        self.frame_count = 0
+        self.encode_count = 0
+        self.static_count = 0
+        self.error_count = 0
+
+        self._subscribers = []
+        self._hold_count = 0
+        self._last_used = time.monotonic()
+        self._snapshot = None
+        self._snapshot_lock = threading.Lock()
+        self._encoder = None
+        self._encoding = set()
+        self._lock = threading.Lock()
+        self._capture_thread = None
+        self._stopping_thread = None
+        self._running = threading.Event()
+
+    @classmethod
+    def get(
+        cls,
+        source: Optional[Union[int, str]] = None,
+        **kwargs
+    ) -> 'CameraBroadcaster':
+        """
+        Get the shared broadcaster of a camera, creating it if needed. The capture
+        settings only apply when the broadcaster is created.
+
+        Args:
+            source (int | str, optional): The camera device number, a video file
+            path or a synthetic source
+            **kwargs: `CameraBroadcaster` capture settings
+
+        Returns:
+            CameraBroadcaster: The camera's broadcaster
+        """
+        source = get_source(source)
+
+        with cls._registry_lock:
+            broadcaster = cls._broadcasters.get(source)
+            if broadcaster is None:
+                broadcaster = cls(source=source, **kwargs)
+                cls._broadcasters[source] = broadcaster
+            return broadcaster
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    @property
+    def is_running(self) -> bool:
+        return self._running.is_set()
+
+    def subscribe(
+        self,
+        queue_size: Optional[int] = None,
+        level: int = 0,
+        adaptive: bool = True
+    ) -> CameraSubscriber:
+        """
+        Subscribe to the published frames, starting the capture if needed.
+
+        Args:
+            queue_size (int, optional): The number of frames to queue
+            level (int, optional): The index of the initial quality level
+            adaptive (bool, optional): Adapt the quality level to the client
+
+        Returns:
+            CameraSubscriber: The subscription, close it to unsubscribe
+        """
+        subscriber = CameraSubscriber(
+            self, queue_size=queue_size, level=level, adaptive=adaptive
+        )
+        with self._lock:
+            self._subscribers.append(subscriber)
+            if self.change_detector is not None:
+                self.change_detector.reset()
+            self._start()
+        return subscriber
+
+    @contextmanager
+    def hold(self) -> Iterator['CameraBroadcaster']:
+        """
+        Keep the capture running for consumers of the raw frames in `frames`, which
+        don't subscribe to the encoded frames.
+
+        Yields:
+            CameraBroadcaster: The broadcaster
+        """
+        with self._lock:
+            self._hold_count += 1
+            self._start()
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._hold_count -= 1
+                self._last_used = time.monotonic()
+
+    def snapshot(self, timeout: Optional[float] = None) -> Optional[bytes]:
+        """
+        Get the latest full quality JPEG frame from the cache, which the streams
+        keep up to date. Without streams the latest frame is encoded once and
+        cached for up to `snapshot_max_age` seconds, so polling more often than that
+        is cheap. Only checking and replacing the cache is locked, so a poll waiting
+        for the capture to open doesn't block the others. If the
+        capture isn't running it's opened and the snapshot waits for its first
+        frame, a cached frame from an earlier capture is never served. The capture
+        then stays warm for the idle timeout, so polling keeps it open.
+
+        Args:
+            timeout (float, optional): Seconds to wait for a frame if the capture
+            isn't running. Defaults to the video open timeout.
+
+        Returns:
+            bytes: The JPEG frame or `None` if the camera has no frames
+        """
+        timeout = self.video_config['open_timeout'] if timeout is None else timeout
+        max_age = self.stream_config['snapshot_max_age']
+        with self.hold():
+            frame = self.frames.wait_for_frame(frame_id=0, timeout=timeout)
+            if frame is None:
+                return None
+
+            with self._snapshot_lock:
+                # The waited for frame's buffer may have been reused since
+                frame = self.frames.latest or frame
+                snapshot = self._snapshot
+                if snapshot is not None and frame.timestamp - snapshot[0] < max_age:
+                    return snapshot[1]
+
+                quality, _ = self.stream_config['quality_levels'][0]
+                created, jpeg = cv2.imencode(
+                    '.jpg', frame.image, [cv2.IMWRITE_JPEG_QUALITY, quality]
+                )
+                if not created:
+                    return None
+                self._snapshot = (frame.timestamp, jpeg.tobytes())
+                return self._snapshot[1]
+
+    def unsubscribe(self, subscriber: CameraSubscriber) -> None:
+        """
+        Unsubscribe a subscriber, the capture stops once idle after the last one.
+
+        Args:
+            subscriber (CameraSubscriber): The subscription
+        """
+        with self._lock:
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+            self._last_used = time.monotonic()
+
+    def _start(self) -> None:
+        """
+        Start the background capture thread and the encoder if they aren't running,
+        must be called holding the lock.
+        """
+        self._running.set()
+        self._last_used = time.monotonic()
+        if self._encoder is None:
+            self._encoder = ThreadPoolExecutor(
+                max_workers=self.stream_config['encoder_workers'],
+                thread_name_prefix=f'camera-{self.source}-encoder'
+            )
+        if self._capture_thread is None:
+            self._capture_thread = threading.Thread(
+                target=self._capture, args=(self._stopping_thread, ), daemon=True
+            )
+            self._capture_thread.start()
+            self._logger.info(f'Broadcasting camera {self.source}.')
+
+    def stop(self) -> None:
+        """
+        Stop the background capture thread and end all the subscriptions.
+        """
+        with self._lock:
+            self._running.clear()
+            capture_thread = self._capture_thread or self._stopping_thread
+        if capture_thread is not None and capture_thread is not threading.current_thread():
+            capture_thread.join()
+
+    def _keep_capturing(self) -> bool:
+        """
+        Check if the capture should continue, i.e. it hasn't been stopped and there
+        are subscribers or holds, or were within the idle timeout. If not the
+        capture thread is released under the lock, so a new subscriber starts a new
+        thread rather than joining a stopping one.
+
+        Returns:
+            bool: True if the capture should continue
+        """
+        with self._lock:
+            in_use = (
+                self._subscribers or self._hold_count or
+                time.monotonic() - self._last_used < self.idle_timeout
+            )
+            if self._running.is_set() and in_use:
+                return True
+            self._running.clear()
+            self._stopping_thread = self._capture_thread
+            self._capture_thread = None
+
+            # Under the lock, so the next capture never sees a stale frame or snapshot
+            self.frames.clear()
+            self._snapshot = None
+
+            # The next capture starts a new encoder, this one finishes its frames
+            encoder, self._encoder = self._encoder, None
+
+            # End the subscriptions if the capture was stopped or failed
+            subscribers, self._subscribers = self._subscribers, []
+
+        if encoder is not None:
+            encoder.shutdown(wait=False)
+        for subscriber in subscribers:
+            subscriber.put(None)
+        return False
+
+    def _publish(self, frame: CameraFrame) -> None:
+        """
+        Submit a frame to be encoded for each quality level the subscribers are at,
+        skipping the levels which are still encoding, and unchanged frames.
+
+        Args:
+            frame (CameraFrame): The captured frame
+        """
+        if not self._subscribers:
+            return
+
+        if self.change_detector is not None:
+            if not self.change_detector.update(frame.image, frame.timestamp):
+                self.static_count += 1
+                return
+
+        levels = {}
+        with self._lock:
+            for subscriber in self._subscribers:
+                if subscriber.level not in self._encoding:
+                    levels.setdefault(subscriber.level, []).append(subscriber)
+            self._encoding.update(levels)
+
+        for level, subscribers in levels.items():
+            self._encoder.submit(self._encode, frame, level, subscribers)
+
+    def _encode(self, frame: CameraFrame, level: int, subscribers: list) -> None:
+        """
+        Encode a frame at a quality level and publish it to its subscribers.
+
+        Args:
+            frame (CameraFrame): The captured frame
+            level (int): The index of the quality level
+            subscribers (list): The subscribers at the level
+        """
+        try:
+            quality, scale = self.stream_config['quality_levels'][level]
+            image = frame.image
+            if scale != 1:
+                image = cv2.resize(
+                    image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA
+                )
+            created, jpeg = cv2.imencode(
+                '.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality]
+            )
+
+            # The frame's buffer is reused once the capture gets round to it again,
+            # in which case the encoded frame may be torn
+            latest = self.frames.latest
+            if latest is None or latest.frame_id - frame.frame_id >= self.frames.size - 1:
+                self._logger.debug(f'Discarded frame {frame.frame_id}, encoded late.')
+                return
+
+            if created:
+                self.encode_count += 1
+                jpeg_frame = jpeg.tobytes()
+                if level == 0:
+                    self._snapshot = (frame.timestamp, jpeg_frame)
+                for subscriber in subscribers:
+                    subscriber.put(jpeg_frame)
+        except Exception:
+            self._logger.exception('Failed to encode a frame.')
+        finally:
+            with self._lock:
+                self._encoding.discard(level)
+
+    def _capture(self, previous_thread: Optional[threading.Thread] = None) -> None:
+        """
+        Capture thread loop. Reads and publishes frames until stopped, at a fixed
+        rate so a fast source doesn't exceed the frame rate.
+
+        Args:
+            previous_thread (threading.Thread, optional): A stopping capture thread
+            to wait for, so it has released the camera before it's opened again
+        """
+        if previous_thread is not None:
+            previous_thread.join()
+
+        camera = open_capture(self.source)
+        camera.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+        camera.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+        if not camera.isOpened():
+            self._logger.error(f'Failed to open camera {self.source}.')
+            with self._lock:
+                self._running.clear()
+
+        # The first frames of a camera are often badly exposed
+        if isinstance(self.source, int):
+            for _ in range(self.video_config['warmup_frames']):
+                camera.grab()
+
+        # Video files are looped
+        is_file = isinstance(self.source, str) and os.path.isfile(self.source)
+
+        def read_frame() -> None:
+            # Capture straight into the frame pool rather than a new array
+            read, image = camera.read(image=self.frames.next_buffer())
+            if read and image is not None:
+                self.frame_count += 1
+                self._publish(self.frames.publish(image))
+            elif is_file and camera.get(cv2.CAP_PROP_POS_FRAMES) > 0:
+                camera.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            else:
+                self.error_count += 1
+                self._logger.debug('Failed to read a frame.')
+
+        try:
+            RateLoop(self.frame_rate).run(read_frame, self._keep_capturing)
+        finally:
+            camera.release()
+            self._logger.info(f'Stopped broadcasting camera {self.source}.')
+
+
+class VideoRecorder(object):
+    """
+    Writes frames to a video file in a background thread, fed through a bounded
+    queue so the producer never waits on encoding or disk I/O. Frames are copied
+    into a ring of preallocated slots, so the producer can pass views it doesn't
+    own, e.g. frame pool views. If the queue is full the frame is skipped and its
+    time is filled by repeating the next frame, keeping the video's timing.
+
+    Args:
+        file_path (str): The file path to save the video to
+        width (int): The width of the video
+        height (int): The height of the video
+        frame_rate (int): The frame rate of the video
+        queue_size (int, optional): The number of frames to queue
+    """
+
+    def __init__(
+        self,
+        file_path: str,
+        width: int,
+        height: int,
+        frame_rate: int,
+        queue_size: Optional[int] = None
+    ) -> None:
+        self.config = config.SENSOR['camera']['video']
+        self.file_path = file_path
+        self.width = width
+        self.height = height
+        self.frame_rate = frame_rate
+        self.queue_size = queue_size or self.config['queue_size']
+
+        # Setup logging
+        self._logger = _logger
+
+        self.frame_count = 0
+        self.skipped_count = 0
+
+        # The writer holds one slot and the queue the rest, the next is free
+        self._slots = np.zeros((self.queue_size + 2, height, width, 3), dtype=np.uint8)
+        self._slot_index = 0
+        self._pending_count = 0
+        self._frames = queue.Queue(maxsize=self.queue_size)
+
+        self._video = cv2.VideoWriter(
+            filename=file_path,
+            fourcc=cv2.VideoWriter_fourcc(*'XVID'),
+            fps=frame_rate,
+            frameSize=(width, height)
+        )
+        self._writer_thread = threading.Thread(target=self._write_frames, daemon=True)
+        self._writer_thread.start()
+
+    def __enter__(self) -> 'VideoRecorder':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def write(self, image: np.ndarray) -> bool:
+        """
+        Queue a frame for one frame interval of the video, resizing it to the video
+        size if needed.
+
+        Args:
+            image (np.ndarray): The frame
+
+        Returns:
+            bool: False if the queue was full and the frame was skipped
+        """
+        self._pending_count += 1
+
+        slot = self._slots[self._slot_index]
+        if image.shape == slot.shape:
+            np.copyto(slot, image)
+        else:
+            cv2.resize(image, (self.width, self.height), dst=slot)
+
+        try:
+            self._frames.put_nowait((self._slot_index, self._pending_count))
+        except queue.Full:
+            self.skipped_count += 1
+            return False
+
+        self._slot_index = (self._slot_index + 1) % len(self._slots)
+        self._pending_count = 0
+        return True
+
+    def _write_frames(self) -> None:
+        """
+        Writer thread loop. Writes each queued frame for as many frame intervals as
+        it covers, until the end of the queue is reached.
+        """
+        while True:
+            item = self._frames.get()
+            if item is None:
+                break
+
+            slot_index, repeat_count = item
+            for _ in range(repeat_count):
+                self._video.write(self._slots[slot_index])
+                self.frame_count += 1
+
+    def close(self) -> None:
+        """
+        Write the queued frames and close the video file.
+        """
+        if self._writer_thread is None:
+            return
+
+        self._frames.put(None)
+        self._writer_thread.join()
+        self._writer_thread = None
+        self._video.release()
+
+
+@dataclass
+class DashcamEvent:
+    reason: str
+    file_path: str
+    trigger_time: float
+    start_time: float
+    end_time: float
+
+
+class Dashcam(object):
+    """
+    Keeps the last few seconds of encoded frames from the camera's shared capture in
+    memory, bounded by duration and size, and saves them along with the following
+    seconds when an event is triggered, e.g. by an obstacle or an impact. Events
+    are saved without re-encoding as an MJPEG stream, which plays with e.g.
+    `ffplay -f mjpeg`, and a JSON index of the frame times.
+
+    Args:
+        source (int | str, optional): The camera device number, a video file path or
+        a synthetic source
+        duration (float, optional): Seconds of frames to keep before an event
+        max_bytes (int, optional): The maximum size of the kept frames
+        directory (str, optional): The directory to save events to
+    """
+
+    def __init__(
+        self,
+        source: Optional[Union[int, str]] = None,
+        duration: Optional[float] = None,
+        max_bytes: Optional[int] = None,
+        directory: Optional[str] = None,
+    ) -> None:
+        self.config = config.SENSOR['camera']['dashcam']
+        self.source = source
+        self.duration = duration or self.config['duration']
+        self.max_bytes = max_bytes or self.config['max_bytes']
+        self.directory = directory or self.config['directory']
+        self.post_event = self.config['post_event']
+
+        # Setup logging
+        self._logger = _logger
+
+        self.frames = collections.deque()
+        self.size = 0
+        self.event = None
+        self.event_count = 0
+
+        self._lock = threading.Lock()
+        self._subscriber = None
+        self._buffer_thread = None
+
+    def __enter__(self) -> 'Dashcam':
+        self.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        """
+        Start buffering frames in a background thread, or restart it if the
+        subscription ended, e.g. because the capture failed.
+        """
+        if self._buffer_thread is not None and self._buffer_thread.is_alive():
+            return
+
+        # The full quality frames, at their own pace rather than a viewer's
+        broadcaster = CameraBroadcaster.get(self.source)
+        self._subscriber = broadcaster.subscribe(queue_size=8, adaptive=False)
+        self._buffer_thread = threading.Thread(target=self._buffer, daemon=True)
+        self._buffer_thread.start()
+        self._logger.info(f'Dashcam buffering {self.duration}s of frames.')
+
+    def stop(self) -> None:
+        """
+        Stop buffering frames, saving a triggered event straight away.
+        """
+        buffer_thread = self._buffer_thread
+        if buffer_thread is None:
+            return
+
+        self._subscriber.close()
+        buffer_thread.join()
+
+    def _buffer(self) -> None:
+        """
+        Buffer thread loop. Adds the published frames to the buffer and saves a
+        triggered event once its post event frames are in. When the subscription
+        ends a triggered event is saved straight away and the thread is cleared, so
+        the dashcam can be started again.
+        """
+        while not self._subscriber.closed:
+            frame = self._subscriber.get(timeout=0.1)
+            now = time.monotonic()
+            if frame is not None:
+                self.add(frame, timestamp=now)
+            if self.event is not None and now >= self.event.end_time:
+                self._save()
+
+        if self.event is not None:
+            self._save()
+        with self._lock:
+            if self._buffer_thread is threading.current_thread():
+                self._buffer_thread = None
+
+    def add(self, frame: bytes, timestamp: Optional[float] = None) -> None:
+        """
+        Add an encoded frame to the buffer, dropping the oldest frames over the
+        duration or size. The frames of a triggered event are kept regardless of
+        the duration.
+
+        Args:
+            frame (bytes): The JPEG frame
+            timestamp (float, optional): The frame time. Defaults to now.
+        """
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        with self._lock:
+            self.frames.append((timestamp, frame))
+            self.size += len(frame)
+
+            start_time = timestamp - self.duration
+            if self.event is not None:
+                start_time = min(start_time, self.event.start_time)
+            while self.frames and (
+                self.frames[0][0] < start_time or self.size > self.max_bytes
+            ):
+                _, dropped_frame = self.frames.popleft()
+                self.size -= len(dropped_frame)
+
+    def trigger(self, reason: str = 'api') -> Optional[str]:
+        """
+        Trigger an event, saving the buffered frames and the next `post_event`
+        seconds of frames. Triggers during an event are part of that event.
+
+        Args:
+            reason (str, optional): The reason for the event, used in the file name
+
+        Returns:
+            str: The event's file path or `None` if an event is already triggered
+        """
+        reason = re.sub(r'[^\w-]', '_', reason)
+        now = time.monotonic()
+        with self._lock:
+            if self.event is not None:
+                return None
+
+            file_name = f'{time.strftime("%Y%m%d-%H%M%S")}-{reason}.mjpeg'
+            self.event = DashcamEvent(
+                reason=reason,
+                file_path=os.path.join(self.directory, file_name),
+                trigger_time=now,
+                start_time=now - self.duration,
+                end_time=now + self.post_event,
+            )
+        self._logger.info(f'Dashcam event triggered: {reason}.')
+        return self.event.file_path
+
+    def check_distance(self, distance: Optional[float]) -> bool:
+        """
+        Trigger an event on an obstacle closer than the configured distance.
+
+        Args:
+            distance (float): A lidar distance in cm
+
+        Returns:
+            bool: True if an event was triggered
+        """
+        if distance is None or distance >= self.config['obstacle_distance']:
+            return False
+        return self.trigger('obstacle') is not None
+
+    def check_impact(self, accelerometer: list) -> bool:
+        """
+        Trigger an event on an acceleration further from 1g than the configured
+        threshold, i.e. an impact or a fall.
+
+        Args:
+            accelerometer (list): Accelerometer x, y & z in g
+
+        Returns:
+            bool: True if an event was triggered
+        """
+        magnitude = float(np.linalg.norm(accelerometer))
+        if abs(magnitude - 1) <= self.config['impact_threshold']:
+            return False
+        return self.trigger('impact') is not None
+
+    def _save(self) -> None:
+        """
+        Save the triggered event's frames and index to disk.
+        """
+        with self._lock:
+            event, self.event = self.event, None
+            frames = [frame for frame in self.frames if frame[0] >= event.start_time]
+
+        os.makedirs(self.directory, exist_ok=True)
+        with open(event.file_path, 'wb') as event_file:
+            for _, frame in frames:
+                event_file.write(frame)
+
+        index_file_path = f'{os.path.splitext(event.file_path)[0]}.json'
+        with open(index_file_path, 'w') as index_file:
+            json.dump({
+                'reason': event.reason,
+                'frame_times': [
+                    round(timestamp - event.trigger_time, 3) for timestamp, _ in frames
+                ]
+            }, index_file)
+
+        self.event_count += 1
+        self._logger.info(f'Dashcam event saved to {event.file_path}.')
+
+
 class Camera(object):
     """
     A sensor class which initialises the camera component and adds image capture,
@@ -17,8 +1262,14 @@ class Camera(object):
 
     Args:
         camera_number (int, optional): The camera device number.
+        source (int | str, optional): A source instead of the camera device, i.e. a
+        video file path or a synthetic source, see `open_capture`.
     """
-    def __init__(self, camera_number: Optional[int] = None) -> None:
+    def __init__(
+        self,
+        camera_number: Optional[int] = None,
+        source: Optional[Union[int, str]] = None
+    ) -> None:
         self.config = config.SENSOR['camera']
         self.image_config = self.config['image']
         self.video_config = self.config['video']
@@ -27,37 +1278,73 @@ class Camera(object):
         self.camera_number = (
             self.config['camera_number'] if camera_number is None else camera_number
         )
+        if source is None and camera_number is not None:
+            source = self.camera_number
+        self.source = get_source(source)
 
         # Setup logging
         self._logger = _logger
 
+    def capture_burst(
+            self,
+            count: int,
+            width: Optional[int] = None,
+            height: Optional[int] = None,
+        ) -> list:
+        """
+        Capture a burst of consecutive frames from the camera's shared capture,
+        which stays open for the idle timeout so following captures are quick.
+
+        Args:
+            count (int): The number of frames, the first is the latest frame
+            width (str, optional): The wigth of the captured frames.
+            height (str, optional): The height of the captured frames.
+
+        Returns:
+            list: Copies of the frames, fewer if the camera stopped delivering them
+        """
+        width = width or self.image_config['width']
+        height = height or self.image_config['height']
+
+        broadcaster = CameraBroadcaster.get(self.source, width=width, height=height)
+        timeout = self.video_config['open_timeout']
+        images = []
+        with broadcaster.hold():
+            frame = broadcaster.frames.wait_for_frame(frame_id=0, timeout=timeout)
+            while frame is not None:
+                # Frames are resized if the capture was already open at another size
+                image = frame.image
+                if image.shape[:2] != (height, width):
+                    image = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+                images.append(image.copy())
+                if len(images) == count:
+                    break
+                frame = broadcaster.frames.wait_for_frame(frame.frame_id, timeout=timeout)
+        return images
+
     def capture_image(
             self,
             file_path: str,
             width: Optional[int] = None,
             height: Optional[int] = None,
+            best_of: Optional[int] = None,
         ) -> None:
         """
         Capture an image to file from the camera with optional width and height.
+        The latest frame is used if the camera is already capturing.
 
         Args:
             file_path (str): The file path to save the image to.
             width (str, optional): The wigth of the captured image.
             height (str, optional): The height of the captured image.
+            best_of (int, optional): Capture a burst of frames and keep the sharpest.
         """
-        width = width or self.image_config['width']
-        height = height or self.image_config['height']
-
         self._logger.info(f'Capturing image to {file_path}.')
 
         # Capture and save the image
-        camera = cv2.VideoCapture(self.camera_number)
-        camera.set(3, width)
-        camera.set(4, height)
-
-        _, image = camera.read()
+        images = self.capture_burst(best_of or 1, width=width, height=height)
+        image = max(images, key=get_sharpness) if images else None
         flipped_image = cv2.flip(image, 0) if image is not None else None
-        camera.release()
 
         if flipped_image is not None:
             cv2.imwrite(file_path, flipped_image)
@@ -65,6 +1352,18 @@ class Camera(object):
         else:
             self._logger.error(f'Failed to capture image.')
 
+    def get_snapshot(self) -> Optional[bytes]:
+        """
+        Get the latest JPEG frame from the camera's shared capture, cached so
+        frequent polling doesn't encode every time. Opens the camera if it isn't
+        capturing, see `CameraBroadcaster.snapshot`.
+
+        Returns:
+            bytes: The JPEG frame or `None` if the camera has no frames.
+        """
+        broadcaster = CameraBroadcaster.get(self.source)
+        return broadcaster.snapshot()
+
     def capture_video(
         self,
         file_path: str,
@@ -75,7 +1374,10 @@ class Camera(object):
     ) -> None:
         """
         Capture a video from the camera with option width, height, frame rate and
-        duration.
+        duration. The latest frame is taken from the camera's shared capture at
+        every frame interval, repeating a frame if the camera is slower than the
+        frame rate, and written by a `VideoRecorder` so the video has the correct
+        timing.
 
         Args:
             file_path (str): The file path to save the video to.
@@ -91,25 +1393,37 @@ class Camera(object):
 
         self._logger.info(f'Capturing video to {file_path}.')
 
-        # Capture and save the video
-        camera = cv2.VideoCapture(self.camera_number)
-
-        video = cv2.VideoWriter(
-            filename=file_path,
-            fourcc=cv2.VideoWriter_fourcc(*'XVID'),
-            fps=frame_rate,
-            frameSize=(width, height)
+        broadcaster = CameraBroadcaster.get(
+            self.source, width=width, height=height, frame_rate=frame_rate
         )
+        with broadcaster.hold():
+            frame = broadcaster.frames.wait_for_frame(
+                frame_id=0, timeout=self.video_config['open_timeout']
+            )
+            if frame is None:
+                self._logger.error(f'Failed to capture video.')
+                return
 
-        start_time = time.time()
-        while (time.time() - start_time) < duration:
-            _, image = camera.read()
-            video.write(image)
+            # Capture and save the video, paced to fixed deadlines
+            interval = 1 / frame_rate
+            repeated_count = 0
+            with VideoRecorder(file_path, width, height, frame_rate) as recorder:
+                start_time = time.monotonic()
+                for index in range(round(duration * frame_rate)):
+                    delay = start_time + (index * interval) - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
 
-        camera.release()
-        video.release()
+                    latest = broadcaster.frames.latest or frame
+                    if latest.frame_id == frame.frame_id and index > 0:
+                        repeated_count += 1
+                    frame = latest
+                    recorder.write(frame.image)
 
-        self._logger.info(f'Video captured to {file_path}.')
+        self._logger.info(
+            f'Video captured to {file_path}, {recorder.frame_count} frames, '
+            f'{repeated_count} repeated and {recorder.skipped_count} skipped.'
+        )
 
     def stream_video(
             self,
@@ -119,41 +1433,30 @@ class Camera(object):
         ) -> Generator:
         """
         Stream video from the camera with optional width, height and frame rate.
+        All streams of a camera share its `CameraBroadcaster`, the width, height
+        and frame rate only apply if the camera isn't already being streamed.
 
         Args:
             width (str, optional): The wigth of the captured video.
             height (str, optional): The height of the captured video.
             frame_rate (str, optional): The frame rate of the captured video.
         """
-        width = width or self.video_config['width']
-        height = height or self.video_config['height']
-        frame_rate = frame_rate or self.video_config['frame_rate']
-
         self._logger.info(f'Streaming video from camera.')
 
-        # Stream video from the camera
-        camera = cv2.VideoCapture(self.camera_number)
-        camera.set(3, width)
-        camera.set(4, height)
-
-        while True:
-            _, frame = camera.read()
-            created, jpeg = cv2.imencode('.jpg', frame)
-            if not created:
-                continue
-
-            jpeg_frame = jpeg.tobytes()
-            content_length = len(jpeg_frame)
-
-            yield (
-                b'--frame\r\n'
-                b'Content-Type: image/jpeg\r\n'
-                b'Content-Length: ' + str(content_length).encode() + b'\r\n'
-                b'\r\n' + jpeg_frame + b'\r\n\r\n'
-            )
-
-            if cv2.waitKey(1) == 27:
-                break
+        # Subscribe to the camera's shared capture
+        broadcaster = CameraBroadcaster.get(
+            self.source, width=width, height=height, frame_rate=frame_rate
+        )
+        subscriber = broadcaster.subscribe()
+        try:
+            for jpeg_frame in subscriber:
+                content_length = len(jpeg_frame)
 
-        cv2.destroyAllWindows()
-        camera.release()
+                yield (
+                    b'--frame\r\n'
+                    b'Content-Type: image/jpeg\r\n'
+                    b'Content-Length: ' + str(content_length).encode() + b'\r\n'
+                    b'\r\n' + jpeg_frame + b'\r\n\r\n'
+                )
+        finally:
+            subscriber.close()
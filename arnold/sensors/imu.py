@@ -1,15 +1,171 @@
+import json
 import logging
 import math
-from typing import Optional
+import os
+import threading
+import time
+from typing import Callable, Optional
 
+import numpy as np
 from mpu9250_jmdev.mpu_9250 import MPU9250
-from mpu9250_jmdev.registers import AK8963_MODE_C100HZ
+from mpu9250_jmdev.registers import (
+    ACCEL_CONFIG, ACCEL_OUT, ACCEL_SCALE_MODIFIER_2G, ACCEL_SCALE_MODIFIER_4G,
+    ACCEL_SCALE_MODIFIER_8G, ACCEL_SCALE_MODIFIER_16G, AFS_2G, AFS_4G, AFS_8G, AFS_16G,
+    AK8963_BIT_14, AK8963_BIT_16, AK8963_CNTL1, AK8963_MAGNET_OUT, AK8963_MODE_C100HZ,
+    GFS_250, GFS_500, GFS_1000, GFS_2000, GYRO_CONFIG, GYRO_SCALE_MODIFIER_250DEG,
+    GYRO_SCALE_MODIFIER_500DEG, GYRO_SCALE_MODIFIER_1000DEG, GYRO_SCALE_MODIFIER_2000DEG,
+    INT_PIN_CFG, MAGNOMETER_SCALE_MODIFIER_BIT_14, MAGNOMETER_SCALE_MODIFIER_BIT_16,
+    PWR_MGMT_1
+)
 
 from arnold import config
+from arnold.utils import RateLoop
 
 
 _logger = logging.getLogger(__name__)
 
+AXES = ('x', 'y', 'z')
+
+# Accelerometer (6), temperature (2) and gyroscope (6) registers are contiguous from
+# ACCEL_OUT, the magnetometer's data and status registers (7) are on the AK8963
+MPU_BURST_SIZE = 14
+AK8963_BURST_SIZE = 7
+
+# Full scale settings to the resolution `configure` would set
+GYROSCOPE_SCALES = {
+    GFS_250: GYRO_SCALE_MODIFIER_250DEG,
+    GFS_500: GYRO_SCALE_MODIFIER_500DEG,
+    GFS_1000: GYRO_SCALE_MODIFIER_1000DEG,
+    GFS_2000: GYRO_SCALE_MODIFIER_2000DEG,
+}
+ACCELEROMETER_SCALES = {
+    AFS_2G: ACCEL_SCALE_MODIFIER_2G,
+    AFS_4G: ACCEL_SCALE_MODIFIER_4G,
+    AFS_8G: ACCEL_SCALE_MODIFIER_8G,
+    AFS_16G: ACCEL_SCALE_MODIFIER_16G,
+}
+MAGNETOMETER_SCALES = {
+    AK8963_BIT_14: MAGNOMETER_SCALE_MODIFIER_BIT_14,
+    AK8963_BIT_16: MAGNOMETER_SCALE_MODIFIER_BIT_16,
+}
+
+ATTITUDE_DTYPE = np.dtype([('roll', '<f8'), ('pitch', '<f8'), ('yaw', '<f8')])
+
+# A single sample of all 9 axes and the temperature
+SAMPLE_DTYPE = np.dtype([
+    ('timestamp', '<f8'),
+    ('accelerometer', '<f4', 3),
+    ('gyroscope', '<f4', 3),
+    ('magnetometer', '<f4', 3),
+    ('temperature', '<f4'),
+])
+
+
+def get_attitudes(accelerometer: np.ndarray, magnetometer: np.ndarray) -> np.ndarray:
+    """
+    The vectorised counterpart of `IMU.get_attitude`, calculating the roll, pitch
+    and yaw of N samples in one batch, e.g. from a recorded log or an `IMUSampler`
+    window.
+
+    Args:
+        accelerometer (np.ndarray): N x 3 accelerometer x, y & z data
+        magnetometer (np.ndarray): N x 3 magnetometer x, y & z data
+
+    Returns:
+        np.ndarray: N roll, pitch and yaw estimates in degrees
+    """
+    accelerometer = np.asarray(accelerometer, dtype=np.float64).reshape(-1, 3)
+    magnetometer = np.asarray(magnetometer, dtype=np.float64).reshape(-1, 3)
+    ax, ay, az = accelerometer.T
+    mx, my, mz = magnetometer.T
+
+    roll = np.arctan2(ax, np.sqrt(ay * ay + az * az))
+    pitch = np.arctan2(ay, np.sqrt(ax * ax + az * az))
+    sin_roll, cos_roll = np.sin(roll), np.cos(roll)
+    sin_pitch, cos_pitch = np.sin(pitch), np.cos(pitch)
+    yaw = np.arctan2(
+        -((my * cos_roll) - (mz * sin_roll)),
+        (mx * cos_pitch) + (my * sin_roll * sin_pitch) + (mz * cos_roll * sin_pitch)
+    )
+
+    attitudes = np.empty(len(accelerometer), dtype=ATTITUDE_DTYPE)
+    attitudes['roll'] = np.degrees(roll)
+    attitudes['pitch'] = np.degrees(pitch)
+    attitudes['yaw'] = np.degrees(yaw)
+    return attitudes
+
+
+class IMUCalibrationStore(object):
+    """
+    Persists IMU calibrations to a JSON file keyed by the module's I2C address, so
+    a calibration survives restarts instead of being redone on every boot.
+
+    Args:
+        file_path (str, optional): The calibration file path
+    """
+
+    def __init__(self, file_path: Optional[str] = None) -> None:
+        self.config = config.SENSOR['imu']
+        self.file_path = file_path or self.config['calibration_file']
+
+        # Setup logging
+        self._logger = _logger
+
+    @staticmethod
+    def _key(address: int) -> str:
+        return f'{address:#04x}'
+
+    def _read(self) -> dict:
+        """
+        Read all the calibrations from the file.
+
+        Returns:
+            dict: Calibrations keyed by address, empty if there is no valid file
+        """
+        try:
+            with open(self.file_path) as calibration_file:
+                return json.load(calibration_file)
+        except FileNotFoundError:
+            return {}
+        except ValueError as exc:
+            self._logger.warning(
+                f'Ignoring invalid IMU calibration file {self.file_path}: {exc}'
+            )
+            return {}
+
+    def load(self, address: int) -> Optional[dict]:
+        """
+        Load the calibration of a module.
+
+        Args:
+            address (int): I2C address of the module
+
+        Returns:
+            dict: The calibration or `None` if the module hasn't been calibrated
+        """
+        return self._read().get(self._key(address))
+
+    def save(self, address: int, calibration: dict) -> None:
+        """
+        Save the calibration of a module, keeping those of other modules. The file
+        is replaced atomically so a crash can't leave it half written.
+
+        Args:
+            address (int): I2C address of the module
+            calibration (dict): Lists of floats keyed by name, e.g. `gyroscope`
+        """
+        calibrations = self._read()
+        calibrations[self._key(address)] = {
+            key: [float(value) for value in values]
+            for key, values in calibration.items()
+        }
+
+        temp_file_path = f'{self.file_path}.tmp'
+        with open(temp_file_path, 'w') as calibration_file:
+            json.dump(calibrations, calibration_file, indent=2)
+        os.replace(temp_file_path, self.file_path)
+        self._logger.info(f'Saved IMU calibration to {self.file_path}')
+
 
 class IMU(object):
     """
@@ -20,18 +176,23 @@ class IMU(object):
         address (str, optional): I2C address of the device
         orientation (dict, optional): Orientation map based on the physical position
         of the module on Arnold
+        calibration_file (str, optional): The calibration store file path
     """
 
     def __init__(
         self,
         address: Optional[str] = None,
-        orientation: Optional[dict] = None
+        orientation: Optional[dict] = None,
+        calibration_file: Optional[str] = None
     ) -> None:
         self.config = config.SENSOR['imu']
 
         # Module config
         self.address = int(address or self.config['address'], 16)
         self.orientation = orientation or self.config['orientation']
+        self.orientation_index = [
+            AXES.index(self.orientation[axis]) for axis in AXES
+        ]
 
         # Setup logging
         self._logger = _logger
@@ -41,45 +202,127 @@ class IMU(object):
             mode=AK8963_MODE_C100HZ,
         )
 
-        # Set the bias from a previous calibration using the saved config
-        self.abias = self.config['bias']['accelerometer']
-        self.gbias = self.config['bias']['gyroscope']
-        self.mbias = self.config['bias']['magnetometer']
+        # Apply a previous calibration from the store, falling back to the config
+        self.calibration_store = IMUCalibrationStore(calibration_file)
+        calibration = self.calibration_store.load(self.address) or {}
+        bias = self.config['bias']
+        self.abias = list(calibration.get('accelerometer', bias['accelerometer']))
+        self.gbias = list(calibration.get('gyroscope', bias['gyroscope']))
+        self.mbias = list(calibration.get('magnetometer', bias['magnetometer']))
+        self.sensor.abias = self.abias
+        self.sensor.gbias = self.gbias
+        self.sensor.mbias = self.mbias
+        self.sensor.magScale = list(calibration.get('magnetometer_scale', [1, 1, 1]))
+
+        # The module keeps its configuration while powered, so the slow configure
+        # is skipped if it's still configured and the magnetometer's fuse ROM
+        # coefficients are stored
+        coefficients = calibration.get('magnetometer_coefficients')
+        if coefficients is not None and self._is_configured():
+            self._restore_configuration(coefficients)
+            self._logger.info('IMU already configured, skipped configuration')
+        else:
+            self.sensor.configure()
+
+    def _is_configured(self) -> bool:
+        """
+        Check if the module's registers are set as `configure` would set them.
 
-        self.sensor.configure()
+        Returns:
+            bool: True if the module is configured
+        """
+        sensor = self.sensor
+        try:
+            return bool(
+                sensor.readMaster(PWR_MGMT_1, 1)[0] == 0x01 and
+                sensor.readMaster(GYRO_CONFIG, 1)[0] & 0x18 == sensor.gfs << 3 and
+                sensor.readMaster(ACCEL_CONFIG, 1)[0] & 0x18 == sensor.afs << 3 and
+                sensor.readMaster(INT_PIN_CFG, 1)[0] & 0x02 and
+                sensor.readAK(AK8963_CNTL1, 1)[0] == (sensor.mfs << 4 | sensor.mode)
+            )
+        except OSError:
+            return False
 
-    def _get_data(self, data: list) -> dict:
+    def _restore_configuration(self, coefficients: list) -> None:
+        """
+        Restore the resolutions and magnetometer coefficients `configure` would
+        have set without writing to the module.
+
+        Args:
+            coefficients (list): The magnetometer's fuse ROM coefficients
+        """
+        self.sensor.gres = GYROSCOPE_SCALES[self.sensor.gfs]
+        self.sensor.ares = ACCELEROMETER_SCALES[self.sensor.afs]
+        self.sensor.mres = MAGNETOMETER_SCALES[self.sensor.mfs]
+        self.sensor.magCalibration = list(coefficients)
+
+    def _map_orientation(self, data: list) -> list:
         """
-        Map the x, y & z list to a dict and round the readings.
+        Map x, y & z based on the physical orientation of the module.
 
         Args:
-            data (dict): The original axes to be mapped
+            data (list): The original x, y & z readings
 
         Returns:
-            dict: Mapped axes dict
+            list: Mapped x, y & z readings
         """
-        return {'x': data[0], 'y': data[1], 'z': data[2]}
+        x, y, z = self.orientation_index
+        return [data[x], data[y], data[z]]
 
-    def _map_orientation(self, data: dict) -> dict:
+    def _get_data(self, data: list) -> dict:
         """
-        Map x, y & z based on the physical orientation of the module.
+        Map the x, y & z list to a dict based on the physical orientation of the
+        module.
 
         Args:
-            data (dict): The original axes to be mapped
+            data (list): The original x, y & z readings
 
         Returns:
             dict: Mapped axes dict
         """
-        return {
-            new_key: data[old_key]
-            for new_key, old_key in self.orientation.items()
-        }
+        x, y, z = self.orientation_index
+        return {'x': data[x], 'y': data[y], 'z': data[z]}
 
     def calibrate(self) -> None:
         """
-        Calibrate all 3 MPU-9250 sensors.
+        Calibrate all 3 MPU-9250 sensors. Calibration resets the module, so it's
+        configured again afterwards. Use `save_calibration` to keep the result.
         """
         self.sensor.calibrate()
+        self.sensor.configure()
+
+        self.abias = list(self.sensor.abias)
+        self.gbias = list(self.sensor.gbias)
+        self.mbias = list(self.sensor.mbias)
+
+    def save_calibration(self) -> None:
+        """
+        Save the current calibration to the calibration store.
+        """
+        self.calibration_store.save(self.address, {
+            'accelerometer': self.sensor.abias,
+            'gyroscope': self.sensor.gbias,
+            'magnetometer': self.sensor.mbias,
+            'magnetometer_scale': self.sensor.magScale,
+            'magnetometer_coefficients': self.sensor.magCalibration,
+        })
+
+    def update_gyroscope_bias(self, residual: list, rate: float = 1.0) -> None:
+        """
+        Adjust the gyroscope bias by a residual measured while stationary.
+
+        Args:
+            residual (list): The mean x, y & z gyroscope readings while stationary,
+            in Arnold's orientation
+            rate (float, optional): The fraction of the residual to apply
+        """
+        gbias = list(self.sensor.gbias)
+        for axis, index in enumerate(self.orientation_index):
+            gbias[index] += rate * residual[axis]
+
+        # Replace rather than update the list, a concurrent read uses either bias
+        self.gbias = self.sensor.gbias = gbias
+        self._logger.debug(f'Gyroscope bias: {gbias}')
 
     def get_accelerometer_data(self) -> dict:
         """
@@ -91,8 +334,8 @@ class IMU(object):
         data = self._get_data(
             self.sensor.readAccelerometerMaster()
         )
-        self._logger.info(f'Accelerometer: {data}')
-        return self._map_orientation(data)
+        self._logger.debug(f'Accelerometer: {data}')
+        return data
 
     def get_gyroscope_data(self) -> dict:
         """
@@ -104,8 +347,8 @@ class IMU(object):
         data = self._get_data(
             self.sensor.readGyroscopeMaster()
         )
-        self._logger.info(f'Gyroscope: {data}')
-        return self._map_orientation(data)
+        self._logger.debug(f'Gyroscope: {data}')
+        return data
 
     def get_magnetometer_data(self) -> dict:
         """
@@ -117,8 +360,8 @@ class IMU(object):
         data = self._get_data(
             self.sensor.readMagnetometerMaster()
         )
-        self._logger.info(f'Magnetometer: {data}')
-        return self._map_orientation(data)
+        self._logger.debug(f'Magnetometer: {data}')
+        return data
 
     def get_temperature(self) -> float:
         """
@@ -128,9 +371,45 @@ class IMU(object):
             float: Temperature in celsius
         """
         temperature = self.sensor.readTemperatureMaster()
-        self._logger.info(f'Temperature: {temperature}')
+        self._logger.debug(f'Temperature: {temperature}')
         return temperature
 
+    def read_all(self, out: Optional[np.void] = None) -> np.void:
+        """
+        Read every channel in one burst read of the MPU-6500 registers and one of
+        the AK8963 registers, instead of a transaction per channel, so the channels
+        are time coherent.
+
+        Args:
+            out (np.void, optional): A `SAMPLE_DTYPE` record to read into, such as a
+            slot in a sample buffer. Defaults to a new record.
+
+        Raises:
+            OSError: Raised if the I2C read fails
+
+        Returns:
+            np.void: The `SAMPLE_DTYPE` record
+        """
+        if out is None:
+            out = np.zeros(1, dtype=SAMPLE_DTYPE)[0]
+
+        timestamp = time.monotonic()
+        data = self.sensor.readMaster(ACCEL_OUT, MPU_BURST_SIZE)
+        magnetometer_data = self.sensor.readAK(AK8963_MAGNET_OUT, AK8963_BURST_SIZE)
+
+        out['timestamp'] = timestamp
+        out['accelerometer'] = self._map_orientation(
+            self.sensor.convertAccelerometer(data[0:6], self.sensor.abias)
+        )
+        out['temperature'] = self.sensor.convertTemperature(data[6:8])
+        out['gyroscope'] = self._map_orientation(
+            self.sensor.convertGyroscope(data[8:14], self.sensor.gbias)
+        )
+        out['magnetometer'] = self._map_orientation(
+            self.sensor.convertMagnetometer(magnetometer_data)
+        )
+        return out
+
     def get_attitude(
         self,
         accelerometer_data: Optional[dict] = None,
@@ -151,23 +430,22 @@ class IMU(object):
         accelerometer_data = accelerometer_data or self.get_accelerometer_data()
         magnetometer_data = magnetometer_data or self.get_magnetometer_data()
 
-        roll = 180 * math.atan2(
+        # The trig works in radians, convert to degrees once all three are known
+        roll = math.atan2(
             accelerometer_data['x'],
             math.sqrt(
                 (accelerometer_data['y'] * accelerometer_data['y']) +
                 (accelerometer_data['z'] * accelerometer_data['z'])
-            ) / math.pi
+            )
         )
-        pitch = 180 * math.atan2(
+        pitch = math.atan2(
             accelerometer_data['y'],
             math.sqrt(
-                (
-                    (accelerometer_data['x'] * accelerometer_data['x']) +
-                    (accelerometer_data['z'] * accelerometer_data['z'])
-                ) / math.pi
+                (accelerometer_data['x'] * accelerometer_data['x']) +
+                (accelerometer_data['z'] * accelerometer_data['z'])
             )
         )
-        yaw = 180 * math.atan2(
+        yaw = math.atan2(
             -(
                 (magnetometer_data['y'] * math.cos(roll)) -
                 (magnetometer_data['z'] * math.sin(roll))
@@ -176,11 +454,422 @@ class IMU(object):
                 (magnetometer_data['x'] * math.cos(pitch)) +
                 (magnetometer_data['y'] * math.sin(roll) * math.sin(pitch)) +
                 (magnetometer_data['z'] * math.cos(roll) * math.sin(pitch))
-            ) / math.pi
+            )
         )
 
         return {
-            'roll': roll,
-            'pitch': pitch,
-            'yaw': yaw
+            'roll': math.degrees(roll),
+            'pitch': math.degrees(pitch),
+            'yaw': math.degrees(yaw)
         }
+
+
+class AttitudeEstimator(object):
+    """
+    A Madgwick sensor fusion filter which incrementally integrates gyroscope
+    samples into an orientation quaternion, corrected towards the accelerometer's
+    gravity vector and the magnetometer's heading. Each update is O(1) and the
+    current attitude is always available without touching the sensor.
+
+    Args:
+        gain (float, optional): The filter gain (beta). Higher values trust the
+        accelerometer and magnetometer more, lower values the gyroscope.
+    """
+
+    def __init__(self, gain: Optional[float] = None) -> None:
+        self.config = config.SENSOR['imu']
+        self.gain = gain or self.config['fusion_gain']
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Reset the orientation, the next update initialises it from the
+        accelerometer and magnetometer.
+        """
+        self.quaternion = (1.0, 0.0, 0.0, 0.0)
+        self.timestamp = None
+
+    def _initialise(self, accelerometer: list, magnetometer: Optional[list]) -> None:
+        """
+        Initialise the orientation from a single accelerometer and magnetometer
+        sample so the filter doesn't have to converge from level and north.
+
+        Args:
+            accelerometer (list): Accelerometer x, y & z in g
+            magnetometer (list, optional): Magnetometer x, y & z in uT
+        """
+        ax, ay, az = accelerometer
+        roll = math.atan2(ay, az)
+        pitch = math.atan2(-ax, math.sqrt(ay * ay + az * az))
+        yaw = 0.0
+        if magnetometer is not None and any(magnetometer):
+            mx, my, mz = magnetometer
+            yaw = math.atan2(
+                (mz * math.sin(roll)) - (my * math.cos(roll)),
+                (mx * math.cos(pitch)) +
+                (my * math.sin(pitch) * math.sin(roll)) +
+                (mz * math.sin(pitch) * math.cos(roll))
+            )
+
+        cr, sr = math.cos(roll / 2), math.sin(roll / 2)
+        cp, sp = math.cos(pitch / 2), math.sin(pitch / 2)
+        cy, sy = math.cos(yaw / 2), math.sin(yaw / 2)
+        self.quaternion = (
+            cr * cp * cy + sr * sp * sy,
+            sr * cp * cy - cr * sp * sy,
+            cr * sp * cy + sr * cp * sy,
+            cr * cp * sy - sr * sp * cy,
+        )
+
+    def update(
+        self,
+        accelerometer: list,
+        gyroscope: list,
+        magnetometer: Optional[list] = None,
+        timestamp: Optional[float] = None
+    ) -> None:
+        """
+        Fuse a sample into the orientation. Without a magnetometer sample only roll
+        and pitch are corrected and yaw is integrated from the gyroscope.
+
+        Args:
+            accelerometer (list): Accelerometer x, y & z in g
+            gyroscope (list): Gyroscope x, y & z in degrees per second
+            magnetometer (list, optional): Magnetometer x, y & z in uT, in the same
+            frame as the accelerometer
+            timestamp (float, optional): The monotonic sample time. Defaults to now.
+        """
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        if self.timestamp is None:
+            self.timestamp = timestamp
+            self._initialise(accelerometer, magnetometer)
+            return
+
+        dt = timestamp - self.timestamp
+        self.timestamp = timestamp
+        if dt <= 0:
+            return
+
+        q0, q1, q2, q3 = self.quaternion
+        gx, gy, gz = (math.radians(value) for value in gyroscope)
+        ax, ay, az = accelerometer
+
+        # Rate of change of the quaternion from the gyroscope
+        q_dot0 = 0.5 * (-q1 * gx - q2 * gy - q3 * gz)
+        q_dot1 = 0.5 * (q0 * gx + q2 * gz - q3 * gy)
+        q_dot2 = 0.5 * (q0 * gy - q1 * gz + q3 * gx)
+        q_dot3 = 0.5 * (q0 * gz + q1 * gy - q2 * gx)
+
+        # Gradient descent corrective step, skipped if the accelerometer is invalid
+        norm = math.sqrt(ax * ax + ay * ay + az * az)
+        if norm:
+            ax, ay, az = ax / norm, ay / norm, az / norm
+            if magnetometer is not None and any(magnetometer):
+                step = self._marg_step(q0, q1, q2, q3, ax, ay, az, *magnetometer)
+            else:
+                step = self._imu_step(q0, q1, q2, q3, ax, ay, az)
+
+            s0, s1, s2, s3 = step
+            norm = math.sqrt(s0 * s0 + s1 * s1 + s2 * s2 + s3 * s3)
+            if norm:
+                q_dot0 -= self.gain * s0 / norm
+                q_dot1 -= self.gain * s1 / norm
+                q_dot2 -= self.gain * s2 / norm
+                q_dot3 -= self.gain * s3 / norm
+
+        q0 += q_dot0 * dt
+        q1 += q_dot1 * dt
+        q2 += q_dot2 * dt
+        q3 += q_dot3 * dt
+        norm = math.sqrt(q0 * q0 + q1 * q1 + q2 * q2 + q3 * q3)
+        self.quaternion = (q0 / norm, q1 / norm, q2 / norm, q3 / norm)
+
+    @staticmethod
+    def _imu_step(q0, q1, q2, q3, ax, ay, az) -> tuple:
+        """
+        The objective function gradient for gravity only.
+        """
+        q0q0, q1q1, q2q2, q3q3 = q0 * q0, q1 * q1, q2 * q2, q3 * q3
+        return (
+            4 * q0 * q2q2 + 2 * q2 * ax + 4 * q0 * q1q1 - 2 * q1 * ay,
+            4 * q1 * q3q3 - 2 * q3 * ax + 4 * q0q0 * q1 - 2 * q0 * ay - 4 * q1 +
+            8 * q1 * q1q1 + 8 * q1 * q2q2 + 4 * q1 * az,
+            4 * q0q0 * q2 + 2 * q0 * ax + 4 * q2 * q3q3 - 2 * q3 * ay - 4 * q2 +
+            8 * q2 * q1q1 + 8 * q2 * q2q2 + 4 * q2 * az,
+            4 * q1q1 * q3 - 2 * q1 * ax + 4 * q2q2 * q3 - 2 * q2 * ay,
+        )
+
+    @staticmethod
+    def _marg_step(q0, q1, q2, q3, ax, ay, az, mx, my, mz) -> tuple:
+        """
+        The objective function gradient for gravity and the earth's magnetic field.
+        """
+        norm = math.sqrt(mx * mx + my * my + mz * mz)
+        mx, my, mz = mx / norm, my / norm, mz / norm
+
+        q0q0, q0q1, q0q2, q0q3 = q0 * q0, q0 * q1, q0 * q2, q0 * q3
+        q1q1, q1q2, q1q3 = q1 * q1, q1 * q2, q1 * q3
+        q2q2, q2q3, q3q3 = q2 * q2, q2 * q3, q3 * q3
+
+        # Reference direction of the earth's magnetic field
+        hx = (
+            mx * q0q0 - 2 * q0 * my * q3 + 2 * q0 * mz * q2 + mx * q1q1 +
+            2 * q1 * my * q2 + 2 * q1 * mz * q3 - mx * q2q2 - mx * q3q3
+        )
+        hy = (
+            2 * q0 * mx * q3 + my * q0q0 - 2 * q0 * mz * q1 + 2 * q1 * mx * q2 -
+            my * q1q1 + my * q2q2 + 2 * q2 * mz * q3 - my * q3q3
+        )
+        # Twice the horizontal and vertical components of the reference field
+        bx = math.sqrt(hx * hx + hy * hy)
+        bz = (
+            -2 * q0 * mx * q2 + 2 * q0 * my * q1 + mz * q0q0 + 2 * q1 * mx * q3 -
+            mz * q1q1 + 2 * q2 * my * q3 - mz * q2q2 + mz * q3q3
+        )
+
+        # Objective function errors for gravity (f1-f3) and the field (f4-f6)
+        f1 = 2 * (q1q3 - q0q2) - ax
+        f2 = 2 * (q0q1 + q2q3) - ay
+        f3 = 1 - 2 * (q1q1 + q2q2) - az
+        f4 = bx * (0.5 - q2q2 - q3q3) + bz * (q1q3 - q0q2) - mx
+        f5 = bx * (q1q2 - q0q3) + bz * (q0q1 + q2q3) - my
+        f6 = bx * (q0q2 + q1q3) + bz * (0.5 - q1q1 - q2q2) - mz
+
+        return (
+            -2 * q2 * f1 + 2 * q1 * f2 - bz * q2 * f4 +
+            (-bx * q3 + bz * q1) * f5 + bx * q2 * f6,
+            2 * q3 * f1 + 2 * q0 * f2 - 4 * q1 * f3 + bz * q3 * f4 +
+            (bx * q2 + bz * q0) * f5 + (bx * q3 - 2 * bz * q1) * f6,
+            -2 * q0 * f1 + 2 * q3 * f2 - 4 * q2 * f3 +
+            (-2 * bx * q2 - bz * q0) * f4 + (bx * q1 + bz * q3) * f5 +
+            (bx * q0 - 2 * bz * q2) * f6,
+            2 * q1 * f1 + 2 * q2 * f2 + (-2 * bx * q3 + bz * q1) * f4 +
+            (-bx * q0 + bz * q2) * f5 + bx * q1 * f6,
+        )
+
+    @property
+    def attitude(self) -> dict:
+        """
+        The current roll, pitch and yaw from the orientation quaternion.
+
+        Returns:
+            dict: Roll, pitch and yaw in degrees
+        """
+        q0, q1, q2, q3 = self.quaternion
+        return {
+            'roll': math.degrees(
+                math.atan2(2 * (q0 * q1 + q2 * q3), 1 - 2 * (q1 * q1 + q2 * q2))
+            ),
+            'pitch': math.degrees(
+                math.asin(max(-1.0, min(1.0, 2 * (q0 * q2 - q3 * q1))))
+            ),
+            'yaw': math.degrees(
+                math.atan2(2 * (q0 * q3 + q1 * q2), 1 - 2 * (q2 * q2 + q3 * q3))
+            ),
+        }
+
+    @property
+    def heading(self) -> float:
+        """
+        The current heading (yaw) in degrees.
+
+        Returns:
+            float: heading
+        """
+        return self.attitude['yaw']
+
+
+class IMUSampler(object):
+    """
+    Polls the IMU at a fixed rate in a background thread into a preallocated ring
+    buffer, so consumers read the latest sample or a window of samples without
+    blocking on I2C. The buffer holds every sample twice, at its slot and at its
+    slot plus the buffer size, so any window is a contiguous view. Views are live
+    and are overwritten as the buffer wraps, copy them to keep them.
+
+    Args:
+        imu (IMU): The IMU to sample
+        sample_rate (int, optional): The sample rate in Hz
+        buffer_size (int, optional): The number of samples to keep
+        estimator (AttitudeEstimator, optional): An attitude estimator to update
+        with every sample
+        track_bias (bool, optional): Re-estimate the gyroscope bias while Arnold is
+        stationary, saving it to the calibration store on stop
+        callback (callable, optional): Called from the sampler thread with every
+        sample, a view into the ring buffer
+    """
+
+    def __init__(
+        self,
+        imu: IMU,
+        sample_rate: Optional[int] = None,
+        buffer_size: Optional[int] = None,
+        estimator: Optional[AttitudeEstimator] = None,
+        track_bias: Optional[bool] = None,
+        callback: Optional[Callable[[np.void], None]] = None
+    ) -> None:
+        self.config = config.SENSOR['imu']
+        self.imu = imu
+        self.estimator = estimator
+        self.callback = callback
+        self.sample_rate = sample_rate or self.config['sample_rate']
+        self.buffer_size = buffer_size or self.config['buffer_size']
+
+        self.bias_tracking = self.config['bias_tracking']
+        self.track_bias = (
+            self.bias_tracking['enabled'] if track_bias is None else track_bias
+        )
+        self.bias_update_count = 0
+
+        # Setup logging
+        self._logger = _logger
+
+        self.buffer = np.zeros(self.buffer_size * 2, dtype=SAMPLE_DTYPE)
+        self.count = 0
+        self.error_count = 0
+
+        self._index = -1
+        self._loop = RateLoop(self.sample_rate)
+        self._sampler_thread = None
+        self._running = threading.Event()
+
+    def __enter__(self) -> 'IMUSampler':
+        self.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        """
+        Start the background sampler thread.
+        """
+        if self._sampler_thread is not None and self._sampler_thread.is_alive():
+            return
+
+        self._running.set()
+        self._sampler_thread = threading.Thread(target=self._sample, daemon=True)
+        self._sampler_thread.start()
+        self._logger.info(f'Sampling IMU at {self.sample_rate}Hz')
+
+    def stop(self) -> None:
+        """
+        Stop the background sampler thread.
+        """
+        self._running.clear()
+        if self._sampler_thread is not None:
+            self._sampler_thread.join()
+            self._sampler_thread = None
+
+        if self.bias_update_count:
+            try:
+                self.imu.save_calibration()
+            except OSError as exc:
+                self._logger.warning(f'Failed to save the IMU calibration: {exc}')
+            self.bias_update_count = 0
+
+    def _sample(self) -> None:
+        """
+        Sampler thread loop. Samples at a fixed rate which doesn't drift with the
+        I2C read time, skipping deadlines which have already passed.
+        """
+        self._loop.run(self.sample, self._running.is_set)
+
+    @property
+    def overrun_count(self) -> int:
+        """
+        The number of sample deadlines missed.
+
+        Returns:
+            int: overrun count
+        """
+        return self._loop.overrun_count
+
+    def sample(self) -> None:
+        """
+        Burst read all channels from the IMU into the next slot of the ring buffer.
+        Failed reads are counted and skipped.
+        """
+        index = (self._index + 1) % self.buffer_size
+
+        sample = self.buffer[index]
+        try:
+            self.imu.read_all(out=sample)
+        except OSError as exc:
+            self.error_count += 1
+            self._logger.debug(f'IMU read failed: {exc}')
+            return
+        self.buffer[index + self.buffer_size] = sample
+
+        self._index = index
+        self.count += 1
+
+        if self.track_bias and self.count % self.bias_tracking['window_size'] == 0:
+            self._track_bias()
+
+        if self.estimator is not None:
+            self.estimator.update(
+                accelerometer=sample['accelerometer'].tolist(),
+                gyroscope=sample['gyroscope'].tolist(),
+                magnetometer=sample['magnetometer'].tolist(),
+                timestamp=float(sample['timestamp'])
+            )
+
+        if self.callback is not None:
+            self.callback(sample)
+
+    def _track_bias(self) -> None:
+        """
+        If the last window of samples is stationary, i.e. the gyroscope is only
+        noise around a rate within `max_rate` of zero and the accelerometer only
+        measures gravity, its mean gyroscope reading is residual bias. A fraction of
+        it is folded into the bias so drift with temperature is tracked without
+        recalibrating. A steady turn or drift is as smooth as a stationary window,
+        so the limit on the mean rate keeps it out of the bias.
+        """
+        window_size = self.bias_tracking['window_size']
+        if window_size > self.buffer_size:
+            return
+
+        samples = self.window(window_size)
+        gyroscope = samples['gyroscope']
+        gravity = np.linalg.norm(samples['accelerometer'], axis=1)
+        residual_bias = gyroscope.mean(axis=0)
+        if (
+            gyroscope.std(axis=0).max() > self.bias_tracking['gyroscope_threshold'] or
+            gravity.std() > self.bias_tracking['accelerometer_threshold'] or
+            np.abs(residual_bias).max() > self.bias_tracking['max_rate']
+        ):
+            return
+
+        self.imu.update_gyroscope_bias(
+            residual_bias.tolist(), rate=self.bias_tracking['rate']
+        )
+        self.bias_update_count += 1
+
+    @property
+    def latest(self) -> Optional[np.void]:
+        """
+        The latest sample, a view into the ring buffer.
+
+        Returns:
+            np.void: The latest sample or `None` if no sample has been taken
+        """
+        if self._index < 0:
+            return None
+        return self.buffer[self._index + self.buffer_size]
+
+    def window(self, size: Optional[int] = None) -> np.ndarray:
+        """
+        The most recent samples in chronological order, a view into the ring buffer.
+
+        Args:
+            size (int, optional): The number of samples. Defaults to all the samples
+            in the buffer.
+
+        Returns:
+            np.ndarray: The samples
+        """
+        size = min(size or self.buffer_size, self.buffer_size, self.count)
+        end = self._index + self.buffer_size + 1
+        return self.buffer[end - size:end]
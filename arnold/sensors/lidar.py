@@ -1,13 +1,553 @@
 import logging
+import os
+import random
 import serial
 import statistics
-from typing import Optional
+import struct
+import threading
+import time
+import tty
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Tuple, Union
+
+import numpy as np
 
 from arnold import config
+from arnold.utils import RollingStatistics
 
 
 _logger = logging.getLogger(__name__)
 
+# TF-Luna frame layout: header (2), distance (2), strength (2), temperature (2)
+# and checksum (1)
+FRAME_HEADER = b'\x59\x59'
+FRAME_SIZE = 9
+
+# Recording file layout: a header of magic, format version and frame size followed
+# by fixed size records of a monotonic timestamp and the raw frame bytes
+RECORDING_MAGIC = b'ARNL'
+RECORDING_VERSION = 1
+RECORDING_HEADER = struct.Struct('<4sHH')
+RECORDING_RECORD = struct.Struct(f'<d{FRAME_SIZE}s')
+RECORDING_DTYPE = np.dtype([('timestamp', '<f8'), ('frame', 'u1', FRAME_SIZE)])
+
+# Bulk decoded frames with the offset of each frame in the decoded buffer
+READING_DTYPE = np.dtype([
+    ('offset', '<i8'),
+    ('distance', '<u2'),
+    ('strength', '<u2'),
+    ('temperature', '<f4'),
+])
+_FRAME_INDEX = np.arange(FRAME_SIZE)
+
+# The buffered frames from which the streaming reader decodes in one NumPy batch.
+# Below this the per call overhead outweighs the batch decode, and a live read
+# is usually only part of a frame
+BULK_DECODE_FRAMES = 32
+
+
+class LidarError(Exception):
+    """
+    Raised when no lidar reading can be returned, either because the reader
+    failed or no frame arrived within the reading timeout.
+    """
+
+
+@dataclass
+class LidarReading:
+    """
+    A single decoded TF-Luna frame.
+
+    Args:
+        distance (int): Distance in cm to the closest object.
+        strength (int): The signal strength of the return.
+        temperature (float): The chip temperature in celsius.
+        timestamp (float): The monotonic time the frame was parsed at.
+    """
+
+    distance: int
+    strength: int
+    temperature: float
+    timestamp: float
+
+
+def parse_frame(frame: bytes, timestamp: Optional[float] = None) -> Optional[LidarReading]:
+    """
+    Decode a single 9 byte TF-Luna frame, validating the header and checksum.
+
+    Args:
+        frame (bytes): The raw frame bytes.
+        timestamp (float, optional): The time the frame was received. Defaults to
+        the current monotonic time.
+
+    Returns:
+        LidarReading: The decoded reading or `None` if the frame is invalid.
+    """
+    if len(frame) < FRAME_SIZE or frame[:2] != FRAME_HEADER:
+        return None
+    if sum(frame[:8]) & 0xff != frame[8]:
+        return None
+
+    return LidarReading(
+        distance=frame[2] | (frame[3] << 8),
+        strength=frame[4] | (frame[5] << 8),
+        temperature=(frame[6] | (frame[7] << 8)) / 8 - 256,
+        timestamp=time.monotonic() if timestamp is None else timestamp,
+    )
+
+
+def encode_frame(distance: int, strength: int = 1000, temperature: float = 40.0) -> bytes:
+    """
+    Encode a TF-Luna frame including the header and checksum.
+
+    Args:
+        distance (int): Distance in cm.
+        strength (int, optional): The signal strength. Defaults to 1000.
+        temperature (float, optional): The chip temperature in celsius. Defaults
+        to 40.0.
+
+    Returns:
+        bytes: The 9 byte frame.
+    """
+    temperature = int((temperature + 256) * 8)
+    frame = FRAME_HEADER + struct.pack('<HHH', distance, strength, temperature)
+    return frame + bytes([sum(frame) & 0xff])
+
+
+def decode_frame_array(frames: np.ndarray) -> np.ndarray:
+    """
+    Decode an N x 9 array of aligned TF-Luna frames, dropping frames which fail
+    the header or checksum validation.
+
+    Args:
+        frames (np.ndarray): The raw frames as unsigned bytes.
+
+    Returns:
+        np.ndarray: The decoded readings with `offset` set to the frame's row index.
+    """
+    frames = np.asarray(frames, dtype=np.uint8).reshape(-1, FRAME_SIZE)
+    valid = (
+        (frames[:, 0] == 0x59) &
+        (frames[:, 1] == 0x59) &
+        ((frames[:, :8].sum(axis=1, dtype=np.uint32) & 0xff) == frames[:, 8])
+    )
+    rows = np.flatnonzero(valid)
+    valid_frames = frames[rows].astype(np.uint16)
+
+    readings = np.empty(len(rows), dtype=READING_DTYPE)
+    readings['offset'] = rows
+    readings['distance'] = valid_frames[:, 2] | (valid_frames[:, 3] << 8)
+    readings['strength'] = valid_frames[:, 4] | (valid_frames[:, 5] << 8)
+    readings['temperature'] = (valid_frames[:, 6] | (valid_frames[:, 7] << 8)) / 8 - 256
+    return readings
+
+
+def decode_frames(buffer: bytes) -> Tuple[np.ndarray, int]:
+    """
+    Locate, validate and decode every TF-Luna frame in a raw serial buffer at once.
+    Frame headers which fail the checksum are skipped, so the decoder resyncs on
+    the next header as the byte by byte parser does.
+
+    Args:
+        buffer (bytes): The raw serial data.
+
+    Returns:
+        tuple (np.ndarray, int): The decoded readings with `offset` set to the
+        frame's byte offset in the buffer, and the number of leading bytes which
+        have been fully consumed and can be discarded
+    """
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    size = len(data)
+    if size < 2:
+        return np.empty(0, dtype=READING_DTYPE), 0
+
+    starts = np.flatnonzero((data[:-1] == 0x59) & (data[1:] == 0x59))
+    complete_starts = starts[starts <= size - FRAME_SIZE]
+
+    readings = decode_frame_array(data[complete_starts[:, None] + _FRAME_INDEX])
+    readings['offset'] = complete_starts[readings['offset']]
+
+    # A header inside a frame's payload can pass the checksum by chance, keep the
+    # earliest of any overlapping frames
+    offsets = readings['offset']
+    if len(offsets) > 1 and (np.diff(offsets) < FRAME_SIZE).any():
+        keep = np.zeros(len(offsets), dtype=bool)
+        frame_end = 0
+        for index, offset in enumerate(offsets.tolist()):
+            if offset >= frame_end:
+                keep[index] = True
+                frame_end = offset + FRAME_SIZE
+        readings = readings[keep]
+
+    # Keep everything from the first incomplete frame after the last decoded one
+    consumed = int(readings['offset'][-1]) + FRAME_SIZE if len(readings) else 0
+    incomplete_starts = starts[(starts > size - FRAME_SIZE) & (starts >= consumed)]
+    if len(incomplete_starts):
+        consumed = int(incomplete_starts[0])
+    else:
+        consumed = max(consumed, size - 1)
+
+    return readings, consumed
+
+
+def decode_recording(records: np.ndarray) -> np.ndarray:
+    """
+    Decode all frames of a recording loaded with `load_recording` in one batch.
+
+    Args:
+        records (np.ndarray): The recording records.
+
+    Returns:
+        np.ndarray: The decoded readings with `offset` set to the record index.
+    """
+    return decode_frame_array(records['frame'])
+
+
+class LidarRecorder(object):
+    """
+    Records raw TF-Luna frames with their monotonic timestamps to a compact
+    binary file which can be replayed with `LidarReplay`. The file is flushed
+    periodically, so at most `flush_interval` seconds of frames are lost if the
+    robot loses power mid-recording.
+
+    Args:
+        file_path (str): The file path to record to.
+        flush_interval (float, optional): Seconds between flushes. Defaults to 1.0.
+    """
+
+    def __init__(self, file_path: str, flush_interval: float = 1.0) -> None:
+        self.file_path = file_path
+        self.flush_interval = flush_interval
+        self.frame_count = 0
+
+        self._file = open(self.file_path, 'wb')
+        self._file.write(
+            RECORDING_HEADER.pack(RECORDING_MAGIC, RECORDING_VERSION, FRAME_SIZE)
+        )
+        self._flushed_at = time.monotonic()
+
+    def __enter__(self) -> 'LidarRecorder':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def write(self, frame: bytes, timestamp: float) -> None:
+        """
+        Append a frame to the recording.
+
+        Args:
+            frame (bytes): The raw frame bytes.
+            timestamp (float): The monotonic time the frame was received.
+        """
+        self._file.write(RECORDING_RECORD.pack(timestamp, bytes(frame)))
+        self.frame_count += 1
+
+        now = time.monotonic()
+        if now - self._flushed_at >= self.flush_interval:
+            self._file.flush()
+            self._flushed_at = now
+
+    def close(self) -> None:
+        """
+        Flush and close the recording file.
+        """
+        self._file.close()
+
+
+def load_recording(file_path: str) -> np.ndarray:
+    """
+    Memory map a lidar recording as a structured array of `timestamp` and `frame`
+    records without reading the file into memory. A partial record at the end of
+    a recording which was cut off mid-write is dropped.
+
+    Args:
+        file_path (str): The recording file path.
+
+    Raises:
+        ValueError: Raised if the file is not a supported lidar recording.
+
+    Returns:
+        np.ndarray: The read only, memory mapped records.
+    """
+    with open(file_path, 'rb') as recording_file:
+        header = recording_file.read(RECORDING_HEADER.size)
+
+    if len(header) < RECORDING_HEADER.size:
+        raise ValueError(f'{file_path} is not a lidar recording.')
+
+    magic, version, frame_size = RECORDING_HEADER.unpack(header)
+    if magic != RECORDING_MAGIC or version != RECORDING_VERSION or frame_size != FRAME_SIZE:
+        raise ValueError(f'{file_path} is not a supported lidar recording.')
+
+    data_size = os.path.getsize(file_path) - RECORDING_HEADER.size
+    record_count, tail_size = divmod(data_size, RECORDING_DTYPE.itemsize)
+    if tail_size:
+        _logger.warning(
+            f'Dropped a {tail_size} byte partial record from the end of {file_path}'
+        )
+
+    # np.memmap can't map an empty region
+    if not record_count:
+        return np.empty(0, dtype=RECORDING_DTYPE)
+
+    return np.memmap(
+        file_path, dtype=RECORDING_DTYPE, mode='r', offset=RECORDING_HEADER.size,
+        shape=(record_count, )
+    )
+
+
+class LidarReplaySource(object):
+    """
+    A serial port stand in which serves the frames of a memory mapped recording at
+    their recorded pace, scaled by `speed`.
+
+    Args:
+        file_path (str): The recording file path.
+        speed (float, optional): The playback speed multiplier. A speed of 0 serves
+        frames as fast as they are read. Defaults to 1.0.
+        timeout (float, optional): The maximum time a read blocks for.
+    """
+
+    def __init__(
+        self,
+        file_path: str,
+        speed: float = 1.0,
+        timeout: Optional[float] = None
+    ) -> None:
+        self.records = load_recording(file_path)
+        self.speed = speed
+        self.timeout = timeout
+
+        # Playback offsets relative to the first recorded frame
+        self._offsets = (
+            self.records['timestamp'] - self.records['timestamp'][0]
+            if len(self.records) else np.empty(0)
+        )
+        self._position = 0
+        self._start_time = None
+
+    @property
+    def finished(self) -> bool:
+        """
+        Whether all recorded frames have been served.
+
+        Returns:
+            bool: playback is finished
+        """
+        return self._position >= len(self.records)
+
+    def _elapsed(self) -> float:
+        """
+        Playback time elapsed in recording time.
+
+        Returns:
+            float: elapsed recording time in seconds
+        """
+        if self._start_time is None:
+            self._start_time = time.monotonic()
+        return (time.monotonic() - self._start_time) * self.speed
+
+    def _due_position(self) -> int:
+        """
+        The record index up to which frames are due for playback.
+
+        Returns:
+            int: due record index
+        """
+        if not self.speed:
+            return len(self.records)
+        return int(np.searchsorted(self._offsets, self._elapsed(), side='right'))
+
+    @property
+    def in_waiting(self) -> int:
+        return (self._due_position() - self._position) * FRAME_SIZE
+
+    def read(self, size: int = 1) -> bytes:
+        """
+        Read whole due frames, blocking until the next frame is due or the timeout
+        expires.
+
+        Args:
+            size (int, optional): The maximum number of bytes to read, rounded up to
+            whole frames.
+
+        Returns:
+            bytes: The raw frame bytes
+        """
+        if self.finished:
+            if self.timeout:
+                time.sleep(self.timeout)
+            return b''
+
+        due_position = self._due_position()
+        if due_position == self._position:
+            wait = (self._offsets[self._position] - self._elapsed()) / self.speed
+            if self.timeout is not None:
+                wait = min(wait, self.timeout)
+            time.sleep(max(wait, 0))
+            due_position = self._due_position()
+
+        frame_count = max(1, -(-size // FRAME_SIZE))
+        end_position = min(due_position, self._position + frame_count)
+        data = self.records['frame'][self._position:end_position].tobytes()
+        self._position = end_position
+        return data
+
+    def reset_input_buffer(self) -> None:
+        """
+        Skip all frames which are currently due.
+        """
+        self._position = max(self._position, self._due_position())
+
+    def close(self) -> None:
+        """
+        Release the memory map.
+        """
+        self.records = np.empty(0, dtype=RECORDING_DTYPE)
+        self._position = 0
+
+
+class LidarSimulator(object):
+    """
+    A virtual TF-Luna on a pseudo terminal which emits correctly framed data at a
+    fixed rate, for benchmarking without the sensor attached. Pass `port` to
+    `Lidar` as its serial port.
+
+    Args:
+        rate (int, optional): The frame rate in Hz. Defaults to 100.
+        distance (int, optional): The distance in cm when no script is set.
+        Defaults to 200.
+        noise (float, optional): The standard deviation of gaussian noise added to
+        the distance in cm. Defaults to 0.
+        script (list or callable, optional): An obstacle script, either a list of
+        (seconds, distance) keyframes which are linearly interpolated and held after
+        the last keyframe, or a callable taking the elapsed seconds and returning
+        the distance
+        strength (int, optional): The signal strength. Defaults to 1000.
+        seed (int, optional): The noise random seed
+    """
+
+    def __init__(
+        self,
+        rate: int = 100,
+        distance: int = 200,
+        noise: float = 0.0,
+        script: Optional[Union[List[Tuple[float, int]], Callable]] = None,
+        strength: int = 1000,
+        seed: Optional[int] = None
+    ) -> None:
+        self.rate = rate
+        self.distance = distance
+        self.noise = noise
+        self.script = script
+        self.strength = strength
+        self.frame_count = 0
+        self.dropped_count = 0
+        self.start_time = None
+
+        # Setup logging
+        self._logger = _logger
+
+        self._random = random.Random(seed)
+        self._master_fd = None
+        self._slave_fd = None
+        self._writer_thread = None
+        self._running = threading.Event()
+
+    def __enter__(self) -> 'LidarSimulator':
+        self.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+    @property
+    def port(self) -> Optional[str]:
+        """
+        The pseudo terminal device path to open as the lidar serial port.
+
+        Returns:
+            str: the device path or `None` if the simulator isn't started
+        """
+        return None if self._slave_fd is None else os.ttyname(self._slave_fd)
+
+    def distance_at(self, elapsed: float) -> int:
+        """
+        The scripted distance, without noise, at a point in time.
+
+        Args:
+            elapsed (float): Seconds since the simulator started
+
+        Returns:
+            int: distance in cm
+        """
+        if self.script is None:
+            return self.distance
+        if callable(self.script):
+            return int(self.script(elapsed))
+
+        times, distances = zip(*self.script)
+        return int(np.interp(elapsed, times, distances))
+
+    def start(self) -> None:
+        """
+        Open the pseudo terminal and start emitting frames.
+        """
+        self._master_fd, self._slave_fd = os.openpty()
+        tty.setraw(self._slave_fd)
+        os.set_blocking(self._master_fd, False)
+
+        self.start_time = time.monotonic()
+        self._running.set()
+        self._writer_thread = threading.Thread(target=self._write_frames, daemon=True)
+        self._writer_thread.start()
+        self._logger.info(f'Simulating lidar at {self.port} ({self.rate}Hz)')
+
+    def stop(self) -> None:
+        """
+        Stop emitting frames and close the pseudo terminal.
+        """
+        self._running.clear()
+        if self._writer_thread is not None:
+            self._writer_thread.join()
+            self._writer_thread = None
+
+        for fd in (self._master_fd, self._slave_fd):
+            if fd is not None:
+                os.close(fd)
+        self._master_fd = self._slave_fd = None
+
+    def _write_frames(self) -> None:
+        """
+        Writer thread loop. Emits frames against fixed deadlines so the rate holds
+        on average, catching up with several frames at once if it falls behind.
+        """
+        interval = 1 / self.rate
+        next_time = self.start_time
+        while self._running.is_set():
+            now = time.monotonic()
+            if now < next_time:
+                time.sleep(next_time - now)
+                continue
+
+            frames = []
+            while next_time <= now:
+                distance = self.distance_at(next_time - self.start_time)
+                if self.noise:
+                    distance += self._random.gauss(0, self.noise)
+                frames.append(
+                    encode_frame(min(max(int(distance), 0), 0xffff), self.strength)
+                )
+                next_time += interval
+
+            try:
+                os.write(self._master_fd, b''.join(frames))
+                self.frame_count += len(frames)
+            except BlockingIOError:
+                # The reader isn't keeping up, drop the frames as a UART would
+                self.dropped_count += len(frames)
+
 
 class Lidar(object):
     """
@@ -18,43 +558,298 @@ class Lidar(object):
         serial_port (str, optional): The serial port which the lidar sensor is
         connect to (UART)
         baud_rate (int, optional): The communication baud rate
+        streaming (bool, optional): Continuously parse frames in a background
+        reader thread rather than reading on demand
+        window_size (int, optional): The number of streamed frames the rolling
+        distance statistics are calculated over
     """
 
     def __init__(
         self,
         serial_port: Optional[str] = None,
-        baudrate: Optional[int] = None
+        baudrate: Optional[int] = None,
+        streaming: Optional[bool] = None,
+        window_size: Optional[int] = None
     ) -> None:
         self.config = config.SENSOR['lidar']
 
         # UART serial config
         self.serial_port = serial_port or self.config['serial_port']
         self.baudrate = baudrate or self.config['baudrate']
+        self.streaming = self.config['streaming'] if streaming is None else streaming
 
         # Setup logging
         self._logger = _logger
 
-        self.lidar_sensor = serial.Serial(
+        self.lidar_sensor = self._open_serial()
+
+        # Streaming reader state
+        self._buffer = bytearray()
+        self._reading = None
+        self._reading_count = 0
+        self._reading_condition = threading.Condition()
+        self.statistics = RollingStatistics(
+            window_size=window_size or self.config['window_size']
+        )
+        self.error = None
+        self._reader_thread = None
+        self._running = threading.Event()
+        self._recorder = None
+        self._recorder_lock = threading.Lock()
+
+        if self.streaming:
+            self.start()
+
+    def _open_serial(self) -> serial.Serial:
+        """
+        Open the serial port the frames are read from.
+
+        Returns:
+            serial.Serial: The serial port instance
+        """
+        return serial.Serial(
             port=self.serial_port,
-            baudrate=self.baudrate
+            baudrate=self.baudrate,
+            timeout=self.config['read_timeout']
         )
 
+    def start(self) -> None:
+        """
+        Start the background reader thread which continuously parses frames
+        from the serial port.
+        """
+        if self._reader_thread is not None and self._reader_thread.is_alive():
+            return
+
+        self.error = None
+        self._running.set()
+        self._reader_thread = threading.Thread(target=self._read_frames, daemon=True)
+        self._reader_thread.start()
+        self._logger.info(f'Streaming lidar frames from {self.serial_port}')
+
+    def stop(self) -> None:
+        """
+        Stop the background reader thread.
+        """
+        self._running.clear()
+        if self._reader_thread is not None:
+            self._reader_thread.join()
+            self._reader_thread = None
+
+    def record(self, file_path: str) -> None:
+        """
+        Record every frame parsed by the reader thread to a file.
+
+        Args:
+            file_path (str): The file path to record to
+        """
+        self.stop_recording()
+        with self._recorder_lock:
+            self._recorder = LidarRecorder(file_path)
+        self._logger.info(f'Recording lidar frames to {file_path}')
+
+    def stop_recording(self) -> None:
+        """
+        Stop recording and close the recording file.
+        """
+        with self._recorder_lock:
+            recorder, self._recorder = self._recorder, None
+            if recorder is not None:
+                recorder.close()
+        if recorder is not None:
+            self._logger.info(
+                f'Recorded {recorder.frame_count} lidar frames to {recorder.file_path}'
+            )
+
+    def release(self) -> None:
+        """
+        Stop streaming and recording and close the serial port.
+        """
+        self.stop()
+        self.stop_recording()
+        self.lidar_sensor.close()
+        self._logger.info(f'Serial port {self.serial_port} released')
+
+    def _read_frames(self) -> None:
+        """
+        Reader thread loop. Blocks on the serial port (bounded by the read timeout)
+        instead of spinning and keeps every frame instead of discarding the input
+        buffer between readings. A serial failure, e.g. the sensor being unplugged,
+        stops the reader and is raised to waiting consumers.
+        """
+        while self._running.is_set():
+            try:
+                data = self.lidar_sensor.read(self.lidar_sensor.in_waiting or 1)
+            except serial.SerialException as exc:
+                self._logger.error(f'Lidar reader stopped: {exc}')
+                with self._reading_condition:
+                    self.error = exc
+                    self._reading_condition.notify_all()
+                break
+
+            if not data:
+                continue
+
+            self._buffer.extend(data)
+            self._parse_buffer()
+
+    def _parse_buffer(self) -> None:
+        """
+        Parse all complete frames in the buffer, resyncing on the frame header when
+        a frame fails validation, and publish the latest reading. Frames are parsed
+        one by one unless the buffer holds at least `BULK_DECODE_FRAMES` frames, e.g.
+        on replay or after a stall, when they're decoded in one batch.
+        """
+        buffer = self._buffer
+        timestamp = time.monotonic()
+        reading = None
+
+        if len(buffer) >= BULK_DECODE_FRAMES * FRAME_SIZE:
+            readings, consumed = decode_frames(buffer)
+            offsets = readings['offset'].tolist()
+            distances = readings['distance'].tolist()
+            if offsets:
+                latest = readings[-1]
+                reading = LidarReading(
+                    distance=int(latest['distance']),
+                    strength=int(latest['strength']),
+                    temperature=float(latest['temperature']),
+                    timestamp=timestamp,
+                )
+        else:
+            offsets = []
+            distances = []
+            consumed = 0
+            while True:
+                index = buffer.find(FRAME_HEADER, consumed)
+                if index < 0:
+                    consumed = max(consumed, len(buffer) - 1)
+                    break
+                if len(buffer) - index < FRAME_SIZE:
+                    consumed = index
+                    break
+
+                frame_reading = parse_frame(buffer[index:index + FRAME_SIZE], timestamp)
+                if frame_reading is None:
+                    consumed = index + 1
+                    continue
+
+                reading = frame_reading
+                offsets.append(index)
+                distances.append(reading.distance)
+                consumed = index + FRAME_SIZE
+
+        if reading is not None:
+            if self._recorder is not None:
+                self._record(
+                    [bytes(buffer[offset:offset + FRAME_SIZE]) for offset in offsets],
+                    timestamp
+                )
+            self._publish(reading, distances)
+
+        del buffer[:consumed]
+
+    def _record(self, frames: list, timestamp: float) -> None:
+        """
+        Write parsed frames to the active recording.
+
+        Args:
+            frames (list): The raw frames to record
+            timestamp (float): The monotonic time the frames were received
+        """
+        with self._recorder_lock:
+            if self._recorder is not None:
+                for frame in frames:
+                    self._recorder.write(frame, timestamp)
+
+    def _publish(self, reading: LidarReading, distances: list) -> None:
+        """
+        Store the latest reading, feed the rolling statistics and wake any waiting
+        consumers.
+
+        Args:
+            reading (LidarReading): The latest decoded reading
+            distances (list): The distances of all frames decoded since the last
+            publish
+        """
+        with self._reading_condition:
+            for distance in distances:
+                self.statistics.update(distance)
+            self._reading = reading
+            self._reading_count += len(distances)
+            self._reading_condition.notify_all()
+
+    def get_reading(self) -> Optional[LidarReading]:
+        """
+        The latest reading parsed by the reader thread. Never blocks.
+
+        Returns:
+            LidarReading: The latest reading or `None` if no frame has been parsed
+        """
+        return self._reading
+
+    def wait_for_reading(self, timeout: Optional[float] = None) -> Optional[LidarReading]:
+        """
+        Wait for a reading newer than the current one from the reader thread.
+
+        Args:
+            timeout (float, optional): The maximum time in seconds to wait
+
+        Returns:
+            LidarReading: The new reading or `None` if the timeout expired or the
+            reader failed
+        """
+        with self._reading_condition:
+            reading_count = self._reading_count
+            received = self._reading_condition.wait_for(
+                lambda: self._reading_count != reading_count or self.error is not None,
+                timeout=timeout
+            )
+            return self._reading if received and self.error is None else None
+
+    def _check_reader(self) -> None:
+        """
+        Raise the failure which stopped the reader thread, if any.
+
+        Raises:
+            LidarError: Raised if the reader thread failed
+        """
+        if self.error is not None:
+            raise LidarError(f'Lidar reader failed: {self.error}')
+
     def get_distance(self) -> int:
         """
         The calculated distance to the nearest object in range.
 
+        Raises:
+            LidarError: Raised if the reader failed or no frame was received within
+            the reading timeout
+
         Returns:
             int: Distance in cm to the closest object
         """
+        timeout = self.config['reading_timeout']
+        if self.streaming:
+            self._check_reader()
+            reading = self.wait_for_reading(timeout=timeout)
+            self._check_reader()
+            if reading is None:
+                raise LidarError(f'No lidar reading within {timeout}s.')
+            return reading.distance
+
         distance = 0
+        deadline = time.monotonic() + timeout
         while True:
+            if time.monotonic() > deadline:
+                raise LidarError(f'No lidar reading within {timeout}s.')
 
             counter = self.lidar_sensor.in_waiting
             if counter > 8:
                 bytes_serial = self.lidar_sensor.read(9)
 
-                if bytes_serial[0] == 0x59 and bytes_serial[1] == 0x59:
-                    distance = (bytes_serial[2] + bytes_serial[3])
+                reading = parse_frame(bytes_serial)
+                if reading is not None:
+                    distance = reading.distance
                     self.lidar_sensor.reset_input_buffer()
                     break
 
@@ -64,6 +859,50 @@ class Lidar(object):
 
         return distance
 
+    def get_smoothed_distance(
+        self,
+        threshold: Optional[float] = None,
+        wait_for_new: bool = False
+    ) -> int:
+        """
+        The outlier rejected mean distance over the rolling window of streamed
+        frames. Only waits if no frame has been received yet, unless `wait_for_new`
+        is set, so loops reacting to the distance can be paced by the frame rate.
+
+        Args:
+            threshold (float, optional): The outlier threshold in standard
+            deviations from the window median
+            wait_for_new (bool, optional): Wait for a frame newer than the last
+            call's. Defaults to False.
+
+        Raises:
+            LidarError: Raised if the reader failed or no frame was received within
+            the reading timeout
+
+        Returns:
+            int: The smoothed distance in cm to the closest object
+        """
+        if not self.streaming:
+            return self.get_mean_distance(self.statistics.window_size)
+
+        threshold = threshold or self.config['outlier_threshold']
+        timeout = self.config['reading_timeout']
+        with self._reading_condition:
+            reading_count = self._reading_count
+            received = self._reading_condition.wait_for(
+                lambda: (
+                    self.error is not None or (
+                        self._reading_count != reading_count if wait_for_new
+                        else self.statistics.count > 0
+                    )
+                ),
+                timeout=timeout
+            )
+            self._check_reader()
+            if not received:
+                raise LidarError(f'No lidar reading within {timeout}s.')
+            return int(self.statistics.filtered_mean(threshold))
+
     def get_mean_distance(self, sample_size: int) -> int:
         """
         The calculated the mean distance to the nearest object in range for a
@@ -79,3 +918,42 @@ class Lidar(object):
             statistics.mean([self.get_distance() for _ in range(sample_size)])
         )
 
+
+class LidarReplay(Lidar):
+    """
+    A `Lidar` which replays a recording made with `Lidar.record` instead of reading
+    from the serial port, for profiling and regression testing off the robot.
+
+    Args:
+        file_path (str): The recording file path
+        speed (float, optional): The playback speed multiplier, 0 replays as fast
+        as possible. Defaults to 1.0.
+        streaming (bool, optional): Continuously parse frames in a background
+        reader thread rather than reading on demand
+        window_size (int, optional): The number of streamed frames the rolling
+        distance statistics are calculated over
+    """
+
+    def __init__(
+        self,
+        file_path: str,
+        speed: float = 1.0,
+        streaming: Optional[bool] = None,
+        window_size: Optional[int] = None
+    ) -> None:
+        self.file_path = file_path
+        self.speed = speed
+        super().__init__(
+            serial_port=file_path, streaming=streaming, window_size=window_size
+        )
+
+    def _open_serial(self) -> LidarReplaySource:
+        """
+        Open the memory mapped recording the frames are read from.
+
+        Returns:
+            LidarReplaySource: The replay source
+        """
+        return LidarReplaySource(
+            self.file_path, speed=self.speed, timeout=self.config['read_timeout']
+        )
@@ -0,0 +1,610 @@
+import json
+import threading
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+from arnold import config
+from arnold.sensors import camera
+
+
+# The capture is patched in the camera module, which patches cv2 itself
+VideoCapture = cv2.VideoCapture
+
+class FakeCapture:
+
+    instances = []
+
+    def __init__(self, index=0, *args):
+        self.index = index
+        self.properties = {}
+        self.frame_count = 0
+        self.static = False
+        self.released = False
+        FakeCapture.instances.append(self)
+
+    def isOpened(self):
+        return True
+
+    def set(self, property_id, value):
+        self.properties[property_id] = value
+        return True
+
+    def get(self, property_id):
+        return self.properties.get(property_id, 0)
+
+    def read(self, image=None):
+        width = int(self.properties.get(cv2.CAP_PROP_FRAME_WIDTH, 640))
+        height = int(self.properties.get(cv2.CAP_PROP_FRAME_HEIGHT, 480))
+        if image is None or image.shape != (height, width, 3):
+            image = np.empty((height, width, 3), dtype=np.uint8)
+        image[:] = 0 if self.static else self.frame_count % 256
+        self.frame_count += 1
+        return True, image
+
+    def grab(self):
+        self.frame_count += 1
+        return True
+
+    def release(self):
+        self.released = True
+
+
+@pytest.fixture
+def video_capture(mocker):
+    FakeCapture.instances = []
+    mocker.patch.object(camera.cv2, 'VideoCapture', FakeCapture)
+    mocker.patch.object(camera.CameraBroadcaster, '_broadcasters', {})
+    yield FakeCapture
+    for broadcaster in camera.CameraBroadcaster._broadcasters.values():
+        broadcaster.stop()
+
+
+class TestSyntheticCapture:
+
+    def test_read(self):
+        capture = camera.SyntheticCapture(width=64, height=48)
+        capture.set(cv2.CAP_PROP_FRAME_WIDTH, 32)
+        capture.set(cv2.CAP_PROP_FRAME_HEIGHT, 24)
+        assert capture.isOpened()
+        assert capture.get(cv2.CAP_PROP_FRAME_WIDTH) == 32
+
+        # Frames are rendered into the buffer given and change every frame
+        buffer = np.empty((24, 32, 3), dtype=np.uint8)
+        read, image = capture.read(image=buffer)
+        assert read
+        assert image is buffer
+        first = image.copy()
+        read, image = capture.read(image=buffer)
+        assert not np.array_equal(image, first)
+        assert capture.get(cv2.CAP_PROP_POS_FRAMES) == 2
+
+        capture.release()
+        assert capture.read() == (False, None)
+
+    def test_patterns(self):
+        static = camera.SyntheticCapture(width=32, height=24, pattern='static')
+        assert np.array_equal(static.read()[1], static.read()[1])
+
+        noise = camera.SyntheticCapture(width=32, height=24, pattern='noise', seed=1)
+        assert noise.read()[1].std() > 50
+
+        with pytest.raises(ValueError):
+            camera.SyntheticCapture(pattern='invalid')
+
+    def test_frame_rate(self):
+        capture = camera.SyntheticCapture(width=32, height=24, frame_rate=50)
+        start = time.monotonic()
+        for _ in range(6):
+            capture.read()
+        assert time.monotonic() - start >= 0.09
+
+    def test_open_capture(self, video_capture):
+        assert isinstance(camera.open_capture('synthetic'), camera.SyntheticCapture)
+        assert camera.open_capture('synthetic:noise').pattern == 'noise'
+        assert camera.open_capture('1').index == 1
+        assert camera.open_capture('video.avi').index == 'video.avi'
+
+    def test_get_source(self, mocker):
+        mocker.patch.dict(config.SENSOR['camera'], {'source': None})
+        assert camera.get_source() == config.SENSOR['camera']['camera_number']
+        mocker.patch.dict(config.SENSOR['camera'], {'source': 'synthetic'})
+        assert camera.get_source() == 'synthetic'
+        assert camera.Camera().source == 'synthetic'
+        assert camera.Camera(camera_number=1).source == 1
+
+        # Device numbers from the environment are the same source as the device
+        mocker.patch.dict(config.SENSOR['camera'], {'source': '0'})
+        assert camera.get_source() == 0
+        assert camera.get_source('1') == 1
+        assert camera.Camera(source='1').source == 1
+
+
+class TestFramePool:
+
+    def test_publish(self):
+        pool = camera.FramePool(size=3)
+        assert pool.next_buffer() is None
+        assert pool.latest is None
+
+        # The first frame is copied into the newly allocated pool
+        image = np.full((4, 6, 3), 1, dtype=np.uint8)
+        frame = pool.publish(image, timestamp=1.0)
+        assert frame.frame_id == 1
+        assert frame.timestamp == 1.0
+        assert not frame.image.flags.writeable
+        assert np.shares_memory(frame.image, pool.buffers)
+        with pytest.raises(ValueError):
+            frame.image[0, 0, 0] = 2
+
+        # Frames captured into the next buffer aren't copied or reallocated
+        for value in range(2, 6):
+            buffer = pool.next_buffer()
+            buffer[:] = value
+            assert pool.publish(buffer).image.base is pool.buffers
+        assert pool.latest.image[0, 0, 0] == 5
+        assert pool.latest.frame_id == 5
+        assert pool.allocation_count == 1
+
+        # A new frame size reallocates the pool
+        pool.publish(np.zeros((8, 6, 3), dtype=np.uint8))
+        assert pool.buffers.shape == (3, 8, 6, 3)
+        assert pool.allocation_count == 2
+
+    def test_wait_for_frame(self):
+        pool = camera.FramePool(size=2)
+        assert pool.wait_for_frame(timeout=0.01) is None
+
+        image = np.zeros((4, 6, 3), dtype=np.uint8)
+        threading.Timer(0.05, pool.publish, args=(image, )).start()
+        frame = pool.wait_for_frame(timeout=1)
+        assert frame.frame_id == 1
+
+        # An older frame id returns the latest frame straight away
+        assert pool.wait_for_frame(frame_id=0, timeout=0) is frame
+
+        # Unless it was cleared, when the next frame is waited for
+        pool.clear()
+        assert pool.latest is None
+        assert pool.wait_for_frame(frame_id=0, timeout=0.01) is None
+        pool.publish(image)
+        assert pool.wait_for_frame(frame_id=0, timeout=0).frame_id == 2
+
+
+class TestChangeDetector:
+
+    def test_update(self):
+        detector = camera.ChangeDetector(threshold=2.0, keep_alive=1.0)
+        image = np.zeros((48, 64, 3), dtype=np.uint8)
+        assert detector.update(image, timestamp=0)
+
+        # Noise under the threshold is ignored until a keep-alive frame is due
+        noise = image.copy()
+        noise[:4, :4] = 255
+        assert not detector.update(noise, timestamp=0.1)
+        assert 0 < detector.difference < 2.0
+        assert not detector.update(image, timestamp=0.9)
+        assert detector.update(image, timestamp=1.0)
+
+        # A change is let through and becomes the reference
+        changed = np.full((48, 64, 3), 100, dtype=np.uint8)
+        assert detector.update(changed, timestamp=1.1)
+        assert detector.difference == pytest.approx(100)
+        assert not detector.update(changed, timestamp=1.2)
+
+        detector.reset()
+        assert detector.update(changed, timestamp=1.3)
+
+
+class TestCameraBroadcaster:
+
+    def setup_method(self, method):
+        self.config = config.SENSOR['camera']
+
+    def test_config(self):
+        required_config = ['camera_number', 'source', 'image', 'video', 'stream']
+        for config_key in required_config:
+            assert config_key in self.config
+
+    def test_get(self, video_capture):
+        broadcaster = camera.CameraBroadcaster.get(0, width=320, height=240)
+        assert camera.CameraBroadcaster.get(0) is broadcaster
+        assert camera.CameraBroadcaster.get(1) is not broadcaster
+        assert camera.CameraBroadcaster.get('0') is broadcaster
+        assert broadcaster.width == 320
+
+    def test_subscribe(self, video_capture):
+        broadcaster = camera.CameraBroadcaster.get(0, width=64, height=48, frame_rate=100)
+        subscribers = [broadcaster.subscribe() for _ in range(3)]
+        frames = [subscriber.get(timeout=1) for subscriber in subscribers]
+
+        # One capture is shared and every subscriber gets the same encoded frame
+        assert len(video_capture.instances) == 1
+        assert broadcaster.frames.latest.image.shape == (48, 64, 3)
+        assert all(frame is not None for frame in frames)
+        image = cv2.imdecode(np.frombuffer(frames[0], dtype=np.uint8), cv2.IMREAD_COLOR)
+        assert image.shape == (48, 64, 3)
+
+        # The capture stops after the last subscriber leaves, wait for it
+        for subscriber in subscribers:
+            subscriber.close()
+            assert subscriber.get() is None
+        broadcaster.stop()
+        assert video_capture.instances[0].released
+        assert not broadcaster.is_running
+
+        # The encoder's worker threads are shut down with it
+        for _ in range(100):
+            encoder_threads = [
+                thread for thread in threading.enumerate()
+                if thread.name.startswith('camera-0-encoder')
+            ]
+            if not encoder_threads:
+                break
+            time.sleep(0.01)
+        assert not encoder_threads
+
+        # And restarts for the next subscriber
+        subscriber = broadcaster.subscribe()
+        assert subscriber.get(timeout=1) is not None
+        assert len(video_capture.instances) == 2
+
+        # Stopping ends the subscriptions once the queued frames are read
+        broadcaster.stop()
+        assert len(list(subscriber)) <= subscriber.queue_size
+        assert subscriber.closed
+        assert broadcaster.subscriber_count == 0
+
+    def test_idle_timeout(self, video_capture):
+        broadcaster = camera.CameraBroadcaster(0, frame_rate=100, idle_timeout=0.1)
+        subscriber = broadcaster.subscribe()
+        assert subscriber.get(timeout=1) is not None
+
+        # The first frames are skipped while the exposure settles
+        assert video_capture.instances[0].frame_count > broadcaster.frame_count
+
+        # The capture stays open for the idle timeout
+        subscriber.close()
+        time.sleep(0.05)
+        assert broadcaster.is_running
+        with broadcaster.hold():
+            time.sleep(0.15)
+            assert broadcaster.is_running
+        for _ in range(50):
+            if video_capture.instances[0].released:
+                break
+            time.sleep(0.01)
+        assert video_capture.instances[0].released
+        assert not broadcaster.is_running
+        assert len(video_capture.instances) == 1
+
+        # The frame from before the stop isn't returned once the capture restarts
+        assert broadcaster.frames.latest is None
+        restart_time = time.monotonic()
+        with broadcaster.hold():
+            frame = broadcaster.frames.wait_for_frame(frame_id=0, timeout=1)
+        assert frame.timestamp >= restart_time
+        assert len(video_capture.instances) == 2
+        broadcaster.stop()
+
+    def test_slow_subscriber(self, video_capture):
+        broadcaster = camera.CameraBroadcaster.get(0, width=64, height=48, frame_rate=200)
+        slow_subscriber = broadcaster.subscribe(queue_size=2)
+        subscriber = broadcaster.subscribe()
+
+        # A subscriber which doesn't drain its queue drops the oldest frames
+        for _ in range(10):
+            assert subscriber.get(timeout=1) is not None
+        assert slow_subscriber.frames.qsize() == 2
+        assert slow_subscriber.dropped_count > 0
+
+        # And is sent smaller frames
+        broadcaster.stop()
+        assert slow_subscriber.level == 3
+        jpeg_frame = list(slow_subscriber)[-1]
+        image = cv2.imdecode(np.frombuffer(jpeg_frame, dtype=np.uint8), cv2.IMREAD_COLOR)
+        assert image.shape == (24, 32, 3)
+        assert broadcaster.encode_count > 0
+
+    def test_static_scene(self, video_capture, mocker):
+        mocker.patch.dict(
+            config.SENSOR['camera']['stream']['change_detection'], {'keep_alive': 0.2}
+        )
+        broadcaster = camera.CameraBroadcaster.get(0, width=64, height=48, frame_rate=100)
+        subscriber = broadcaster.subscribe()
+        assert subscriber.get(timeout=1) is not None
+        video_capture.instances[0].static = True
+
+        # Only keep-alive frames of a static scene are encoded
+        start_time = time.monotonic()
+        frames = []
+        while time.monotonic() - start_time < 0.5:
+            frame = subscriber.get(timeout=0.05)
+            if frame is not None:
+                frames.append(frame)
+        broadcaster.stop()
+
+        assert 1 <= len(frames) <= 4
+        assert broadcaster.static_count > 20
+        assert broadcaster.encode_count < broadcaster.frame_count / 4
+
+    def test_snapshot(self, video_capture, mocker):
+        broadcaster = camera.CameraBroadcaster.get(0, width=64, height=48, frame_rate=100)
+        imencode = mocker.spy(camera.cv2, 'imencode')
+
+        # The capture is started and stays warm
+        snapshot = broadcaster.snapshot()
+        assert snapshot.startswith(b'\xff\xd8')
+        assert broadcaster.is_running
+        assert imencode.call_count == 1
+
+        # Polling returns the cached frame without encoding
+        assert broadcaster.snapshot() is snapshot
+        assert imencode.call_count == 1
+
+        # Unless it's too old
+        mocker.patch.dict(config.SENSOR['camera']['stream'], {'snapshot_max_age': 0})
+        time.sleep(0.05)
+        assert broadcaster.snapshot() is not snapshot
+        assert imencode.call_count == 2
+
+        # The streams' full quality frames are cached
+        mocker.patch.dict(config.SENSOR['camera']['stream'], {'snapshot_max_age': 10})
+        subscriber = mocker.Mock()
+        broadcaster._encode(broadcaster.frames.latest, 0, [subscriber])
+        jpeg_frame = subscriber.put.call_args[0][0]
+        assert broadcaster.snapshot() is jpeg_frame
+        assert imencode.call_count == 3
+
+        # Waiting for the capture to open doesn't block the other polls
+        wait_for_frame = broadcaster.frames.wait_for_frame
+
+        def unlocked_wait_for_frame(*args, **kwargs):
+            assert not broadcaster._snapshot_lock.locked()
+            return wait_for_frame(*args, **kwargs)
+
+        mocker.patch.object(broadcaster.frames, 'wait_for_frame', unlocked_wait_for_frame)
+
+        # After the capture stops a fresh frame is captured, not the cached one
+        broadcaster.stop()
+        assert broadcaster.snapshot() is not jpeg_frame
+        assert imencode.call_count == 4
+        assert len(video_capture.instances) == 2
+
+    def test_adaptive_quality(self, mocker):
+        mocker.patch.dict(config.SENSOR['camera']['stream'], {'upgrade_after': 3})
+        subscriber = camera.CameraSubscriber(broadcaster=None, queue_size=1)
+
+        # Each dropped frame steps down a quality level
+        for frame in [b'1', b'2', b'3', b'4', b'5']:
+            subscriber.put(frame)
+        assert subscriber.dropped_count == 4
+        assert subscriber.level == 3
+
+        # Keeping up steps back up
+        for _ in range(3):
+            assert subscriber.get() is not None
+            subscriber.put(b'6')
+        assert subscriber.level == 2
+
+        # Unless the subscription isn't adaptive
+        subscriber = camera.CameraSubscriber(broadcaster=None, queue_size=1, adaptive=False)
+        for frame in [b'1', b'2', b'3']:
+            subscriber.put(frame)
+        assert subscriber.level == 0
+
+
+class TestVideoRecorder:
+
+    def test_write(self, mocker, tmp_path):
+        recorder = camera.VideoRecorder(str(tmp_path / 'video.avi'), 32, 24, 10, queue_size=1)
+
+        # Block the writer on the first frame
+        writing, release = threading.Event(), threading.Event()
+        written = []
+
+        def write(image):
+            writing.set()
+            release.wait()
+            written.append(int(image[0, 0, 0]))
+
+        recorder._video = mocker.Mock(write=mocker.Mock(side_effect=write))
+
+        # A frame of a different size is resized
+        assert recorder.write(np.full((48, 64, 3), 1, dtype=np.uint8))
+        assert writing.wait(timeout=1)
+
+        # While the queue is full frames are skipped
+        assert recorder.write(np.full((24, 32, 3), 2, dtype=np.uint8))
+        assert not recorder.write(np.full((24, 32, 3), 3, dtype=np.uint8))
+        assert not recorder.write(np.full((24, 32, 3), 4, dtype=np.uint8))
+        assert recorder.skipped_count == 2
+
+        release.set()
+        while not recorder._frames.empty():
+            time.sleep(0.01)
+
+        # And their time is filled by the next frame
+        assert recorder.write(np.full((24, 32, 3), 5, dtype=np.uint8))
+        recorder.close()
+        assert written == [1, 2, 5, 5, 5]
+        assert recorder.frame_count == 5
+
+
+class TestDashcam:
+
+    def test_add(self, tmp_path):
+        dashcam = camera.Dashcam(duration=1.0, max_bytes=9, directory=str(tmp_path))
+
+        # Frames older than the duration are dropped
+        for index in range(4):
+            dashcam.add(b'ab', timestamp=index * 0.5)
+        assert [timestamp for timestamp, _ in dashcam.frames] == [0.5, 1.0, 1.5]
+
+        # As are frames over the size limit
+        dashcam.add(b'abcdef', timestamp=1.6)
+        assert [timestamp for timestamp, _ in dashcam.frames] == [1.5, 1.6]
+        assert dashcam.size == 8
+
+    def test_trigger(self, video_capture, mocker, tmp_path):
+        mocker.patch.dict(config.SENSOR['camera']['dashcam'], {'post_event': 0.2})
+        broadcaster = camera.CameraBroadcaster.get(0, width=64, height=48, frame_rate=50)
+        dashcam = camera.Dashcam(source=0, duration=0.2, directory=str(tmp_path))
+        with dashcam:
+            time.sleep(0.4)
+            assert dashcam.check_distance(200) is False
+            assert dashcam.check_impact([0, 0, 1.1]) is False
+
+            # Triggers during an event are part of it
+            assert dashcam.check_distance(5) is True
+            file_path = dashcam.event.file_path
+            assert dashcam.trigger('api') is None
+
+            for _ in range(100):
+                if dashcam.event_count:
+                    break
+                time.sleep(0.01)
+            assert dashcam.check_impact([3, 0, 1]) is True
+        broadcaster.stop()
+
+        # Both the pre and post event frames are saved
+        assert dashcam.event_count == 2
+        assert file_path.endswith('-obstacle.mjpeg')
+        with open(file_path.replace('.mjpeg', '.json')) as index_file:
+            index = json.load(index_file)
+        assert index['reason'] == 'obstacle'
+        assert min(index['frame_times']) < -0.1
+        assert max(index['frame_times']) > 0.1
+
+        with open(file_path, 'rb') as event_file:
+            data = event_file.read()
+        assert data.count(b'\xff\xd8') >= len(index['frame_times'])
+        assert data.startswith(b'\xff\xd8')
+
+    def test_restart(self, video_capture, tmp_path):
+        broadcaster = camera.CameraBroadcaster.get(0, width=64, height=48, frame_rate=50)
+        dashcam = camera.Dashcam(source=0, duration=0.2, directory=str(tmp_path))
+        dashcam.start()
+
+        # The buffer thread ends with the subscription
+        broadcaster.stop()
+        for _ in range(100):
+            if dashcam._buffer_thread is None:
+                break
+            time.sleep(0.01)
+        assert dashcam._buffer_thread is None
+
+        # And starting again resumes buffering
+        dashcam.frames.clear()
+        dashcam.start()
+        try:
+            for _ in range(100):
+                if dashcam.frames:
+                    break
+                time.sleep(0.01)
+            assert dashcam.frames
+        finally:
+            dashcam.stop()
+        broadcaster.stop()
+
+
+class TestCamera:
+
+    def test_get_sharpness(self):
+        image = np.zeros((48, 64, 3), dtype=np.uint8)
+        image[::8, :] = 255
+        blurred_image = cv2.GaussianBlur(image, (9, 9), 0)
+        assert camera.get_sharpness(image) > camera.get_sharpness(blurred_image) > 0
+        assert camera.get_sharpness(np.zeros_like(image)) == 0
+
+    def test_capture_image(self, video_capture, mocker, tmp_path):
+        camera_sensor = camera.Camera()
+        images = camera_sensor.capture_burst(3, width=64, height=48)
+        values = [int(image[0, 0, 0]) for image in images]
+        assert values[0] >= 5
+        assert values == list(range(values[0], values[0] + 3))
+        assert all(image.flags.writeable for image in images)
+
+        # The camera stays open for the following captures
+        file_path = str(tmp_path / 'image.jpg')
+        mocker.patch.object(
+            camera, 'get_sharpness', side_effect=lambda image: -abs(int(image[0, 0, 0]) - 9)
+        )
+        camera_sensor.capture_image(file_path, width=32, height=24, best_of=5)
+        assert len(video_capture.instances) == 1
+
+        # The sharpest frame of the burst is saved at the requested size
+        image = cv2.imread(file_path)
+        assert image.shape == (24, 32, 3)
+        assert abs(int(image[0, 0, 0]) - 9) <= 2
+
+    def test_capture_video(self, video_capture, tmp_path):
+        file_path = str(tmp_path / 'video.avi')
+        camera_sensor = camera.Camera()
+        camera_sensor.capture_video(
+            file_path, width=64, height=48, frame_rate=20, duration=0.5
+        )
+
+        # The video has a frame per frame interval
+        video = VideoCapture(file_path)
+        assert video.get(cv2.CAP_PROP_FRAME_COUNT) == 10
+        assert video.get(cv2.CAP_PROP_FPS) == 20
+        read, image = video.read()
+        assert read
+        assert image.shape == (48, 64, 3)
+        video.release()
+
+        # The capture stops with the recording
+        broadcaster = camera.CameraBroadcaster.get(camera_sensor.source)
+        broadcaster.stop()
+        assert video_capture.instances[0].released
+
+    def test_stream_video(self, video_capture):
+        camera_sensor = camera.Camera()
+        stream = camera_sensor.stream_video(width=64, height=48)
+        chunk = next(stream)
+        assert chunk.startswith(b'--frame\r\nContent-Type: image/jpeg\r\n')
+
+        broadcaster = camera.CameraBroadcaster.get(camera_sensor.source)
+        assert broadcaster.subscriber_count == 1
+
+        # Closing the stream unsubscribes it
+        stream.close()
+        assert broadcaster.subscriber_count == 0
+
+    def test_synthetic_source(self, mocker):
+        mocker.patch.object(camera.CameraBroadcaster, '_broadcasters', {})
+        camera_sensor = camera.Camera(source='synthetic')
+        stream = camera_sensor.stream_video(width=64, height=48)
+        try:
+            for _ in range(3):
+                chunk = next(stream)
+                image = cv2.imdecode(
+                    np.frombuffer(chunk.split(b'\r\n\r\n', 1)[1], np.uint8),
+                    cv2.IMREAD_COLOR
+                )
+                assert image.shape == (48, 64, 3)
+        finally:
+            stream.close()
+            camera.CameraBroadcaster.get('synthetic').stop()
+
+    def test_file_source(self, mocker, tmp_path):
+        mocker.patch.object(camera.CameraBroadcaster, '_broadcasters', {})
+        file_path = str(tmp_path / 'source.avi')
+        writer = cv2.VideoWriter(file_path, cv2.VideoWriter_fourcc(*'MJPG'), 20, (64, 48))
+        synthetic = camera.SyntheticCapture(width=64, height=48)
+        for _ in range(3):
+            writer.write(synthetic.read()[1])
+        writer.release()
+
+        # The file is looped past its end
+        broadcaster = camera.CameraBroadcaster.get(file_path, frame_rate=100)
+        subscriber = broadcaster.subscribe(queue_size=10)
+        try:
+            for _ in range(6):
+                assert subscriber.get(timeout=2) is not None
+        finally:
+            broadcaster.stop()
+        assert broadcaster.frame_count >= 6
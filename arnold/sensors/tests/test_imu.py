@@ -1,4 +1,37 @@
+import math
+import time
+
+import numpy as np
+import pytest
+
 from arnold import config
+from arnold.sensors import camera, imu
+
+
+@pytest.fixture
+def calibration_file(mocker, tmp_path):
+    file_path = str(tmp_path / 'imu_calibration.json')
+    mocker.patch.dict(config.SENSOR['imu'], {'calibration_file': file_path})
+    return file_path
+
+
+@pytest.fixture
+def mpu9250(mocker, calibration_file):
+    sensor = mocker.patch.object(imu, 'MPU9250').return_value
+    sensor.gfs, sensor.afs, sensor.mfs, sensor.mode = 3, 3, 1, 0x06
+    sensor.readAccelerometerMaster.return_value = [0.1, 0.2, 0.9]
+    sensor.readGyroscopeMaster.return_value = [1.0, 2.0, 3.0]
+    sensor.readMagnetometerMaster.return_value = [20.0, 5.0, -40.0]
+    sensor.readTemperatureMaster.return_value = 30.5
+
+    # Burst reads
+    sensor.readMaster.return_value = list(range(14))
+    sensor.readAK.return_value = list(range(7))
+    sensor.convertAccelerometer.return_value = [0.1, 0.2, 0.9]
+    sensor.convertGyroscope.return_value = [1.0, 2.0, 3.0]
+    sensor.convertMagnetometer.return_value = [20.0, 5.0, -40.0]
+    sensor.convertTemperature.return_value = 30.5
+    return sensor
 
 
 class TestIMU:
@@ -7,21 +40,249 @@ class TestIMU:
         self.config = config.SENSOR['imu']
 
     def test_config(self):
-        for config_key in ['address', 'orientation']:
+        required_config = [
+            'address', 'orientation', 'calibration_file', 'bias_tracking',
+            'sample_rate', 'buffer_size', 'fusion_gain'
+        ]
+        for config_key in required_config:
             assert config_key in self.config
 
-    def test_get_accelerometer_data(self):
-        # TODO: Figure out how to mock smbus
-        pass
+    def test_calibration(self, mpu9250, calibration_file):
+        # Nothing stored falls back to the configured bias and configures
+        imu_sensor = imu.IMU(orientation={'x': 'y', 'y': 'x', 'z': 'z'})
+        assert mpu9250.gbias == self.config['bias']['gyroscope']
+        mpu9250.configure.assert_called_once()
+
+        mpu9250.abias, mpu9250.gbias = [0.1, 0.2, 0.3], [1.0, 2.0, 3.0]
+        mpu9250.mbias, mpu9250.magScale = [4.0, 5.0, 6.0], [1.0, 1.1, 0.9]
+        mpu9250.magCalibration = [1.2, 1.2, 1.1]
+        imu_sensor.save_calibration()
+
+        # The residual is applied in the module's orientation
+        imu_sensor.update_gyroscope_bias([1.0, 0.0, 0.0], rate=0.5)
+        assert mpu9250.gbias == [1.0, 2.5, 3.0]
+        assert imu_sensor.gbias is mpu9250.gbias
+
+        # The stored calibration is applied
+        mpu9250.configure.reset_mock()
+        imu_sensor = imu.IMU()
+        assert mpu9250.abias == [0.1, 0.2, 0.3]
+        assert mpu9250.gbias == [1.0, 2.0, 3.0]
+        assert mpu9250.mbias == [4.0, 5.0, 6.0]
+        assert mpu9250.magScale == [1.0, 1.1, 0.9]
+        mpu9250.configure.assert_called_once()
+
+        # A module which is still configured is warm started
+        registers = {
+            imu.PWR_MGMT_1: 0x01, imu.GYRO_CONFIG: 0x18, imu.ACCEL_CONFIG: 0x18,
+            imu.INT_PIN_CFG: 0x02, imu.AK8963_CNTL1: 0x16,
+        }
+        mpu9250.readMaster.side_effect = lambda register, size: [registers[register]]
+        mpu9250.readAK.side_effect = lambda register, size: [registers[register]]
+        mpu9250.configure.reset_mock()
+        mpu9250.magCalibration = None
+        imu_sensor = imu.IMU()
+        mpu9250.configure.assert_not_called()
+        assert mpu9250.magCalibration == [1.2, 1.2, 1.1]
+        assert mpu9250.gres == imu.GYRO_SCALE_MODIFIER_2000DEG
+        assert mpu9250.ares == imu.ACCEL_SCALE_MODIFIER_16G
+        assert mpu9250.mres == imu.MAGNOMETER_SCALE_MODIFIER_BIT_16
+
+    def test_calibration_store(self, calibration_file):
+        store = imu.IMUCalibrationStore()
+        assert store.load(0x68) is None
+
+        store.save(0x68, {'gyroscope': [1, 2, 3]})
+        store.save(0x69, {'gyroscope': [4, 5, 6]})
+        assert store.load(0x68) == {'gyroscope': [1.0, 2.0, 3.0]}
+        assert store.load(0x69) == {'gyroscope': [4.0, 5.0, 6.0]}
+
+        # An invalid file is ignored
+        with open(calibration_file, 'w') as invalid_file:
+            invalid_file.write('{')
+        assert store.load(0x68) is None
+
+    def test_get_accelerometer_data(self, mpu9250):
+        imu_sensor = imu.IMU(orientation={'x': 'x', 'y': 'z', 'z': 'y'})
+        assert imu_sensor.get_accelerometer_data() == {'x': 0.1, 'y': 0.9, 'z': 0.2}
+
+    def test_get_gyroscope_data(self, mpu9250):
+        imu_sensor = imu.IMU()
+        assert imu_sensor.get_gyroscope_data() == {'x': 1.0, 'y': 2.0, 'z': 3.0}
+
+    def test_get_magnetometer_data(self, mpu9250):
+        imu_sensor = imu.IMU()
+        assert imu_sensor.get_magnetometer_data() == {'x': 20.0, 'y': 5.0, 'z': -40.0}
+
+    def test_get_temperature(self, mpu9250):
+        imu_sensor = imu.IMU()
+        assert imu_sensor.get_temperature() == 30.5
+
+    def test_read_all(self, mpu9250):
+        imu_sensor = imu.IMU(orientation={'x': 'x', 'y': 'z', 'z': 'y'})
+        sample = imu_sensor.read_all()
+
+        # One burst read per device
+        mpu9250.readMaster.assert_called_once_with(imu.ACCEL_OUT, 14)
+        mpu9250.readAK.assert_called_once_with(imu.AK8963_MAGNET_OUT, 7)
+        mpu9250.convertAccelerometer.assert_called_once_with(
+            list(range(0, 6)), mpu9250.abias
+        )
+        mpu9250.convertTemperature.assert_called_once_with(list(range(6, 8)))
+        mpu9250.convertGyroscope.assert_called_once_with(
+            list(range(8, 14)), mpu9250.gbias
+        )
+
+        assert sample['accelerometer'].tolist() == pytest.approx([0.1, 0.9, 0.2])
+        assert sample['gyroscope'].tolist() == [1.0, 3.0, 2.0]
+        assert sample['magnetometer'].tolist() == [20.0, -40.0, 5.0]
+        assert sample['temperature'] == 30.5
+        assert sample['timestamp'] > 0
+
+    def test_get_attitude(self, mpu9250):
+        imu_sensor = imu.IMU()
+        attitude = imu_sensor.get_attitude(
+            accelerometer_data={'x': 0.0, 'y': 0.0, 'z': 1.0},
+            magnetometer_data={'x': 0.0, 'y': -20.0, 'z': -40.0},
+        )
+        assert attitude == {'roll': 0, 'pitch': 0, 'yaw': 90}
+
+        # Angles are in degrees
+        attitude = imu_sensor.get_attitude(
+            accelerometer_data={'x': 0.5, 'y': 0.0, 'z': math.sqrt(0.75)},
+            magnetometer_data={'x': 20.0, 'y': 0.0, 'z': -40.0},
+        )
+        assert attitude['roll'] == pytest.approx(30)
+        assert attitude['pitch'] == 0
+
+    def test_get_attitudes(self, mpu9250):
+        imu_sensor = imu.IMU()
+        random = np.random.default_rng(0)
+        accelerometer = random.uniform(-1, 1, (50, 3))
+        magnetometer = random.uniform(-50, 50, (50, 3))
+
+        attitudes = imu.get_attitudes(accelerometer, magnetometer)
+        assert len(attitudes) == 50
+        for index in range(50):
+            attitude = imu_sensor.get_attitude(
+                accelerometer_data=dict(zip(imu.AXES, accelerometer[index])),
+                magnetometer_data=dict(zip(imu.AXES, magnetometer[index])),
+            )
+            for key in ['roll', 'pitch', 'yaw']:
+                assert attitudes[key][index] == pytest.approx(attitude[key])
+
+
+class TestAttitudeEstimator:
+
+    def test_initialise(self):
+        estimator = imu.AttitudeEstimator()
+        estimator.update([0, 0, 1], [0, 0, 0], [0, 20, -40], timestamp=0)
+        assert estimator.attitude['roll'] == pytest.approx(0)
+        assert estimator.attitude['pitch'] == pytest.approx(0)
+        assert estimator.heading == pytest.approx(-90)
+
+    def test_converge(self):
+        estimator = imu.AttitudeEstimator(gain=0.5)
+        estimator.update([0, 0, 1], [0, 0, 0], [20, 0, -40], timestamp=0)
+
+        # Tilted 30 degrees and turned 45 degrees while stationary
+        accelerometer = [0, 0.5, math.sqrt(0.75)]
+        for index in range(1, 3000):
+            estimator.update(accelerometer, [0, 0, 0], [14, 14, -40], timestamp=index / 100)
+
+        assert estimator.attitude['roll'] == pytest.approx(30, abs=0.5)
+        assert estimator.attitude['pitch'] == pytest.approx(0, abs=0.5)
+
+    def test_gyroscope_integration(self):
+        estimator = imu.AttitudeEstimator(gain=0.05)
+        for index in range(101):
+            estimator.update([0, 0, 1], [0, 0, 90], timestamp=index / 100)
+
+        assert estimator.heading == pytest.approx(90, abs=0.5)
+
+
+class TestIMUSampler:
+
+    def test_sample(self, mpu9250):
+        imu_sensor = imu.IMU(orientation={'x': 'y', 'y': 'x', 'z': 'z'})
+        sampler = imu.IMUSampler(imu_sensor, buffer_size=4)
+        assert sampler.latest is None
+        assert len(sampler.window()) == 0
+
+        for index in range(6):
+            mpu9250.convertTemperature.return_value = index
+            sampler.sample()
+
+        # Failed reads are skipped
+        mpu9250.readMaster.side_effect = OSError
+        sampler.sample()
+        assert sampler.error_count == 1
+        assert sampler.count == 6
+
+        assert sampler.latest['temperature'] == 5
+        assert sampler.latest['gyroscope'].tolist() == [2.0, 1.0, 3.0]
+
+        # Windows are chronological views into the buffer, even when wrapped
+        window = sampler.window()
+        assert window['temperature'].tolist() == [2, 3, 4, 5]
+        assert window.base is sampler.buffer
+        assert sampler.window(2)['temperature'].tolist() == [4, 5]
+        assert (window['timestamp'][1:] >= window['timestamp'][:-1]).all()
+
+    def test_sampler_thread(self, mpu9250):
+        imu_sensor = imu.IMU()
+        estimator = imu.AttitudeEstimator()
+        with imu.IMUSampler(imu_sensor, sample_rate=200, estimator=estimator) as sampler:
+            time.sleep(0.2)
+
+        assert 10 < sampler.count < 60
+        assert sampler.latest['magnetometer'].tolist() == [20.0, 5.0, -40.0]
+        assert estimator.timestamp == sampler.latest['timestamp']
+
+    def test_callback(self, mpu9250, tmp_path):
+        dashcam = camera.Dashcam(directory=str(tmp_path))
+        sampler = imu.IMUSampler(
+            imu.IMU(),
+            callback=lambda sample: dashcam.check_impact(sample['accelerometer'])
+        )
+
+        sampler.sample()
+        assert dashcam.event is None
+
+        # An impact in a sample triggers a dashcam event
+        mpu9250.convertAccelerometer.return_value = [3.0, 0.0, 1.0]
+        sampler.sample()
+        assert dashcam.event.reason == 'impact'
+
+    def test_track_bias(self, mpu9250, calibration_file, mocker):
+        mocker.patch.dict(
+            config.SENSOR['imu']['bias_tracking'],
+            {'window_size': 10, 'rate': 0.5, 'max_rate': 5.0}
+        )
+        imu_sensor = imu.IMU()
+        mpu9250.gbias = [0.0, 0.0, 0.0]
+        sampler = imu.IMUSampler(imu_sensor, buffer_size=20, track_bias=True)
+
+        # Stationary, the residual gyroscope reading is folded into the bias
+        for _ in range(10):
+            sampler.sample()
+        assert sampler.bias_update_count == 1
+        assert mpu9250.gbias == [0.5, 1.0, 1.5]
 
-    def test_get_gyroscope_data(self):
-        # TODO: Figure out how to mock smbus
-        pass
+        # Moving, the bias is left alone
+        for index in range(10):
+            mpu9250.convertGyroscope.return_value = [10.0 * index, 0.0, 0.0]
+            sampler.sample()
+        assert sampler.bias_update_count == 1
 
-    def test_get_magnetometer_data(self):
-        # TODO: Figure out how to mock smbus
-        pass
+        # As it is turning at a steady rate, which is as smooth as stationary
+        mpu9250.convertGyroscope.return_value = [0.0, 0.0, 30.0]
+        for _ in range(10):
+            sampler.sample()
+        assert sampler.bias_update_count == 1
+        assert mpu9250.gbias == [0.5, 1.0, 1.5]
 
-    def test_get_temperature(self):
-        # TODO: Figure out how to mock smbus
-        pass
+        # The updated bias is saved on stop
+        sampler.stop()
+        assert imu_sensor.calibration_store.load(0x68)['gyroscope'] == [0.5, 1.0, 1.5]
+        assert sampler.bias_update_count == 0
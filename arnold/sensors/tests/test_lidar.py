@@ -1,4 +1,44 @@
+import os
+import threading
+import time
+
+import pytest
+import serial
+
 from arnold import config
+from arnold.sensors import lidar
+
+
+class FakeSerial:
+
+    def __init__(self, data=b'', **kwargs):
+        self.data = bytearray(data)
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def feed(self, data):
+        with self.lock:
+            self.data.extend(data)
+
+    @property
+    def in_waiting(self):
+        return len(self.data)
+
+    def read(self, size=1):
+        with self.lock:
+            data = bytes(self.data[:size])
+            del self.data[:size]
+        if not data:
+            # Emulate the serial read timeout
+            time.sleep(0.01)
+        return data
+
+    def reset_input_buffer(self):
+        with self.lock:
+            self.data.clear()
+
+    def close(self):
+        self.closed = True
 
 
 class TestLidar:
@@ -7,9 +47,238 @@ class TestLidar:
         self.config = config.SENSOR['lidar']
 
     def test_config(self):
-        for config_key in ['serial_port', 'baudrate']:
+        required_config = [
+            'serial_port', 'baudrate', 'read_timeout', 'reading_timeout', 'streaming',
+            'window_size', 'outlier_threshold'
+        ]
+        for config_key in required_config:
             assert config_key in self.config
 
-    def test_get_distance(self):
-        # TODO: Figure out how to mock Serial
-        pass
+    def test_parse_frame(self):
+        reading = lidar.parse_frame(lidar.encode_frame(300, strength=1200), timestamp=1.0)
+        assert reading == lidar.LidarReading(
+            distance=300, strength=1200, temperature=40.0, timestamp=1.0
+        )
+
+        # Invalid checksum and header
+        frame = bytearray(lidar.encode_frame(300))
+        frame[8] = (frame[8] + 1) & 0xff
+        assert lidar.parse_frame(bytes(frame)) is None
+        assert lidar.parse_frame(b'\x00' + lidar.encode_frame(300)[1:]) is None
+
+    def test_decode_frames(self):
+        corrupt_frame = bytearray(lidar.encode_frame(10))
+        corrupt_frame[8] ^= 0xff
+
+        # A distance of 0x5959 puts a header inside the frame payload
+        buffer = b''.join([
+            b'\x01\x59',
+            bytes(corrupt_frame),
+            lidar.encode_frame(120, strength=900),
+            lidar.encode_frame(0x5959),
+            lidar.encode_frame(300),
+            lidar.encode_frame(400)[:5],
+        ])
+        readings, consumed = lidar.decode_frames(buffer)
+
+        assert readings['distance'].tolist() == [120, 0x5959, 300]
+        assert readings['strength'].tolist() == [900, 1000, 1000]
+        assert readings['temperature'].tolist() == [40.0, 40.0, 40.0]
+        assert readings['offset'].tolist() == [11, 20, 29]
+        assert buffer[consumed:] == lidar.encode_frame(400)[:5]
+
+        # Nothing to decode keeps a trailing partial header
+        readings, consumed = lidar.decode_frames(b'\x00\x01\x59')
+        assert len(readings) == 0
+        assert consumed == 2
+
+    def test_get_distance(self, mocker):
+        fake_serial = FakeSerial(lidar.encode_frame(300))
+        mocker.patch.object(lidar.serial, 'Serial', return_value=fake_serial)
+
+        lidar_sensor = lidar.Lidar(streaming=False)
+        assert lidar_sensor.get_distance() == 300
+
+    def test_streaming(self, mocker):
+        fake_serial = FakeSerial()
+        mocker.patch.object(lidar.serial, 'Serial', return_value=fake_serial)
+
+        lidar_sensor = lidar.Lidar(streaming=True)
+        try:
+            assert lidar_sensor.get_reading() is None
+
+            # Garbage and a corrupt frame ahead of valid frames are skipped
+            corrupt_frame = bytearray(lidar.encode_frame(10))
+            corrupt_frame[8] ^= 0xff
+            data = b'\x01\x59' + bytes(corrupt_frame) + lidar.encode_frame(120)
+            threading.Timer(0.05, fake_serial.feed, args=(data, )).start()
+            reading = lidar_sensor.wait_for_reading(timeout=1)
+            assert reading.distance == 120
+            assert lidar_sensor.get_reading() is reading
+
+            # Frames split across reads are reassembled
+            frame = lidar.encode_frame(250)
+            fake_serial.feed(frame[:4])
+            assert lidar_sensor.wait_for_reading(timeout=0.2) is None
+            threading.Timer(0.05, fake_serial.feed, args=(frame[4:], )).start()
+            assert lidar_sensor.wait_for_reading(timeout=1).distance == 250
+        finally:
+            lidar_sensor.release()
+
+        assert fake_serial.closed
+
+    def test_streaming_bulk(self, mocker):
+        fake_serial = FakeSerial()
+        mocker.patch.object(lidar.serial, 'Serial', return_value=fake_serial)
+
+        lidar_sensor = lidar.Lidar(streaming=True, window_size=100)
+        try:
+            # A backlog of frames, with a corrupt one, is decoded in one batch
+            corrupt_frame = bytearray(lidar.encode_frame(10))
+            corrupt_frame[8] ^= 0xff
+            frames = [lidar.encode_frame(100 + index) for index in range(40)]
+            frames.insert(20, bytes(corrupt_frame))
+            threading.Timer(0.05, fake_serial.feed, args=(b''.join(frames), )).start()
+            assert lidar_sensor.wait_for_reading(timeout=1).distance == 139
+            assert lidar_sensor.statistics.count == 40
+        finally:
+            lidar_sensor.release()
+
+    def test_reader_failure(self, mocker):
+        fake_serial = FakeSerial()
+        fake_serial.read = mocker.Mock(side_effect=serial.SerialException('unplugged'))
+        mocker.patch.object(lidar.serial, 'Serial', return_value=fake_serial)
+
+        lidar_sensor = lidar.Lidar(streaming=True)
+        try:
+            with pytest.raises(lidar.LidarError, match='unplugged'):
+                lidar_sensor.get_distance()
+            with pytest.raises(lidar.LidarError, match='unplugged'):
+                lidar_sensor.get_smoothed_distance()
+            assert isinstance(lidar_sensor.error, serial.SerialException)
+        finally:
+            lidar_sensor.release()
+
+    def test_reading_timeout(self, mocker):
+        mocker.patch.dict(self.config, {'reading_timeout': 0.05})
+        mocker.patch.object(lidar.serial, 'Serial', return_value=FakeSerial())
+
+        lidar_sensor = lidar.Lidar(streaming=True)
+        try:
+            with pytest.raises(lidar.LidarError, match='No lidar reading'):
+                lidar_sensor.get_distance()
+            with pytest.raises(lidar.LidarError, match='No lidar reading'):
+                lidar_sensor.get_smoothed_distance()
+        finally:
+            lidar_sensor.release()
+
+    def test_get_smoothed_distance(self, mocker):
+        fake_serial = FakeSerial()
+        mocker.patch.object(lidar.serial, 'Serial', return_value=fake_serial)
+
+        lidar_sensor = lidar.Lidar(streaming=True, window_size=5)
+        try:
+            data = b''.join(
+                lidar.encode_frame(distance) for distance in [90, 300, 100, 110, 100, 90]
+            )
+            fake_serial.feed(data)
+            for _ in range(100):
+                if lidar_sensor.statistics.count == 5:
+                    break
+                time.sleep(0.01)
+
+            # The 300cm outlier is rejected from the window
+            assert lidar_sensor.get_smoothed_distance(threshold=1.0) == 100
+
+            # Waiting for a new frame blocks until one arrives
+            mocker.patch.dict(self.config, {'reading_timeout': 0.05})
+            with pytest.raises(lidar.LidarError):
+                lidar_sensor.get_smoothed_distance(wait_for_new=True)
+            mocker.patch.dict(self.config, {'reading_timeout': 1.0})
+            frame = lidar.encode_frame(100)
+            threading.Timer(0.05, fake_serial.feed, args=(frame, )).start()
+            assert lidar_sensor.get_smoothed_distance(wait_for_new=True) == 100
+        finally:
+            lidar_sensor.release()
+
+    def test_record_and_replay(self, mocker, tmp_path):
+        fake_serial = FakeSerial()
+        mocker.patch.object(lidar.serial, 'Serial', return_value=fake_serial)
+
+        file_path = str(tmp_path / 'lidar.rec')
+        distances = [100, 120, 140, 160]
+
+        lidar_sensor = lidar.Lidar(streaming=True)
+        lidar_sensor.record(file_path)
+        try:
+            for distance in distances:
+                frame = lidar.encode_frame(distance)
+                threading.Timer(0.02, fake_serial.feed, args=(frame, )).start()
+                assert lidar_sensor.wait_for_reading(timeout=1).distance == distance
+        finally:
+            lidar_sensor.release()
+
+        records = lidar.load_recording(file_path)
+        assert len(records) == len(distances)
+        assert lidar.decode_recording(records)['distance'].tolist() == distances
+        assert (records['timestamp'][1:] >= records['timestamp'][:-1]).all()
+        assert records['frame'][0].tobytes() == lidar.encode_frame(100)
+
+        # Replay as fast as possible through the same interface
+        lidar_replay = lidar.LidarReplay(file_path, speed=0, window_size=len(distances))
+        try:
+            for _ in range(100):
+                if lidar_replay.statistics.count == len(distances):
+                    break
+                time.sleep(0.01)
+
+            assert lidar_replay.get_reading().distance == 160
+            assert lidar_replay.get_smoothed_distance() == 130
+        finally:
+            lidar_replay.release()
+
+    def test_load_recording_truncated(self, tmp_path):
+        file_path = str(tmp_path / 'lidar.rec')
+        with lidar.LidarRecorder(file_path) as recorder:
+            for index, distance in enumerate([100, 120, 140]):
+                recorder.write(lidar.encode_frame(distance), timestamp=float(index))
+
+        # Lose the end of the last record, as on a power cut mid-write
+        with open(file_path, 'r+b') as recording_file:
+            recording_file.truncate(os.path.getsize(file_path) - 5)
+
+        records = lidar.load_recording(file_path)
+        assert lidar.decode_recording(records)['distance'].tolist() == [100, 120]
+
+    def test_recorder_flush(self, tmp_path):
+        file_path = str(tmp_path / 'lidar.rec')
+        recorder = lidar.LidarRecorder(file_path, flush_interval=0)
+        try:
+            recorder.write(lidar.encode_frame(100), timestamp=0.0)
+
+            # Readable before the recorder is closed
+            assert len(lidar.load_recording(file_path)) == 1
+        finally:
+            recorder.close()
+
+    def test_load_recording_invalid(self, tmp_path):
+        file_path = tmp_path / 'invalid.rec'
+        file_path.write_bytes(b'not a recording')
+        with pytest.raises(ValueError):
+            lidar.load_recording(str(file_path))
+
+    def test_simulator(self):
+        script = [(0, 300), (0.2, 300), (0.3, 30)]
+        with lidar.LidarSimulator(rate=200, script=script) as simulator:
+            lidar_sensor = lidar.Lidar(serial_port=simulator.port, window_size=5)
+            try:
+                assert lidar_sensor.wait_for_reading(timeout=1).distance == 300
+
+                # The obstacle script is followed
+                time.sleep(0.4)
+                assert lidar_sensor.get_smoothed_distance() == 30
+            finally:
+                lidar_sensor.release()
+
+        assert simulator.frame_count > 0
+        assert simulator.distance_at(0.25) == 165
@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+
+from arnold import config
+from arnold.sensors import vision
+
+
+def get_frame(x, y, seed=0):
+    """
+    A noise frame with a textured 'person' at x, y in a 320x240 frame, scaled up
+    to 640x480.
+    """
+    random = np.random.default_rng(seed)
+    frame = random.integers(0, 64, (240, 320, 3), dtype=np.uint8)
+    person = np.random.default_rng(1).integers(128, 256, (128, 64, 3), dtype=np.uint8)
+    frame[y:y + 128, x:x + 64] = person
+    return np.repeat(np.repeat(frame, 2, axis=0), 2, axis=1)
+
+
+@pytest.fixture
+def tracker(mocker):
+    tracker = vision.PersonTracker(
+        detection_width=320, redetect_interval=1.0, lost_timeout=0.5, flip=False
+    )
+    mocker.patch.object(tracker, '_hog')
+    tracker._hog.detectMultiScale.return_value = (
+        np.array([[100, 50, 64, 128]]), np.array([[1.5]])
+    )
+    return tracker
+
+
+class TestPersonTracker:
+
+    def setup_method(self, method):
+        self.config = config.SENSOR['camera']['follow']
+
+    def test_config(self):
+        required_config = [
+            'detection_width', 'redetect_interval', 'track_threshold', 'lost_timeout',
+            'deadband', 'stop_height'
+        ]
+        for config_key in required_config:
+            assert config_key in self.config
+
+    def test_detect(self, tracker):
+        target = tracker.update(get_frame(100, 50), timestamp=0)
+        assert target.detected
+        assert target.x == pytest.approx(100 / 320)
+        assert target.height == pytest.approx(128 / 240)
+        assert target.offset == pytest.approx((132 / 320) * 2 - 1)
+
+        # The detector runs on the downscaled grayscale frame
+        frame = tracker._hog.detectMultiScale.call_args[0][0]
+        assert frame.shape == (240, 320)
+
+    def test_track(self, tracker):
+        tracker.update(get_frame(100, 50), timestamp=0)
+
+        # Between detections the target is tracked by its template
+        target = tracker.update(get_frame(120, 56, seed=1), timestamp=0.1)
+        assert not target.detected
+        assert target.x == pytest.approx(120 / 320)
+        assert target.y == pytest.approx(56 / 240)
+        assert target.score > 0.9
+        assert tracker.detect_count == 1
+        assert tracker.track_count == 1
+
+        # A detection is rerun after the interval
+        tracker.update(get_frame(100, 50), timestamp=1.1)
+        assert tracker.detect_count == 2
+
+    def test_lost(self, tracker):
+        target = tracker.update(get_frame(100, 50), timestamp=0)
+        tracker._hog.detectMultiScale.return_value = ((), ())
+
+        # Missed frames are ridden out on the last known target until the timeout
+        empty_frame = get_frame(0, 0, seed=2) // 4
+        assert tracker.update(empty_frame, timestamp=0.1) is target
+        assert tracker.target is target
+        assert tracker.update(empty_frame, timestamp=0.6) is None
+        assert tracker.target is None
+
+    def test_get_direction(self):
+        target = vision.Target(
+            x=0.45, y=0.1, width=0.1, height=0.5, score=1.0, timestamp=0, detected=True
+        )
+        assert vision.get_direction(None) == 'stop'
+        assert vision.get_direction(target, deadband=0.2, stop_height=0.8) == 'forward'
+
+        target.x = 0.7
+        assert vision.get_direction(target, deadband=0.2, stop_height=0.8) == 'right'
+        target.x = 0.2
+        assert vision.get_direction(target, deadband=0.2, stop_height=0.8) == 'left'
+
+        # Close enough
+        target.x, target.height = 0.45, 0.9
+        assert vision.get_direction(target, deadband=0.2, stop_height=0.8) == 'stop'
@@ -0,0 +1,296 @@
+import logging
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from arnold import config
+
+
+_logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Target:
+    """
+    A tracked person, with the bounding box as fractions of the frame size.
+    """
+    x: float
+    y: float
+    width: float
+    height: float
+    score: float
+    timestamp: float
+    detected: bool
+
+    @property
+    def offset(self) -> float:
+        """
+        The horizontal offset of the centre of the target from the centre of the
+        frame.
+
+        Returns:
+            float: -1.0 at the left edge to 1.0 at the right edge
+        """
+        return (self.x + self.width / 2) * 2 - 1
+
+
+def get_direction(
+    target: Optional[Target],
+    deadband: Optional[float] = None,
+    stop_height: Optional[float] = None
+) -> str:
+    """
+    The drivetrain direction to keep a target centred and follow it.
+
+    Args:
+        target (Target, optional): The target, if any
+        deadband (float, optional): The offset from the centre within which the
+        target is centred
+        stop_height (float, optional): The fraction of the frame height at which
+        the target is close enough to stop
+
+    Returns:
+        str: `left`, `right`, `forward` or `stop`
+    """
+    follow_config = config.SENSOR['camera']['follow']
+    deadband = follow_config['deadband'] if deadband is None else deadband
+    stop_height = follow_config['stop_height'] if stop_height is None else stop_height
+
+    if target is None:
+        return 'stop'
+    if abs(target.offset) > deadband:
+        return 'right' if target.offset > 0 else 'left'
+    if target.height >= stop_height:
+        return 'stop'
+    return 'forward'
+
+
+class PersonTracker(object):
+    """
+    Tracks a person in the camera frames. The HOG people detector is far too slow
+    for every full size frame on a Pi, so frames are downscaled to grayscale at
+    `detection_width` and once a person is detected they're tracked by template
+    matching around their last position, with a full detection only every
+    `redetect_interval` seconds to correct drift and reacquire lost targets.
+
+    Args:
+        detection_width (int, optional): The width frames are downscaled to
+        redetect_interval (float, optional): Seconds between detections while a
+        target is tracked
+        track_threshold (float, optional): The minimum template match score (0 - 1)
+        to keep tracking
+        lost_timeout (float, optional): Seconds without a match before the target
+        is lost
+        flip (bool, optional): Flip frames vertically, for the camera mounted
+        upside down, as the detector only finds upright people
+    """
+
+    def __init__(
+        self,
+        detection_width: Optional[int] = None,
+        redetect_interval: Optional[float] = None,
+        track_threshold: Optional[float] = None,
+        lost_timeout: Optional[float] = None,
+        flip: Optional[bool] = None
+    ) -> None:
+        self.config = config.SENSOR['camera']['follow']
+        self.detection_width = detection_width or self.config['detection_width']
+        self.redetect_interval = (
+            self.config['redetect_interval'] if redetect_interval is None
+            else redetect_interval
+        )
+        self.track_threshold = (
+            self.config['track_threshold'] if track_threshold is None
+            else track_threshold
+        )
+        self.lost_timeout = (
+            self.config['lost_timeout'] if lost_timeout is None else lost_timeout
+        )
+        self.flip = self.config['flip'] if flip is None else flip
+        self.search_margin = self.config['search_margin']
+        self.hit_threshold = self.config['hit_threshold']
+
+        self.target = None
+        self.detect_count = 0
+        self.track_count = 0
+
+        self._hog = cv2.HOGDescriptor()
+        self._hog.setSVMDetector(cv2.HOGDescriptor_getDefaultPeopleDetector())
+        self._template = None
+        self._box = None
+        self._detected_at = None
+
+        # Setup logging
+        self._logger = _logger
+
+    def reset(self) -> None:
+        """
+        Forget the target.
+        """
+        self.target = None
+        self._template = None
+        self._box = None
+        self._detected_at = None
+
+    def _prepare(self, image: np.ndarray) -> np.ndarray:
+        """
+        Downscale a frame to grayscale at the detection width.
+
+        Args:
+            image (np.ndarray): The BGR frame
+
+        Returns:
+            np.ndarray: The grayscale frame
+        """
+        height, width = image.shape[:2]
+        size = (self.detection_width, round(height * self.detection_width / width))
+        frame = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        return cv2.flip(frame, 0) if self.flip else frame
+
+    def _set_target(
+        self,
+        frame: np.ndarray,
+        box: tuple,
+        score: float,
+        timestamp: float,
+        detected: bool
+    ) -> Target:
+        """
+        Update the target from a box in the downscaled frame.
+        """
+        x, y, width, height = box
+        frame_height, frame_width = frame.shape
+        self._box = box
+        self.target = Target(
+            x=x / frame_width,
+            y=y / frame_height,
+            width=width / frame_width,
+            height=height / frame_height,
+            score=float(score),
+            timestamp=timestamp,
+            detected=detected,
+        )
+        return self.target
+
+    def _detect(self, frame: np.ndarray, timestamp: float) -> Optional[Target]:
+        """
+        Detect people in the frame, preferring the closest to the current target.
+
+        Args:
+            frame (np.ndarray): The downscaled grayscale frame
+            timestamp (float): The frame's capture time
+
+        Returns:
+            Target: The target or `None` if nobody was detected
+        """
+        self.detect_count += 1
+        self._detected_at = timestamp
+
+        boxes, weights = self._hog.detectMultiScale(
+            frame, hitThreshold=self.hit_threshold, winStride=(8, 8),
+            padding=(8, 8), scale=1.05
+        )
+        if len(boxes) == 0:
+            return None
+
+        # Clip the boxes to the frame so the template fits the search window
+        frame_height, frame_width = frame.shape
+        boxes = [
+            (
+                max(x, 0), max(y, 0),
+                min(x + width, frame_width) - max(x, 0),
+                min(y + height, frame_height) - max(y, 0),
+            )
+            for x, y, width, height in boxes
+        ]
+        scores = np.ravel(weights)
+
+        if self._box is not None:
+            centre_x = self._box[0] + self._box[2] / 2
+            centre_y = self._box[1] + self._box[3] / 2
+            index = min(
+                range(len(boxes)),
+                key=lambda i: (
+                    (boxes[i][0] + boxes[i][2] / 2 - centre_x) ** 2 +
+                    (boxes[i][1] + boxes[i][3] / 2 - centre_y) ** 2
+                )
+            )
+        else:
+            index = int(np.argmax(scores))
+
+        x, y, width, height = boxes[index]
+        self._template = frame[y:y + height, x:x + width].copy()
+        return self._set_target(frame, boxes[index], scores[index], timestamp, True)
+
+    def _track(self, frame: np.ndarray, timestamp: float) -> Optional[Target]:
+        """
+        Find the target's template in a window around its last position.
+
+        Args:
+            frame (np.ndarray): The downscaled grayscale frame
+            timestamp (float): The frame's capture time
+
+        Returns:
+            Target: The target or `None` if it wasn't matched
+        """
+        self.track_count += 1
+
+        x, y, width, height = self._box
+        frame_height, frame_width = frame.shape
+        margin_x = int(width * self.search_margin)
+        margin_y = int(height * self.search_margin)
+        left, top = max(x - margin_x, 0), max(y - margin_y, 0)
+        right = min(x + width + margin_x, frame_width)
+        bottom = min(y + height + margin_y, frame_height)
+
+        result = cv2.matchTemplate(
+            frame[top:bottom, left:right], self._template, cv2.TM_CCOEFF_NORMED
+        )
+        _, score, _, location = cv2.minMaxLoc(result)
+        if score < self.track_threshold:
+            return None
+
+        box = (left + location[0], top + location[1], width, height)
+        return self._set_target(frame, box, score, timestamp, False)
+
+    def update(
+        self,
+        image: np.ndarray,
+        timestamp: Optional[float] = None
+    ) -> Optional[Target]:
+        """
+        Detect or track the target in a frame.
+
+        Args:
+            image (np.ndarray): The BGR frame
+            timestamp (float, optional): The frame's capture time. Defaults to now.
+
+        Returns:
+            Target: The target, the last known target if it was missed within the
+            lost timeout, or `None` if it's lost
+        """
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        frame = self._prepare(image)
+        tracking = self.target is not None
+
+        target = None
+        if self._template is None or (
+            timestamp - self._detected_at >= self.redetect_interval
+        ):
+            target = self._detect(frame, timestamp)
+        if target is None and self._template is not None:
+            target = self._track(frame, timestamp)
+
+        # Ride out a few missed frames on the last known target before losing it
+        if target is None and self.target is not None:
+            if timestamp - self.target.timestamp < self.lost_timeout:
+                return self.target
+            self._logger.info('Lost the target.')
+            self.reset()
+        elif target is not None and not tracking:
+            self._logger.info('Acquired a target.')
+        return target
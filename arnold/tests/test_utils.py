@@ -0,0 +1,182 @@
+import random
+import statistics
+import threading
+import time
+
+import pytest
+
+from arnold import utils
+
+
+class TestRollingStatistics:
+
+    def test_empty(self):
+        rolling_statistics = utils.RollingStatistics(window_size=5)
+        assert rolling_statistics.count == 0
+        assert rolling_statistics.mean is None
+        assert rolling_statistics.variance is None
+        assert rolling_statistics.median is None
+        assert rolling_statistics.filtered_mean() is None
+
+    def test_window(self):
+        values = [random.uniform(0, 500) for _ in range(100)]
+        rolling_statistics = utils.RollingStatistics(window_size=10)
+        for index, value in enumerate(values):
+            rolling_statistics.update(value)
+            window = values[max(0, index - 9):index + 1]
+
+            assert rolling_statistics.count == len(window)
+            assert abs(rolling_statistics.mean - statistics.mean(window)) < 1e-6
+            assert rolling_statistics.median == statistics.median(window)
+            if len(window) > 1:
+                assert abs(rolling_statistics.variance - statistics.variance(window)) < 1e-6
+
+    def test_filtered_mean(self):
+        rolling_statistics = utils.RollingStatistics(window_size=10)
+        for value in [100, 101, 99, 100, 102, 98, 100, 101, 99, 1200]:
+            rolling_statistics.update(value)
+
+        assert rolling_statistics.filtered_mean() == 100
+        assert rolling_statistics.mean == 210
+
+        rolling_statistics.reset()
+        assert rolling_statistics.count == 0
+
+
+class TestRateLoop:
+
+    def test_run(self):
+        loop = utils.RateLoop(rate=100)
+        deadlines = []
+        loop.run(lambda: deadlines.append(loop.deadline), lambda: len(deadlines) < 10)
+
+        # Deadlines are fixed, not after each call
+        intervals = [end - start for start, end in zip(deadlines, deadlines[1:])]
+        assert intervals == [pytest.approx(0.01)] * 9
+        assert loop.overrun_count == 0
+
+    def test_overrun(self):
+        loop = utils.RateLoop(rate=100)
+        deadlines = []
+
+        def slow_step():
+            deadlines.append(loop.deadline)
+            time.sleep(0.03)
+
+        # Deadlines passed during a slow call are skipped
+        loop.run(slow_step, lambda: len(deadlines) < 3)
+        assert loop.overrun_count == 3
+        assert deadlines[1] - deadlines[0] > 0.02
+
+
+class TestMotionScheduler:
+
+    def test_async_delay(self):
+        events = []
+        scheduler = utils.MotionScheduler(halt_callback=lambda: events.append('halt'))
+        try:
+            scheduler.async_delay(0.1, start_callback=lambda: events.append('start'))
+
+            # The motion is started in the calling thread
+            assert events == ['start']
+            assert scheduler.is_active()
+            time.sleep(0.2)
+            assert events == ['start', 'halt']
+            assert not scheduler.is_active()
+
+            # Blocking delays wait for the halt
+            start_time = time.monotonic()
+            scheduler.delay(0.1)
+            assert 0.1 <= time.monotonic() - start_time < 0.15
+        finally:
+            scheduler.close()
+
+    def test_terminate(self):
+        events = []
+        scheduler = utils.MotionScheduler(halt_callback=lambda: events.append('halt'))
+        try:
+            scheduler.async_delay(10)
+            scheduler.terminate()
+            assert events == ['halt']
+            assert not scheduler.is_active()
+
+            # A terminated motion isn't halted again by its deadline
+            scheduler.async_delay(0.1)
+            scheduler.terminate()
+            time.sleep(0.2)
+            assert events == ['halt', 'halt']
+        finally:
+            scheduler.close()
+
+    def test_pause(self):
+        events = []
+        scheduler = utils.MotionScheduler(
+            halt_callback=lambda: events.append(('halt', time.monotonic())),
+            pause_duration=0.1
+        )
+        try:
+            thread_count = threading.active_count()
+            for direction in ['forward', 'back', 'left']:
+                scheduler.async_delay(
+                    1, start_callback=lambda direction=direction: events.append(
+                        (direction, time.monotonic())
+                    )
+                )
+            assert threading.active_count() <= thread_count + 1
+
+            # Replaced motions are halted and the next only starts after the pause
+            assert [event for event, _ in events] == ['forward', 'halt']
+            time.sleep(0.15)
+            assert [event for event, _ in events] == ['forward', 'halt', 'left']
+            assert events[2][1] - events[1][1] >= 0.1
+        finally:
+            scheduler.close()
+
+
+class TestDeviceRegistry:
+
+    def test_get(self):
+        registry = utils.DeviceRegistry()
+        try:
+            drivetrain = registry.get('motion.drivetrain.DriveTrain')
+            assert registry.get('motion.drivetrain.DriveTrain') is drivetrain
+            assert registry.get('sensors.vision.PersonTracker') is not drivetrain
+        finally:
+            registry.release_all()
+
+        # Released devices free their pins and are created afresh
+        assert drivetrain.left_motor.closed
+        assert registry.get('motion.drivetrain.DriveTrain') is not drivetrain
+        registry.release_all()
+
+    def test_release(self, mocker):
+        registry = utils.DeviceRegistry()
+        dashcam = registry.get('sensors.camera.Dashcam')
+        stop = mocker.patch.object(dashcam, 'stop')
+
+        # Devices without a release method are stopped
+        registry.release('sensors.camera.Dashcam')
+        stop.assert_called_once()
+        registry.release('sensors.camera.Dashcam')
+        stop.assert_called_once()
+
+    def test_ramp(self):
+        values = []
+        scheduler = utils.MotionScheduler()
+        try:
+            start_time = time.monotonic()
+            scheduler.schedule([utils.MotionStep(
+                duration=0.3,
+                start_callback=lambda: values.append((0, time.monotonic())),
+                ramp=[1, 2, 3],
+                ramp_callback=lambda value: values.append((value, time.monotonic())),
+                tick=0.05,
+            )])
+            assert scheduler.wait(timeout=1)
+
+            # The ramp is applied at a fixed tick from the start of the step
+            assert [value for value, _ in values] == [0, 1, 2, 3]
+            for index, (_, timestamp) in enumerate(values[1:], start=1):
+                assert 0 <= timestamp - start_time - index * 0.05 < 0.02
+        finally:
+            scheduler.close()
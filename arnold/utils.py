@@ -1,9 +1,14 @@
+import atexit
+import bisect
+import collections
 import importlib
 import logging
+import math
 import string
 import threading
 import time
-from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
 
 from arnold.constants import COMMAND_MAP, INT_MAP
 
@@ -18,64 +23,542 @@ def sanitise_input(input: str, punctuation: Optional[str] = None) -> str:
     return input.translate(str.maketrans('', '', punctuation)).lower()
 
 
-class InterruptibleDelay(object):
+class RollingStatistics(object):
     """
-    An interruptable delay used to ensure that `sleep` can be interrupted
-    before the delay timeout is complete.
+    Rolling window statistics which are updated incrementally as values arrive,
+    so the mean, variance and median of the window are available in O(1) instead
+    of being recomputed from a list on every query. The mean and variance cost
+    O(1) per update, the sorted copy of the window which the median and filtered
+    mean are read from costs O(window) per update, a cheap memmove for the small
+    windows used. Not thread safe, callers sharing an instance across threads must
+    hold their own lock.
 
     Args:
-        halt_callback (callable, optional): The function to call when the delay
-        is interrupted or complete.
+        window_size (int): The number of most recent values to keep.
+    """
+
+    def __init__(self, window_size: int) -> None:
+        if window_size < 1:
+            raise ValueError('The window size must be at least 1.')
+
+        self.window_size = window_size
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Clear all values from the window.
+        """
+        self._window = collections.deque()
+        self._sorted_window = []
+        self._mean = 0.0
+        self._sum_squares = 0.0
+
+    def update(self, value: float) -> None:
+        """
+        Add a value to the window, evicting the oldest value once the window is
+        full. Mean and variance are maintained with Welford's method.
+
+        Args:
+            value (float): The new value
+        """
+        if len(self._window) == self.window_size:
+            old_value = self._window.popleft()
+            del self._sorted_window[bisect.bisect_left(self._sorted_window, old_value)]
+
+            mean = self._mean + (value - old_value) / self.window_size
+            self._sum_squares += (value - old_value) * (value - mean + old_value - self._mean)
+            self._mean = mean
+        else:
+            delta = value - self._mean
+            self._mean += delta / (len(self._window) + 1)
+            self._sum_squares += delta * (value - self._mean)
+
+        self._sum_squares = max(self._sum_squares, 0.0)
+        self._window.append(value)
+        bisect.insort(self._sorted_window, value)
+
+    @property
+    def count(self) -> int:
+        """
+        The number of values in the window.
+
+        Returns:
+            int: value count
+        """
+        return len(self._window)
+
+    @property
+    def mean(self) -> Optional[float]:
+        """
+        The mean of the window.
+
+        Returns:
+            float: mean or `None` if the window is empty
+        """
+        return self._mean if self._window else None
+
+    @property
+    def variance(self) -> Optional[float]:
+        """
+        The sample variance of the window.
+
+        Returns:
+            float: variance or `None` if the window is empty
+        """
+        if not self._window:
+            return None
+        if len(self._window) == 1:
+            return 0.0
+        return self._sum_squares / (len(self._window) - 1)
+
+    @property
+    def stdev(self) -> Optional[float]:
+        """
+        The sample standard deviation of the window.
+
+        Returns:
+            float: standard deviation or `None` if the window is empty
+        """
+        variance = self.variance
+        return None if variance is None else math.sqrt(variance)
+
+    @property
+    def median(self) -> Optional[float]:
+        """
+        The median of the window.
 
+        Returns:
+            float: median or `None` if the window is empty
+        """
+        count = len(self._sorted_window)
+        if not count:
+            return None
+
+        middle = count // 2
+        if count % 2:
+            return self._sorted_window[middle]
+        return (self._sorted_window[middle - 1] + self._sorted_window[middle]) / 2
+
+    def filtered_mean(self, threshold: float = 2.0) -> Optional[float]:
+        """
+        The mean of the window after rejecting outliers further than `threshold`
+        standard deviations from the median.
+
+        Args:
+            threshold (float, optional): The outlier threshold in standard
+            deviations. Defaults to 2.0.
+
+        Returns:
+            float: outlier rejected mean or `None` if the window is empty
+        """
+        median = self.median
+        if median is None:
+            return None
+
+        limit = threshold * self.stdev
+        lower = bisect.bisect_left(self._sorted_window, median - limit)
+        upper = bisect.bisect_right(self._sorted_window, median + limit)
+        inliers = self._sorted_window[lower:upper]
+        if not inliers:
+            return median
+        return sum(inliers) / len(inliers)
+
+
+class RateLoop(object):
+    """
+    Calls a function at a fixed rate against fixed deadlines, so the rate doesn't
+    drift with the function's run time. A deadline which has already passed when
+    the function returns is skipped and counted as an overrun.
+
+    Args:
+        rate (float): The rate in Hz
+    """
+
+    def __init__(self, rate: float) -> None:
+        self.interval = 1 / rate
+
+        # The time the current call was due
+        self.deadline = None
+        self.overrun_count = 0
+
+    def run(
+        self,
+        step: Callable[[], Any],
+        keep_running: Callable[[], bool],
+        start_time: Optional[float] = None,
+        sleep: Callable[[float], Any] = time.sleep
+    ) -> None:
+        """
+        Call `step` at the rate until `keep_running`, checked before every call,
+        returns False.
+
+        Args:
+            step (callable): The function to call, which can read `deadline`
+            keep_running (callable): Whether to keep calling the function
+            start_time (float, optional): The first deadline. Defaults to now.
+            sleep (callable, optional): Sleeps until the next deadline, e.g. an
+            event's `wait` to be woken when stopped. Defaults to `time.sleep`.
+        """
+        self.deadline = time.monotonic() if start_time is None else start_time
+        while keep_running():
+            step()
+
+            self.deadline += self.interval
+            now = time.monotonic()
+            if self.deadline < now:
+                self.overrun_count += 1
+                self.deadline = now
+            else:
+                sleep(self.deadline - now)
+
+
+@dataclass
+class MotionStep:
+    """
+    A step of a scheduled motion. Steps follow on from each other without a halt
+    unless `pause` is set, then the motion is halted and paused before the step.
+    The `ramp` values are passed to the `ramp_callback` one every `tick` seconds
+    after the step starts, e.g. to accelerate the motors.
+    """
+    duration: Optional[float]
+    start_callback: Optional[Callable] = None
+    pause: bool = True
+    ramp: Sequence[Any] = ()
+    ramp_callback: Optional[Callable] = None
+    tick: float = 0.0
+
+
+class MotionScheduler(object):
+    """
+    Runs timed motions on a single long lived thread, which waits on a condition
+    until the next deadline instead of polling, so a motion is halted the moment
+    its duration is up or it's terminated, and commands don't start threads. A
+    motion is a sequence of steps which replaces the current motion. Steps are
+    started only once `pause_duration` has passed since the last halt, and can ramp
+    values at a fixed tick while they run. The callbacks are run with the
+    scheduler's lock held, so they must be quick, e.g. setting motor pins.
+
+    Args:
+        halt_callback (callable, optional): The function to call when a motion is
+        interrupted or complete.
+        pause_duration (float, optional): The minimum time between a halt and the
+        start of the next step. Defaults to 0.
     """
-    def __init__(self, halt_callback: Optional[Callable] = None) -> None:
-        self.interrupt = False
-        self.active = False
+
+    def __init__(
+        self,
+        halt_callback: Optional[Callable] = None,
+        pause_duration: float = 0.0
+    ) -> None:
         self.halt_callback = halt_callback
+        self.pause_duration = pause_duration
+
+        self.step_index = -1
+        self.step_count = 0
+        self.cancelled = False
+
+        self._condition = threading.Condition()
+        self._steps = collections.deque()
+        self._step = None
+        self._start_time = None
+        self._deadline = None
+        self._running = False
+        self._halted_at = None
+        self._ramp_index = 0
+        self._closed = False
+        self._thread = None
+
+    @property
+    def lock(self) -> threading.Condition:
+        """
+        The reentrant lock held while the callbacks run, to hold while reading the
+        state they change and scheduling from it.
+
+        Returns:
+            threading.Condition: The scheduler's condition
+        """
+        return self._condition
 
-    def delay(self, duration: int) -> None:
+    def _halt(self, now: float) -> None:
+        """
+        Halt the motion, with the lock held.
+        """
+        self._running = False
+        self._halted_at = now
+        if self.halt_callback is not None:
+            self.halt_callback()
+
+    def _start(self) -> None:
+        """
+        Start the current step, with the lock held.
         """
-        Sleep until the duration is up or interrupt if needed. Keeps active
-        state and calls halt_callback prior to returning.
+        self._running = True
+        self._ramp_index = 0
+        if self._step.start_callback is not None:
+            self._step.start_callback()
+
+    def _advance(self, now: float) -> None:
+        """
+        Move on to the next step, halting once there are none left, with the lock
+        held.
 
         Args:
-            duration (int): The duration to sleep for
+            now (float): The time the previous step ended
         """
-        self.active = True
-        count = 0
-        while count < duration * 10:
-            if self.interrupt:
-                self.interrupt = False
-                break
-            time.sleep(0.1)
-            count += 1
-        self.halt_callback()
-        self.active = False
+        if not self._steps:
+            self._step = None
+            self._deadline = None
+            if self._running:
+                self._halt(now)
+            self._condition.notify_all()
+            return
+
+        self._step = self._steps.popleft()
+        self.step_index += 1
+        if self._running and self._step.pause:
+            self._halt(now)
+
+        start_time = now
+        if not self._running and self._halted_at is not None:
+            start_time = max(now, self._halted_at + self.pause_duration)
+
+        self._start_time = start_time
+        self._deadline = (
+            math.inf if self._step.duration is None else start_time + self._step.duration
+        )
+        if start_time <= now:
+            self._start()
+
+    def _run(self) -> None:
+        """
+        Start and advance the steps as their deadlines pass.
+        """
+        with self._condition:
+            while not self._closed:
+                now = time.monotonic()
+                if self._step is not None and not self._running:
+                    if now >= self._start_time:
+                        self._start()
+                        continue
+                    next_time = self._start_time
+                elif self._step is not None:
+                    if now >= self._deadline:
+                        self._advance(now)
+                        continue
+                    next_time = self._deadline
+
+                    # Ramp ticks are kept to the step's start, a late tick skips
+                    # straight to the latest value due
+                    ramp = self._step.ramp
+                    if self._ramp_index < len(ramp):
+                        due = min(
+                            int((now - self._start_time) / self._step.tick), len(ramp)
+                        )
+                        if due > self._ramp_index:
+                            self._ramp_index = due
+                            self._step.ramp_callback(ramp[due - 1])
+                            continue
+                        next_time = min(
+                            next_time,
+                            self._start_time + (self._ramp_index + 1) * self._step.tick
+                        )
+                else:
+                    next_time = None
+
+                timeout = None if next_time in (None, math.inf) else next_time - now
+                self._condition.wait(timeout)
+
+    def schedule(self, steps: List[MotionStep]) -> None:
+        """
+        Schedule a sequence of steps, replacing the current motion. The first step
+        is started straight away unless it has to wait out the pause after a halt.
+
+        Args:
+            steps (list): The steps of the motion
+        """
+        with self._condition:
+            self._steps = collections.deque(steps)
+            self._step = None
+            self.step_index = -1
+            self.step_count = len(steps)
+            self.cancelled = False
+            self._advance(time.monotonic())
+
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='motion-scheduler', daemon=True
+                )
+                self._thread.start()
+            self._condition.notify()
+
+    def async_delay(
+        self,
+        duration: Optional[float],
+        start_callback: Optional[Callable] = None
+    ) -> None:
+        """
+        Schedule a single step motion for a duration, replacing the current motion.
+
+        Args:
+            duration (float, optional): The duration of the motion. Defaults to
+            running until terminated.
+            start_callback (callable, optional): The function to call to start the
+            motion
+        """
+        self.schedule([MotionStep(duration=duration, start_callback=start_callback)])
 
-    def async_delay(self, duration: int) -> None:
+    def delay(self, duration: Optional[float]) -> None:
         """
-        Calls delay in a thread and starts.
+        Schedule a motion for a duration and wait for it to be halted.
 
         Args:
-            duration (int): The duration to sleep for
+            duration (float, optional): The duration of the motion
         """
-        thread = threading.Thread(target=self.delay, args=(duration, ))
-        thread.start()
+        self.async_delay(duration)
+        self.wait()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait for the motion to be complete or terminated.
+
+        Args:
+            timeout (float, optional): Seconds to wait. Defaults to waiting forever.
+
+        Returns:
+            bool: True unless the timeout passed first
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self._step is None, timeout)
 
     def is_active(self) -> bool:
         """
-        Helper to return if the delay is active or not.
+        Helper to return if a motion is scheduled or running.
+
+        Returns:
+            bool: motion is active
+        """
+        return self._step is not None
+
+    def progress(self) -> dict:
+        """
+        The progress through the steps of the motion.
 
         Returns:
-            bool: delay is active
+            dict: The current `step` index, the `steps` count, the seconds `elapsed`
+            in the current step and if the motion was `cancelled`
         """
-        return self.active
+        with self._condition:
+            elapsed = 0.0
+            if self._running:
+                elapsed = time.monotonic() - self._start_time
+            return {
+                'step': self.step_index if self._step is not None else None,
+                'steps': self.step_count,
+                'elapsed': elapsed,
+                'cancelled': self.cancelled,
+            }
 
     def terminate(self) -> None:
         """
-        Sets interrupt in order to terminate the delay.
+        Halt the motion immediately, in the calling thread.
+        """
+        with self._condition:
+            self.cancelled = self._step is not None
+            self._steps.clear()
+            self._step = None
+            self._deadline = None
+            self._halt(time.monotonic())
+            self._condition.notify_all()
+
+    def close(self) -> None:
+        """
+        Terminate the motion and stop the scheduler thread.
+        """
+        self.terminate()
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+class DeviceRegistry(object):
+    """
+    A process wide registry of device instances, created lazily on first use and
+    shared by the API, voice and autonomous modes, so device pins and ports are
+    only set up once and released once on shutdown. Devices are referenced by
+    their class path in the `arnold` package, as in the command map, e.g.
+    `motion.drivetrain.DriveTrain`.
+    """
+
+    # The first of these methods an instance has releases it
+    RELEASE_METHODS = ('release', 'stop')
+
+    def __init__(self) -> None:
+        self._instances = {}
+        self._lock = threading.RLock()
+
+        # Setup logging
+        self._logger = _logger
+
+    def get(self, class_path: str) -> Any:
+        """
+        Get the shared instance of a device, creating it if needed.
+
+        Args:
+            class_path (str): The path to the class, e.g. `sensors.lidar.Lidar`
+
+        Returns:
+            any: The instance
         """
-        self.interrupt = True
+        with self._lock:
+            instance = self._instances.get(class_path)
+            if instance is None:
+                class_path_list = class_path.split('.')
+                module = importlib.import_module(
+                    f'arnold.{".".join(class_path_list[:-1])}'
+                )
+                instance = getattr(module, class_path_list[-1])()
+                self._instances[class_path] = instance
+                self._logger.info(f'Initialised {class_path}.')
+            return instance
+
+    def release(self, class_path: str) -> None:
+        """
+        Release a device and remove it from the registry, so it's created afresh
+        on next use.
+
+        Args:
+            class_path (str): The path to the class
+        """
+        with self._lock:
+            instance = self._instances.pop(class_path, None)
+        if instance is None:
+            return
+
+        for method_name in self.RELEASE_METHODS:
+            release_method = getattr(instance, method_name, None)
+            if callable(release_method):
+                release_method()
+                break
+        self._logger.info(f'Released {class_path}.')
+
+    def release_all(self) -> None:
+        """
+        Release all the devices, in the reverse order they were created.
+        """
+        with self._lock:
+            class_paths = list(self._instances)
+        for class_path in reversed(class_paths):
+            try:
+                self.release(class_path)
+            except Exception as exc:
+                self._logger.warning(f'Failed to release {class_path}: {exc}')
+
+
+registry = DeviceRegistry()
+atexit.register(registry.release_all)
 
 
 class CommandParser(object):
@@ -108,7 +591,7 @@ class CommandParser(object):
         return clean_command.split(' ')
 
     def _get_method(self, class_path: str, method_name: str) -> Tuple[object, Callable]:
-        """Import and initiate the class and return the method.
+        """Get the shared class instance from the registry and return the method.
 
         Args:
             class_path (str): the path to the class
@@ -118,12 +601,7 @@ class CommandParser(object):
             tuple (object, callable): the class instance and method the command
             is calling
         """
-        class_path_list = class_path.split('.')
-        class_name = class_path_list[-1]
-        module_path = '.'.join(class_path_list[:-1])
-        module = importlib.import_module(f'arnold.{module_path}')
-        cls = getattr(module, class_name)
-        instance = cls()
+        instance = registry.get(class_path)
         return instance, getattr(instance, method_name)
 
     def _get_recognised_tokens(self, tokens: List) -> Set: